@@ -6,15 +6,87 @@ load_dotenv()
 
 class Settings(BaseModel):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")
     cohere_api_key: str = os.getenv("COHERE_API_KEY", "")
     qdrant_host: str = os.getenv("QDRANT_HOST", "localhost")
     qdrant_port: int = int(os.getenv("QDRANT_PORT", "6333"))
+    qdrant_grpc_port: int = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    qdrant_prefer_grpc: bool = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "openai")  # openai | local
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
     llm_model: str = os.getenv("LLM_MODEL", "gpt-4o")
-    embedding_dimension: int = 1536
+    embedding_dimension: int = int(os.getenv("EMBEDDING_DIMENSION", "0"))  # 0 = the model's native size
+    local_embedding_model: str = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+    local_embedding_runtime: str = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")  # torch | onnx
+    local_embedding_quantize: bool = os.getenv("LOCAL_EMBEDDING_QUANTIZE", "false").lower() == "true"
+    local_embedding_onnx_file: str = os.getenv("LOCAL_EMBEDDING_ONNX_FILE", "")
+    local_embedding_threads: int = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))  # 0 = torch default
+    local_embedding_batch_size: int = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+    local_embedding_batch_wait_ms: float = float(os.getenv("LOCAL_EMBEDDING_BATCH_WAIT_MS", "2"))
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")  # "" disables
+    embedding_cache_max_entries: int = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    query_embedding_cache_size: int = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+    embedding_batch_tokens: int = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+    embedding_max_in_flight: int = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "4"))
+    embedding_rpm: int = int(os.getenv("EMBEDDING_RPM", "3000"))  # 0 = unlimited
+    embedding_tpm: int = int(os.getenv("EMBEDDING_TPM", "1000000"))  # 0 = unlimited
+    pdf_table_engine: str = os.getenv("PDF_TABLE_ENGINE", "pdfplumber")  # pdfplumber | pymupdf
+    pdf_parse_workers: int = int(os.getenv("PDF_PARSE_WORKERS", "0"))  # >1 parses large PDFs in page ranges
     chunk_size: int = int(os.getenv("CHUNK_SIZE", "512"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "50"))
+    ingest_manifest_path: str = os.getenv("INGEST_MANIFEST_PATH", "data/ingest_manifest.json")
+    # Text and metadata of every chunk, addressed by the integer ids the vector and BM25 indexes store
+    chunk_store_path: str = os.getenv("CHUNK_STORE_PATH", "data/chunks.seg")
+    vector_backend: str = os.getenv("VECTOR_BACKEND", "qdrant")  # qdrant | embedded (in-process, no server)
+    embedded_index_path: str = os.getenv("EMBEDDED_INDEX_PATH", "data/vector_index")
+    embedded_index_dtype: str = os.getenv("EMBEDDED_INDEX_DTYPE", "float16")  # float16 | int8
+    # Live vectors at which the embedded index adds an HNSW graph; below it exact search is fast enough
+    embedded_hnsw_threshold: int = int(os.getenv("EMBEDDED_HNSW_THRESHOLD", "20000"))
+    embedded_hnsw_ef: int = int(os.getenv("EMBEDDED_HNSW_EF", "128"))
+    # float32 copies of index blocks kept for exact search; 0 converts from the mapped file on every query
+    embedded_index_cache_mb: int = int(os.getenv("EMBEDDED_INDEX_CACHE_MB", "256"))
     collection_name: str = "documents"
+    hnsw_payload_m: int = int(os.getenv("HNSW_PAYLOAD_M", "16"))
+    # Qdrant collection profile, applied when the collection is created
+    hnsw_m: int = int(os.getenv("HNSW_M", "16"))
+    hnsw_ef_construct: int = int(os.getenv("HNSW_EF_CONSTRUCT", "128"))
+    hnsw_ef: int = int(os.getenv("HNSW_EF", "128"))  # per-query beam width; 0 = Qdrant's default
+    qdrant_quantization: str = os.getenv("QDRANT_QUANTIZATION", "none")  # none | scalar | binary (opt-in: trades recall for RAM)
+    # Quantized candidates fetched per result, then rescored against the original vectors
+    qdrant_oversampling: float = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+    qdrant_rescore: bool = os.getenv("QDRANT_RESCORE", "true").lower() == "true"
+    # Original vectors on disk, quantized copies in RAM: memory drops ~4x (scalar) or ~32x (binary)
+    qdrant_on_disk: bool = os.getenv("QDRANT_ON_DISK", "false").lower() == "true"
+    # Two-stage search: a truncated, re-normalized "coarse" vector of this size is searched for candidates,
+    # which the "full" vector (kept on disk, no graph) rescores. 0 = single-stage on the full vector.
+    # Only meaningful for Matryoshka-trained models such as text-embedding-3.
+    matryoshka_dimension: int = int(os.getenv("MATRYOSHKA_DIMENSION", "0"))
+    matryoshka_candidates: int = int(os.getenv("MATRYOSHKA_CANDIDATES", "10"))  # coarse candidates per result
+    hybrid_leg_timeout_ms: float = float(os.getenv("HYBRID_LEG_TIMEOUT_MS", "2000"))
+    hybrid_workers: int = int(os.getenv("HYBRID_WORKERS", "16"))
+    rerank_backend: str = os.getenv("RERANK_BACKEND", "none")  # none | local | cohere
+    cohere_rerank_model: str = os.getenv("COHERE_RERANK_MODEL", "rerank-english-v3.0")
+    local_rerank_model: str = os.getenv("LOCAL_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    rerank_batch_tokens: int = int(os.getenv("RERANK_BATCH_TOKENS", "8192"))  # padded tokens per forward pass
+    rerank_cache_size: int = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+    rerank_round_size: int = int(os.getenv("RERANK_ROUND_SIZE", "10"))
+    rerank_early_stop: bool = os.getenv("RERANK_EARLY_STOP", "false").lower() == "true"
+    answer_cache_size: int = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))  # 0 disables
+    answer_cache_ttl_s: float = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+    # Cosine similarity for reusing the answer to a differently worded question; 0 = exact matches only
+    answer_cache_semantic_threshold: float = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
+    # Prompt context size, in TextPreprocessor tokens, that retrieved chunks are packed into
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    # Requests each API endpoint runs at once; beyond that it answers 429 instead of queueing
+    api_query_concurrency: int = int(os.getenv("API_QUERY_CONCURRENCY", "32"))
+    api_stream_concurrency: int = int(os.getenv("API_STREAM_CONCURRENCY", "64"))
+    api_ingest_concurrency: int = int(os.getenv("API_INGEST_CONCURRENCY", "1"))
+    api_delete_concurrency: int = int(os.getenv("API_DELETE_CONCURRENCY", "4"))
+    upload_dir: str = os.getenv("UPLOAD_DIR", "data/uploads")
+    # Per-stage spans and latency histograms (app/tracing.py); off costs an attribute check per stage
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+    # Finished traces are appended here as OTLP/JSON lines, one per trace; "" keeps them in memory only
+    trace_export_path: str = os.getenv("TRACE_EXPORT_PATH", "")
     top_k_retrieval: int = 20
     top_k_rerank: int = 5
 
@@ -1,8 +1,21 @@
+from collections import Counter
 from dataclasses import dataclass
+from itertools import accumulate, islice
+from typing import Iterable, Iterator
+from app import tracing
 from app.ingestion.parser import DocumentBlock, ParsedDocument, BlockType
-import re
+import hashlib, re, uuid
 from app.ingestion.preprocessor import TextPreprocessor
 
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1d3c52-8a0e-4b7e-9c21-5d4f0b8e2a17")
+
+
+def make_chunk_id(doc_id: str, text: str, occurrence: int = 0) -> str:
+    # Same document + same text -> same Qdrant point id; occurrence separates repeated passages
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{doc_id}\0{digest}\0{occurrence}"))
+
+
 @dataclass
 class Chunk:
     text: str
@@ -13,6 +26,7 @@ class Chunk:
     parent_section: str = ""
     chunk_type: str = "paragraph"
     token_count: int = 0
+    chunk_id: str = ""
 
 
     def to_dict(self) -> dict:
@@ -21,6 +35,7 @@ class Chunk:
             "chunk_index": self.chunk_index, "page_number": self.page_number,
             "section_title": self.section_title, "parent_section": self.parent_section,
             "chunk_type": self.chunk_type, "token_count": self.token_count,
+            "chunk_id": self.chunk_id,
         }
 
 
@@ -30,55 +45,39 @@ class StructureAwareChunker:
         self.min_chunk_tokens = 50
         self.overlap_tokens = overlap_tokens
         self.preprocessor = TextPreprocessor()
+        self.count_batch_size = 64  # blocks counted per tokenizer call while streaming
 
 
+    @tracing.traced("StructureAwareChunker.chunk_document")
     def chunk_document(self, doc: ParsedDocument) -> list[Chunk]:
-        chunks = []
-        chunk_idx = 0
-        sections = self._group_by_section(doc.blocks)
+        return list(self.iter_chunks(doc.blocks, doc.doc_id))
 
 
-        for section_title, blocks in sections:
-            for block in blocks:
-                if block.block_type == BlockType.TABLE:
+    def iter_chunks(self, blocks: Iterable[DocumentBlock], doc_id: str) -> Iterator[Chunk]:
+        # Streams over blocks as the parser yields them; output is identical to chunk_document
+        occurrences = Counter()
+        for idx, chunk in enumerate(self._merge_small_chunks(self._split_blocks(blocks, doc_id))):
+            chunk.chunk_index = idx
+            chunk.chunk_id = make_chunk_id(doc_id, chunk.text, occurrences[chunk.text])
+            occurrences[chunk.text] += 1
+            yield chunk
+
+
+    def _split_blocks(self, blocks: Iterable[DocumentBlock], doc_id: str) -> Iterator[Chunk]:
+        blocks = iter(blocks)
+        # Each block is tokenized once, a small group at a time so streaming isn't held up
+        while group := list(islice(blocks, self.count_batch_size)):
+            counts = self.preprocessor.count_tokens_batch([block.content for block in group])
+            for block, token_count in zip(group, counts):
+                if block.block_type == BlockType.TABLE or token_count <= self.max_tokens:
                     # Tables always stay as single chunks
-                    chunks.append(self._make_chunk(block, doc.doc_id, chunk_idx))
-                    chunk_idx += 1
-                elif self.preprocessor.count_tokens(block.content) <= self.max_tokens:
-                    chunks.append(self._make_chunk(block, doc.doc_id, chunk_idx))
-                    chunk_idx += 1
+                    yield self._make_chunk(block, doc_id, -1, token_count)
                 else:
                     # Split large blocks at sentence boundaries
-                    for sub in self._split_with_overlap(block, doc.doc_id):
-                        sub.chunk_index = chunk_idx
-                        chunks.append(sub)
-                        chunk_idx += 1
-
+                    yield from self._split_with_overlap(block, doc_id)
 
-        chunks = self._merge_small_chunks(chunks)
-        return chunks
-    
-    def _group_by_section(self, blocks: list[DocumentBlock]) -> list[tuple[str, list[DocumentBlock]]]:
-        sections = []
-        current_section = ""
-        current_blocks = []
 
-
-        for block in blocks:
-            if block.block_type == BlockType.HEADING:
-                if current_blocks:
-                    sections.append((current_section, current_blocks))
-                current_section = block.content.strip()
-                current_blocks = [block]
-            else:
-                current_blocks.append(block)
-
-
-        if current_blocks:
-            sections.append((current_section, current_blocks))
-        return sections
-    
-    def _make_chunk(self, block: DocumentBlock, doc_id: str, chunk_idx: int) -> Chunk:
+    def _make_chunk(self, block: DocumentBlock, doc_id: str, chunk_idx: int, token_count: int = None) -> Chunk:
         return Chunk(
             text=block.content,
             doc_id=doc_id,
@@ -87,106 +86,71 @@ class StructureAwareChunker:
             section_title=block.section_title,
             parent_section=block.parent_section,
             chunk_type=block.block_type.value,
-            token_count=self.preprocessor.count_tokens(block.content)
+            token_count=self.preprocessor.count_tokens(block.content) if token_count is None else token_count
         )
     
     def _split_with_overlap(self, block: DocumentBlock, doc_id: str) -> list[Chunk]:
         sentences = re.split(r'(?<=[.!?]) +', block.content)
-        chunks = []
-        current_sentences = []
-        current_tokens = 0
-
-        for sentence in sentences:
-            sentence_tokens = self.preprocessor.count_tokens(sentence)
-
-            if current_tokens + sentence_tokens > self.max_tokens and current_sentences:
-                # Save current chunk
-                chunk_text = " ".join(current_sentences)
-                chunks.append(Chunk(
-                    text=chunk_text.strip(),
-                    doc_id=doc_id,
-                    chunk_index=-1,
-                    page_number=block.page_number,
-                    section_title=block.section_title,
-                    parent_section=block.parent_section,
-                    chunk_type=block.block_type.value,
-                    token_count=self.preprocessor.count_tokens(chunk_text)
-                ))
-
-                # Build overlap from previous sentences
-                overlap_sentences = []
-                overlap_tokens = 0
-                for s in reversed(current_sentences):
-                    s_tokens = self.preprocessor.count_tokens(s)
-                    if overlap_tokens + s_tokens > self.overlap_tokens:
-                        break
-                    overlap_sentences.insert(0, s)
-                    overlap_tokens += s_tokens
-
-                current_sentences = overlap_sentences
-                current_tokens = overlap_tokens
-
-            current_sentences.append(sentence)
-            current_tokens += sentence_tokens
-
-        # Don't forget the last chunk
-        if current_sentences:
-            chunk_text = " ".join(current_sentences)
-            chunks.append(Chunk(
-                text=chunk_text.strip(),
+        # Sentences are tokenized once, bare and with the joining space. Splits only ever happen after
+        # sentence-final punctuation, so a chunk's count is its first bare count plus the rest spaced.
+        counts = self.preprocessor.count_tokens_batch(sentences + [" " + s for s in sentences[1:]])
+        bare, spaced = counts[:len(sentences)], [0] + counts[len(sentences):]
+        spaced_prefix = list(accumulate(spaced, initial=0))
+
+        def make(start, end):
+            return Chunk(
+                text=" ".join(sentences[start:end]).strip(),
                 doc_id=doc_id,
                 chunk_index=-1,
                 page_number=block.page_number,
                 section_title=block.section_title,
                 parent_section=block.parent_section,
                 chunk_type=block.block_type.value,
-                token_count=self.preprocessor.count_tokens(chunk_text)
-            ))
+                token_count=bare[start] + spaced_prefix[end] - spaced_prefix[start + 1]
+            )
+
+        # The current chunk is always the sentence range [start, i)
+        chunks, start, current_tokens = [], 0, 0
+        for i, sentence_tokens in enumerate(bare):
+            if current_tokens + sentence_tokens > self.max_tokens and i > start:
+                chunks.append(make(start, i))
+
+                # Build overlap from previous sentences
+                overlap_start, overlap_tokens = i, 0
+                while overlap_start > start and overlap_tokens + bare[overlap_start - 1] <= self.overlap_tokens:
+                    overlap_start -= 1
+                    overlap_tokens += bare[overlap_start]
+                start, current_tokens = overlap_start, overlap_tokens
+
+            current_tokens += sentence_tokens
 
+        # Don't forget the last chunk
+        chunks.append(make(start, len(sentences)))
         return chunks
-    
-    def _merge_small_chunks(self, chunks: list[Chunk]) -> list[Chunk]:
-        if not chunks or len(chunks) == 1:
-            return chunks
-        
-        merged_chunks = []
-        curr_buffer = [chunks[0]]
-        curr_tokens = chunks[0].token_count
-        curr_chunk_type = chunks[0].chunk_type
-        curr_section = chunks[0].section_title
-
-        for chunk in chunks[1:]:
+
+
+    def _merge_small_chunks(self, chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+        # Only the current buffer is held, so merging works on a stream; chunk_index is set by the caller
+        curr_buffer, curr_tokens = [], 0
+
+        for chunk in chunks:
             curr_chunk_tokens = chunk.token_count
-            if (chunk.chunk_type != curr_chunk_type 
-                or chunk.section_title != curr_section 
+            if curr_buffer and (chunk.chunk_type != curr_buffer[0].chunk_type
+                or chunk.section_title != curr_buffer[0].section_title
                 or curr_tokens + curr_chunk_tokens > self.max_tokens
                 or (curr_tokens >= self.min_chunk_tokens and curr_chunk_tokens >= self.min_chunk_tokens)):
-                # create merged chunk
-                merged_text = " ".join(c.text for c in curr_buffer)
-                merged_tokens = sum(c.token_count for c in curr_buffer)
-                new_chunk = curr_buffer[0]
-                new_chunk.text = merged_text
-                new_chunk.token_count = merged_tokens
-                merged_chunks.append(new_chunk)
-                curr_buffer = [chunk]
-                curr_tokens = curr_chunk_tokens
-                curr_chunk_type = chunk.chunk_type
-                curr_section = chunk.section_title
-            else:
-                curr_buffer.append(chunk)
-                curr_tokens += curr_chunk_tokens
-        
+                yield self._flush(curr_buffer)
+                curr_buffer, curr_tokens = [], 0
+            curr_buffer.append(chunk)
+            curr_tokens += curr_chunk_tokens
+
         if curr_buffer:
-            merged_text = " ".join(c.text for c in curr_buffer)
-            merged_tokens = sum(c.token_count for c in curr_buffer)
-            new_chunk = curr_buffer[0]
-            new_chunk.text = merged_text
-            new_chunk.token_count = merged_tokens
-            merged_chunks.append(new_chunk)
-
-        # Reindex the merged chunks
-        for idx, chunk in enumerate(merged_chunks):
-            chunk.chunk_index = idx
+            yield self._flush(curr_buffer)
+
 
-        return merged_chunks
-                
+    def _flush(self, buffer: list[Chunk]) -> Chunk:
+        new_chunk = buffer[0]
+        if len(buffer) > 1:
+            new_chunk.text = " ".join(c.text for c in buffer)
+            new_chunk.token_count = sum(c.token_count for c in buffer)
+        return new_chunk
@@ -0,0 +1,66 @@
+import hashlib, json, os, threading
+from loguru import logger
+from app.config import settings
+
+
+def file_fingerprint(file_path: str, *params) -> str:
+    # File bytes plus the chunking parameters: changing either changes the chunks
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(json.dumps(params).encode())
+    return h.hexdigest()
+
+
+def payload_hash(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class IngestManifest:
+    """What each document looked like at its last successful ingest.
+
+    doc_id -> {"path", "fingerprint", "embedding", "chunks": {chunk_id: payload hash}}
+    """
+
+    version = 2  # 2: indexes keyed by chunk store ids; older ingests are redone so UUID points are replaced
+
+    def __init__(self, path=None):
+        self.path = settings.ingest_manifest_path if path is None else path
+        self.documents = {}
+        self._lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.documents = data["documents"]
+            else:
+                logger.warning(f"Ignoring {self.path}: manifest version {data.get('version')}")
+
+
+    def get(self, doc_id: str) -> dict | None:
+        with self._lock:
+            return self.documents.get(doc_id)
+
+
+    def set(self, doc_id: str, entry: dict):
+        with self._lock:
+            self.documents[doc_id] = entry
+
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self.documents.pop(doc_id, None)
+
+
+    def save(self):
+        if not self.path: return
+        with self._lock:
+            data = json.dumps({"version": self.version, "documents": self.documents})
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
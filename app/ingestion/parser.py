@@ -1,11 +1,16 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional
-import fitz  # PyMuPDF
-import pdfplumber
-from docx import Document
+from typing import Iterator, Optional
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from loguru import logger
+import multiprocessing
+
+from app import tracing
+from app.config import settings
+
+# The format libraries (PyMuPDF, pdfplumber, python-docx) are imported by the parser that needs them,
+# so a process that only handles one format, or none, doesn't pay for the others
 
 
 class BlockType(Enum):
@@ -40,13 +45,24 @@ class DOCXParser:
         pass
 
     def parse(self, file_path: str, doc_id: str) -> ParsedDocument:
-        # Placeholder for DOCX parsing logic
         logger.info(f"Parsing {file_path}")
+        from docx import Document
         doc = ParsedDocument(doc_id=doc_id, filename=file_path)
         docx_doc = Document(file_path)
         doc.title = docx_doc.core_properties.title or ""
         doc.author = docx_doc.core_properties.author or ""
+        doc.blocks = list(self._iter_blocks(docx_doc))
+        logger.info(f"Parsed {len(doc.blocks)} blocks from {file_path}")
+        return doc
+
+
+    def iter_blocks(self, file_path: str) -> Iterator[DocumentBlock]:
+        from docx import Document
+        logger.info(f"Streaming {file_path}")
+        yield from self._iter_blocks(Document(file_path))
+
 
+    def _iter_blocks(self, docx_doc) -> Iterator[DocumentBlock]:
         current_section, parent_section = "", ""
 
         for para in docx_doc.paragraphs:
@@ -59,32 +75,32 @@ class DOCXParser:
                 if int(style.replace("heading", "").strip()) <= 2:
                     parent_section = current_section
 
-                doc.blocks.append(DocumentBlock(
+                yield DocumentBlock(
                     content=text,
                     block_type=BlockType.HEADING,
                     page_number=0,  # DOCX doesn't have pages, can be set to 0 or estimated
                     section_title=current_section,
                     parent_section=parent_section,
                     metadata={"style": style}
-                ))
+                )
             elif style.startswith("list"):
-                doc.blocks.append(DocumentBlock(
+                yield DocumentBlock(
                     content=text,
                     block_type=BlockType.LIST_ITEM,
                     page_number=0,
                     section_title=current_section,
                     parent_section=parent_section,
                     metadata={"style": style}
-                ))
+                )
             else:
-                doc.blocks.append(DocumentBlock(
+                yield DocumentBlock(
                     content=text,
                     block_type=BlockType.PARAGRAPH,
                     page_number=0,
                     section_title=current_section,
                     parent_section=parent_section,
                     metadata={"style": style}
-                ))
+                )
 
         for table in docx_doc.tables:
             rows = []
@@ -98,63 +114,177 @@ class DOCXParser:
 
             table_text = "\n".join(["\t".join(cells) for cells in rows])
 
-            doc.blocks.append(DocumentBlock(
+            yield DocumentBlock(
                 content=table_text,
                 block_type=BlockType.TABLE,
                 page_number=0,
                 section_title=current_section,  # Don't leave these empty!
                 parent_section=parent_section,
                 metadata={"num_rows": len(rows) - 1, "num_cols": len(rows[0])}
-            ))
+            )
 
-    
+
+
+def _extract_page_range(file_path: str, start: int, end: int, heading_threshold: float,
+                        table_engine: str) -> list[list[tuple]]:
+    # Process-pool entry point for PDFParser's parallel mode
+    import fitz
+    parser = PDFParser(parallel_workers=0, table_engine=table_engine)
+    parser.heading_font_size_threshold = heading_threshold
+    with fitz.open(file_path) as pdf:
+        return list(parser._iter_pages(file_path, pdf, start, end))
 
 
 class PDFParser:
-    def __init__(self):
+    def __init__(self, parallel_workers=None, parallel_min_pages=200, table_engine=None):
         self.heading_font_size_threshold = 14
+        # pdfplumber's finder is ~2.5x faster per page than PyMuPDF 1.24's find_tables on our filings
+        self.table_engine = table_engine or settings.pdf_table_engine
+        # Very large PDFs can be split into page ranges parsed in separate processes
+        self.parallel_workers = settings.pdf_parse_workers if parallel_workers is None else parallel_workers
+        self.parallel_min_pages = parallel_min_pages
 
 
     def parse(self, file_path: str, doc_id: str) -> ParsedDocument:
+        import fitz  # PyMuPDF
         logger.info(f"Parsing {file_path}")
         doc = ParsedDocument(doc_id=doc_id, filename=file_path)
-        pdf = fitz.open(file_path)
-        doc.total_pages = len(pdf)
-        doc.title = pdf.metadata.get("title", "") or ""
-        doc.author = pdf.metadata.get("author", "") or ""
+        with fitz.open(file_path) as pdf:
+            doc.total_pages = len(pdf)
+            doc.title = pdf.metadata.get("title", "") or ""
+            doc.author = pdf.metadata.get("author", "") or ""
+            doc.blocks = list(self._iter_blocks(file_path, pdf))
+        logger.info(f"Parsed {len(doc.blocks)} blocks from {doc.total_pages} pages")
+        return doc
 
 
-        current_section, parent_section = "", ""
+    def iter_blocks(self, file_path: str) -> Iterator[DocumentBlock]:
+        # Yields blocks page by page; only the current page is held in memory
+        import fitz
+        logger.info(f"Streaming {file_path}")
+        with fitz.open(file_path) as pdf:
+            yield from self._iter_blocks(file_path, pdf)
+
+
+    def _iter_blocks(self, file_path: str, pdf) -> Iterator[DocumentBlock]:
+        if self.parallel_workers > 1 and len(pdf) >= self.parallel_min_pages:
+            pages = self._iter_parallel(file_path, len(pdf))
+        else:
+            pages = self._iter_pages(file_path, pdf, 0, len(pdf))
 
 
-        for page_num in range(len(pdf)):
-            page = pdf[page_num]
-            blocks = page.get_text("dict")["blocks"]
-            for block in blocks:
-                if block["type"] != 0: continue  # Skip non-text
-                block_text, block_type, font_size = self._classify_block(block)
-                if not block_text.strip(): continue
+        current_section, parent_section = "", ""
 
 
+        for page_num, items in enumerate(pages, 1):
+            for block_text, block_type, font_size in items:
+                block_type = BlockType(block_type)
                 if block_type == BlockType.HEADING:
                     if font_size > 18:
-                        parent_section = block_text.strip()
-                    current_section = block_text.strip()
+                        parent_section = block_text
+                    current_section = block_text
 
 
-                doc.blocks.append(DocumentBlock(
-                    content=block_text.strip(),
+                yield DocumentBlock(
+                    content=block_text,
                     block_type=block_type,
-                    page_number=page_num + 1,
+                    page_number=page_num,
                     section_title=current_section,
                     parent_section=parent_section,
-                    metadata={"font_size": font_size}
-                ))
-        pdf.close()
-        self._extract_tables(file_path, doc)
-        logger.info(f"Parsed {len(doc.blocks)} blocks from {doc.total_pages} pages")
-        return doc
-    
+                    metadata={"font_size": font_size} if block_type != BlockType.TABLE else {}
+                )
+
+
+    def _iter_parallel(self, file_path: str, n_pages: int) -> Iterator[list[tuple]]:
+        step = -(-n_pages // self.parallel_workers)
+        ranges = [(start, min(start + step, n_pages)) for start in range(0, n_pages, step)]
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(len(ranges), mp_context=context) as pool:
+            # map() returns ranges in order, so earlier pages are yielded while later ones still parse
+            parts = pool.map(_extract_page_range, *zip(*[(file_path, s, e, self.heading_font_size_threshold,
+                                                          self.table_engine) for s, e in ranges]))
+            for part in parts:
+                yield from part
+
+
+    def _iter_pages(self, file_path: str, pdf, start: int, end: int) -> Iterator[list[tuple]]:
+        # One pass per page: text blocks and tables together, as (text, block type value, font size) in reading order
+        plumber = None
+        try:
+            for page_num in range(start, end):
+                page = pdf[page_num]
+                tables = self._find_tables(page) if self.table_engine == "pymupdf" else []
+                if tables is None or (self.table_engine == "pdfplumber" and self._has_ruling(page)):
+                    # Only pages that can hold a table pay for pdfplumber, and the file is opened once
+                    if plumber is None:
+                        import pdfplumber
+                        plumber = pdfplumber.open(file_path)
+                    plumber_page = plumber.pages[page_num]
+                    tables = [(t.bbox, self._table_text(t.extract())) for t in plumber_page.find_tables()]
+                    plumber_page.close()  # drop pdfplumber's per-page object cache
+                yield self._page_items(page, tables)
+        finally:
+            if plumber is not None: plumber.close()
+
+
+    def _find_tables(self, page) -> list[tuple[tuple, str]] | None:
+        if not self._has_ruling(page): return []
+        try:
+            return [(t.bbox, self._table_text(t.extract())) for t in page.find_tables().tables]
+        except Exception as e:
+            logger.warning(f"PyMuPDF table detection failed on page {page.number + 1}, using pdfplumber: {e}")
+            return None
+
+
+    def _has_ruling(self, page) -> bool:
+        # Line-based table detection needs at least two horizontal and two vertical edges;
+        # most pages only have a header rule, so this skips the expensive detection for them
+        import fitz
+        horizontal = vertical = 0
+        for drawing in page.get_cdrawings():
+            for item in drawing["items"]:
+                if item[0] == "l":
+                    (x0, y0), (x1, y1) = item[1], item[2]
+                    if abs(y0 - y1) < 1 and abs(x0 - x1) >= 1: horizontal += 1
+                    elif abs(x0 - x1) < 1 and abs(y0 - y1) >= 1: vertical += 1
+                elif item[0] == "re":
+                    rect = fitz.Rect(item[1])
+                    if rect.height < 2 and rect.width >= 2: horizontal += 1
+                    elif rect.width < 2 and rect.height >= 2: vertical += 1
+                    elif rect.width >= 2 and rect.height >= 2: horizontal, vertical = horizontal + 2, vertical + 2
+                elif item[0] == "qu":
+                    horizontal, vertical = horizontal + 2, vertical + 2
+                if horizontal >= 2 and vertical >= 2: return True
+        return False
+
+
+    def _table_text(self, table) -> str:
+        return "\n".join(["\t".join(str(cell or "").strip() for cell in row) for row in table if any(row)])
+
+
+    def _page_items(self, page, tables) -> list[tuple]:
+        text_items = []
+        for block in page.get_text("dict")["blocks"]:
+            if block["type"] != 0: continue  # Skip non-text
+            # Text inside a table's area is already part of that table block
+            x0, y0, x1, y1 = block["bbox"]
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            if any(tx0 <= cx <= tx1 and ty0 <= cy <= ty1 for (tx0, ty0, tx1, ty1), _ in tables): continue
+            block_text, block_type, font_size = self._classify_block(block)
+            if not block_text.strip(): continue
+            text_items.append((y0, (block_text.strip(), block_type.value, font_size)))
+
+        # Place each table before the first text block that starts below its top edge
+        items, tables = [], sorted((bbox[1], text) for bbox, text in tables if text)
+        next_table = 0
+        for y0, item in text_items:
+            while next_table < len(tables) and tables[next_table][0] <= y0:
+                items.append((tables[next_table][1], BlockType.TABLE.value, 0.0))
+                next_table += 1
+            items.append(item)
+        items.extend((text, BlockType.TABLE.value, 0.0) for _, text in tables[next_table:])
+        return items
+
     def _classify_block(self, block) -> tuple[str, BlockType, float]:
         text_parts = []
         total_font_size = 0
@@ -178,21 +308,6 @@ class PDFParser:
         elif block_text.strip().startswith(("•", "-", "–", "1.", "2.", "3.")):
             return block_text, BlockType.LIST_ITEM, avg_font_size
         return block_text, BlockType.PARAGRAPH, avg_font_size
-    
-    def _extract_tables(self, file_path: str, doc: ParsedDocument):
-        with pdfplumber.open(file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                tables = page.extract_tables()
-                for table in tables:
-                    table_text = "\n".join(["\t".join(str(cell or "").strip() for cell in row)
-                                            for row in table if any(row)])
-                    doc.blocks.append(DocumentBlock(
-                        content=table_text,
-                        block_type=BlockType.TABLE,
-                        page_number=page_num + 1,
-                        section_title="",
-                        parent_section=""
-                    ))
 
 
 
@@ -202,9 +317,18 @@ class DocumentParser:
         self.docx_parser = DOCXParser()
 
 
+    @tracing.traced("DocumentParser.parse")
     def parse(self, file_path: str, doc_id: str) -> ParsedDocument:
+        return self._parser_for(file_path).parse(file_path, doc_id)
+
+
+    def iter_blocks(self, file_path: str) -> Iterator[DocumentBlock]:
+        return self._parser_for(file_path).iter_blocks(file_path)
+
+
+    def _parser_for(self, file_path: str):
         ext = Path(file_path).suffix.lower()
-        if ext == ".pdf": return self.pdf_parser.parse(file_path, doc_id)
-        elif ext in (".docx", ".doc"): return self.docx_parser.parse(file_path, doc_id)
+        if ext == ".pdf": return self.pdf_parser
+        elif ext in (".docx", ".doc"): return self.docx_parser
         else: raise ValueError(f"Unsupported: {ext}")
 
@@ -0,0 +1,327 @@
+"""Bulk ingestion: parse and chunk in a process pool, embed and upsert concurrently.
+
+Re-ingesting is incremental: unchanged files are skipped, and for changed files only new chunks
+are embedded while stale ones are removed from both stores.
+
+    python -m app.ingestion.pipeline data/sample_docs --prune
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse, multiprocessing, os, queue, threading, time
+from loguru import logger
+
+from app import tracing
+from app.config import settings
+from app.ingestion.manifest import IngestManifest, file_fingerprint, payload_hash
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".doc")
+_STOP = object()
+
+# Per-process parser, chunker and output queue, created once by the pool initializer
+_parser = _chunker = _out_q = None
+
+
+def _init_worker(max_tokens, overlap_tokens, out_q):
+    global _parser, _chunker, _out_q
+    from app.ingestion.chunker import StructureAwareChunker
+    from app.ingestion.parser import DocumentParser
+    _parser = DocumentParser()
+    _chunker = StructureAwareChunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    _out_q = out_q
+
+
+def _parse_and_chunk(file_path: str, doc_id: str, batch_size: int, known: dict | None):
+    """Streams chunks that need embedding; returns every chunk's payload hash, the moved chunks and the time taken.
+
+    known maps chunk_id -> payload hash from the last ingest (None sends everything). A known id with a
+    different hash is the same text at a new position: it needs a payload update, not an embedding.
+    """
+    batch, hashes, moved, start = [], {}, [], time.perf_counter()
+    # Chunk batches go out as soon as they fill, so embedding starts while the rest of the document parses
+    for chunk in _chunker.iter_chunks(_parser.iter_blocks(file_path), doc_id):
+        hashes[chunk.chunk_id] = payload_hash(chunk.to_dict())
+        if known is None or chunk.chunk_id not in known:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                _out_q.put(batch)
+                batch = []
+        elif known[chunk.chunk_id] != hashes[chunk.chunk_id]:
+            moved.append(chunk)
+    if batch:
+        _out_q.put(batch)
+    return hashes, moved, time.perf_counter() - start
+
+
+@dataclass
+class IngestionStats:
+    docs: int = 0
+    chunks: int = 0  # chunks embedded and upserted
+    skipped: int = 0  # documents unchanged since the last ingest
+    unchanged_chunks: int = 0
+    moved_chunks: int = 0  # same text at a new position, payload rewritten
+    deleted_chunks: int = 0
+    failed: list[str] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def docs_per_sec(self):
+        return self.docs / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def chunks_per_sec(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+
+class IngestionPipeline:
+    def __init__(self, vector_store=None, bm25_store=None, parse_workers=None, embed_workers=4,
+                 upsert_workers=2, batch_size=256, queue_size=8, manifest=None):
+        if vector_store is None:
+            from app.retrieval.vector_store import create_vector_store
+            vector_store = create_vector_store()
+        if bm25_store is None:
+            from app.retrieval.bm25_store import BM25Store
+            bm25_store = BM25Store()
+            bm25_store.load()
+        if getattr(vector_store, "chunks", None) is not getattr(bm25_store, "chunks", None):
+            raise ValueError("The vector and BM25 stores must share one chunk store")
+        self.vector_store = vector_store
+        self.bm25_store = bm25_store
+        self.manifest = manifest if manifest is not None else IngestManifest()
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._stats_lock = threading.Lock()
+
+
+    def ingest_directory(self, directory: str, prune=False) -> IngestionStats:
+        # The doc_id is the path under directory without its suffix, so a/report.pdf and b/report.pdf stay apart
+        files = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in SUPPORTED_EXTENSIONS)
+        documents = [(str(f), f.relative_to(directory).with_suffix("").as_posix()) for f in files]
+        if prune:
+            # Documents ingested from this directory whose files are gone
+            root, present = Path(directory).resolve(), {doc_id for _, doc_id in documents}
+            for doc_id, entry in list(self.manifest.documents.items()):
+                if doc_id not in present and Path(entry["path"]).resolve().is_relative_to(root):
+                    logger.info(f"Removing {doc_id}: {entry['path']} no longer exists")
+                    self.remove_document(doc_id)
+        return self.ingest(documents)
+
+
+    def remove_document(self, doc_id: str):
+        self.vector_store.delete_document(doc_id)
+        self.bm25_store.delete_document(doc_id)
+        self.manifest.remove(doc_id)
+
+
+    def ingest(self, documents: list[tuple[str, str]]) -> IngestionStats:
+        """Ingest (file_path, doc_id) pairs; returns throughput stats."""
+        first = {}
+        for file_path, doc_id in documents:
+            # Two files under one doc_id would each replace the other's chunks
+            if first.setdefault(doc_id, file_path) != file_path:
+                raise ValueError(f"{first[doc_id]} and {file_path} would both be ingested as {doc_id}")
+        with tracing.span("IngestionPipeline.ingest", documents=len(documents)) as span:
+            stats = self._ingest(documents)
+            span.set(docs=stats.docs, chunks=stats.chunks, skipped=stats.skipped)
+        return stats
+
+
+    def _ingest(self, documents):
+        stats = IngestionStats()
+        updates = {}  # manifest entries, recorded only once the whole run has been indexed
+        upserted = {}  # doc_id -> chunk ids upserted this run, to undo for documents that then fail
+        # Bounded queues give backpressure: parsing pauses when embedding falls behind, and so on
+        embed_q, upsert_q = queue.Queue(self.queue_size), queue.Queue(self.queue_size)
+        errors = []
+        # Bound to the ingest span, so embed and upsert spans from these threads join its trace
+        embed_loop, upsert_loop = tracing.bind(self._embed_loop), tracing.bind(self._upsert_loop)
+        embedders = [threading.Thread(target=embed_loop, args=(embed_q, upsert_q, errors), daemon=True)
+                     for _ in range(self.embed_workers)]
+        upserters = [threading.Thread(target=upsert_loop, args=(upsert_q, stats, errors, upserted), daemon=True)
+                     for _ in range(self.upsert_workers)]
+        for t in embedders + upserters: t.start()
+
+        try:
+            try:
+                self._parse_stage(documents, embed_q, stats, errors, updates)
+            finally:
+                for _ in embedders: embed_q.put(_STOP)
+                for t in embedders: t.join()
+                for _ in upserters: upsert_q.put(_STOP)
+                for t in upserters: t.join()
+            for file_path, doc_id in documents:
+                if file_path in stats.failed:
+                    self._discard_failed(file_path, doc_id, upserted.get(doc_id, ()))
+            if errors:
+                raise errors[0]
+            for doc_id, entry in updates.items():
+                self.manifest.set(doc_id, entry)
+        finally:
+            # Points already in the vector store are persisted even when the run fails, so the chunk store,
+            # BM25 segment and manifest on disk never fall behind it
+            self.vector_store.save()
+            self.bm25_store.save()
+            self.manifest.save()
+        stats.elapsed = time.perf_counter() - stats.started
+        logger.info(f"Ingested {stats.docs} docs / {stats.chunks} chunks in {stats.elapsed:.1f}s "
+                    f"({stats.docs_per_sec:.2f} docs/s, {stats.chunks_per_sec:.1f} chunks/s); skipped {stats.skipped} "
+                    f"unchanged docs, kept {stats.unchanged_chunks} chunks, moved {stats.moved_chunks}, "
+                    f"deleted {stats.deleted_chunks}")
+        return stats
+
+
+    def _discard_failed(self, file_path, doc_id, upserted):
+        entry = self.manifest.get(doc_id)
+        if entry and entry["embedding"] == self._embedding_signature and os.path.exists(file_path):
+            # Indexed before and still on disk (a transient read or parse error): keep that version and its
+            # manifest entry, dropping only chunks this run added before the failure
+            added = [chunk_id for chunk_id in upserted if chunk_id not in entry["chunks"]]
+            if added:
+                self.vector_store.delete_chunks(added, doc_id)
+                self.bm25_store.delete_chunks(added, doc_id)
+            return
+        # Never indexed (or its file is gone): whatever part made it in is removed, and it starts over next run
+        self.remove_document(doc_id)
+
+
+    @property
+    def _embedding_signature(self):
+        # Vectors from another model or dimension can't be reused, even for identical text
+        return f"{self.vector_store.embedder.model}:{self.vector_store.embedder.dimension}"
+
+
+    def _plan(self, file_path, doc_id, stats):
+        # Returns (fingerprint, known chunk hashes or None) for a document that needs work, None to skip it
+        fingerprint = file_fingerprint(file_path, settings.chunk_size, settings.chunk_overlap)
+        entry = self.manifest.get(doc_id)
+        if entry and entry["embedding"] == self._embedding_signature:
+            if entry["fingerprint"] == fingerprint:
+                stats.skipped += 1
+                return None
+            return fingerprint, entry["chunks"]
+        # New to the manifest (or re-embedded): clear anything indexed under this doc_id before, e.g. random-id points
+        self.vector_store.delete_document(doc_id)
+        self.bm25_store.delete_document(doc_id)
+        return fingerprint, None
+
+
+    def _apply_diff(self, doc_id, known, hashes, moved, stats):
+        # New chunks were streamed to the embed queue by the worker; the rest only touch existing entries
+        if known is None: return
+        stale = [chunk_id for chunk_id in known if chunk_id not in hashes]
+        if stale:
+            self.vector_store.delete_chunks(stale, doc_id)
+        if stale or moved:
+            self.bm25_store.delete_chunks(stale + [c.chunk_id for c in moved], doc_id)
+        if moved:
+            self.vector_store.update_payloads(moved)
+            self.bm25_store.add_documents([c.to_dict() for c in moved])
+        new = sum(1 for chunk_id in hashes if chunk_id not in known)
+        stats.unchanged_chunks += len(hashes) - new - len(moved)
+        stats.moved_chunks += len(moved)
+        stats.deleted_chunks += len(stale)
+
+
+    def _parse_stage(self, documents, embed_q, stats, errors, updates):
+        # spawn: worker processes must not inherit the embed/upsert threads or open client sockets
+        context = multiprocessing.get_context("spawn")
+        pending, todo = {}, list(documents)
+        with context.Manager() as manager:
+            # Workers stream chunk batches back through a bounded queue instead of returning whole documents
+            out_q = manager.Queue(self.queue_size)
+            with ProcessPoolExecutor(self.parse_workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(settings.chunk_size, settings.chunk_overlap, out_q)) as pool:
+                while todo or pending:
+                    # Keep at most two documents per worker in flight
+                    while todo and len(pending) < 2 * self.parse_workers and not errors:
+                        file_path, doc_id = todo.pop(0)
+                        try:
+                            plan = self._plan(file_path, doc_id, stats)
+                        except OSError as e:
+                            logger.error(f"Failed to read {file_path}: {e}")
+                            stats.failed.append(file_path)
+                            continue
+                        if plan is None: continue
+                        future = pool.submit(_parse_and_chunk, file_path, doc_id, self.batch_size, plan[1])
+                        pending[future] = (file_path, doc_id, *plan)
+                    try:
+                        batch = out_q.get(timeout=0.05)
+                        # After a failure keep draining so blocked workers can finish
+                        if not errors: embed_q.put(batch)
+                        continue
+                    except queue.Empty:
+                        pass
+                    for future in [f for f in pending if f.done()]:
+                        file_path, doc_id, fingerprint, known = pending.pop(future)
+                        try:
+                            hashes, moved, seconds = future.result()
+                        except Exception as e:
+                            logger.error(f"Failed to parse {file_path}: {e}")
+                            stats.failed.append(file_path)
+                            continue
+                        # Worker processes have their own tracer; their time is recorded here
+                        tracing.observe("IngestionPipeline.parse_chunk", seconds)
+                        self._apply_diff(doc_id, known, hashes, moved, stats)
+                        updates[doc_id] = {"path": file_path, "fingerprint": fingerprint,
+                                           "embedding": self._embedding_signature, "chunks": hashes}
+                        stats.docs += 1
+                    if errors:
+                        todo.clear()
+                        for future in pending: future.cancel()
+                # Every worker has returned, so anything still queued is complete
+                while not out_q.empty():
+                    batch = out_q.get()
+                    if not errors: embed_q.put(batch)
+
+
+    def _embed_loop(self, embed_q, upsert_q, errors):
+        while (batch := embed_q.get()) is not _STOP:
+            if errors: continue  # drain so the parse stage never blocks on a full queue
+            try:
+                embeddings = self.vector_store.embedder.embed_batch([c.text for c in batch])
+                upsert_q.put((batch, embeddings))
+            except Exception as e:
+                errors.append(e)
+
+
+    def _upsert_loop(self, upsert_q, stats, errors, upserted):
+        while (item := upsert_q.get()) is not _STOP:
+            if errors: continue
+            batch, embeddings = item
+            try:
+                self.vector_store.upsert_embedded(batch, embeddings)
+                self.bm25_store.add_documents([c.to_dict() for c in batch])
+                with self._stats_lock:
+                    stats.chunks += len(batch)
+                    for c in batch:
+                        upserted.setdefault(c.doc_id, set()).add(c.chunk_id)
+            except Exception as e:
+                errors.append(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse, chunk, embed and index every document in a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--parse-workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--prune", action="store_true", help="remove documents whose files were deleted")
+    args = parser.parse_args()
+
+    pipeline = IngestionPipeline(parse_workers=args.parse_workers, embed_workers=args.embed_workers,
+                                 upsert_workers=args.upsert_workers, batch_size=args.batch_size,
+                                 queue_size=args.queue_size)
+    stats = pipeline.ingest_directory(args.directory, prune=args.prune)
+    print(f"docs={stats.docs} chunks={stats.chunks} skipped={stats.skipped} deleted_chunks={stats.deleted_chunks} "
+          f"failed={len(stats.failed)} elapsed={stats.elapsed:.1f}s "
+          f"docs/s={stats.docs_per_sec:.2f} chunks/s={stats.chunks_per_sec:.1f}")
+
+
+if __name__ == "__main__":
+    main()
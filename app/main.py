@@ -0,0 +1,199 @@
+"""HTTP API: query, streamed query, ingest, delete and metrics over one set of process-wide clients and indexes.
+
+    uvicorn app.main:app --host 0.0.0.0 --port 8000
+
+Each endpoint admits a fixed number of concurrent requests (API_*_CONCURRENCY) and answers 429 with
+Retry-After beyond that, so overload is shed immediately instead of queueing until clients time out.
+"""
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from pathlib import Path
+import json, shutil
+
+import anyio
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from loguru import logger
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+from app import tracing
+from app.config import settings
+from app.ingestion.pipeline import SUPPORTED_EXTENSIONS
+
+
+class QueryRequest(BaseModel):
+    question: str = Field(min_length=1)
+    doc_filter: str | dict | None = None  # a doc_id or {field: value}
+    top_k: int = Field(5, ge=1, le=50)
+
+
+class Admission:
+    """Concurrency limit for one endpoint; requests over it are rejected with 429 rather than queued.
+
+    Only touched from the event loop, so the counters need no lock. Blocking work for admitted
+    requests runs on the endpoint's own thread limiter, sized to match.
+    """
+
+    def __init__(self, name, limit):
+        self.name, self.limit = name, limit
+        self.threads = anyio.CapacityLimiter(limit)
+        self.in_flight = self.admitted = self.rejected = 0
+
+
+    def acquire(self):
+        """Takes a slot or raises 429; returns an idempotent release function."""
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise HTTPException(429, f"Too many concurrent {self.name} requests", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        self.admitted += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= 1
+        return release
+
+
+    async def run(self, fn, *args):
+        release = self.acquire()
+        try:
+            return await anyio.to_thread.run_sync(fn, *args, limiter=self.threads)
+        finally:
+            release()
+
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "admitted": self.admitted, "rejected": self.rejected}
+
+
+def build_services():
+    # One Qdrant client, embedder (with its cache and rate limits), OpenAI client and warm BM25 index per process
+    from app.ingestion.pipeline import IngestionPipeline
+    from app.retrieval.bm25_store import BM25Store
+    from app.retrieval.rag_pipeline import RAGPipeline
+    from app.retrieval.vector_store import create_vector_store
+
+    vector_store = create_vector_store()
+    bm25_store = BM25Store()
+    bm25_store.load()
+    rag = RAGPipeline(vector_store, bm25_store)
+    rag.context_packer.preprocessor.encoder  # load the shared tokenizer now rather than on the first request
+    return rag, IngestionPipeline(vector_store, bm25_store)
+
+
+def create_app(rag=None, ingestion=None) -> FastAPI:
+    """rag and ingestion default to pipelines built by build_services() at startup."""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if rag is None or ingestion is None:
+            app.state.rag, app.state.ingestion = await anyio.to_thread.run_sync(build_services)
+        else:
+            app.state.rag, app.state.ingestion = rag, ingestion
+        app.state.admission = {
+            "query": Admission("query", settings.api_query_concurrency),
+            "stream": Admission("stream", settings.api_stream_concurrency),
+            "ingest": Admission("ingest", settings.api_ingest_concurrency),
+            "delete": Admission("delete", settings.api_delete_concurrency),
+        }
+        logger.info("API ready")
+        yield
+
+    app = FastAPI(title="Document RAG", lifespan=lifespan)
+
+
+    @app.get("/health")
+    async def health(request: Request):
+        state = request.app.state
+        cache = getattr(state.rag, "answer_cache", None)
+        return {"status": "ok", "admission": {name: a.stats() for name, a in state.admission.items()},
+                "answer_cache": cache.stats() if cache is not None else None}
+
+
+    @app.get("/metrics")
+    async def metrics():
+        """Per-stage latency histograms in the Prometheus text format (empty unless TRACING_ENABLED)."""
+        return PlainTextResponse(tracing.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+    @app.post("/query")
+    async def query(body: QueryRequest, request: Request):
+        state = request.app.state
+        response = await state.admission["query"].run(state.rag.query, body.question, body.doc_filter, body.top_k)
+        return asdict(response)
+
+
+    @app.post("/query/stream")
+    async def query_stream(body: QueryRequest, request: Request):
+        """Server-sent events: one `data: {json}` line per query_stream event."""
+        state = request.app.state
+        admission = state.admission["stream"]
+        release = admission.acquire()
+        events = state.rag.query_stream(body.question, body.doc_filter, body.top_k)
+
+        async def finish():
+            # Closing the generator closes the completion stream, so a client hang-up stops generation.
+            # Runs from the body's finally and again as a background task, in case the body never started.
+            release()
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(events.close)
+
+        async def sse():
+            try:
+                while (event := await anyio.to_thread.run_sync(next, events, None, limiter=admission.threads)):
+                    yield f"data: {json.dumps(event)}\n\n"
+            finally:
+                await finish()
+
+        return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"},
+                                 background=BackgroundTask(finish))
+
+
+    @app.post("/ingest")
+    async def ingest(files: list[UploadFile], request: Request):
+        """Stores the uploaded files under UPLOAD_DIR and ingests them; the doc_id is the file stem."""
+        state = request.app.state
+        for file in files:
+            if Path(file.filename or "").suffix.lower() not in SUPPORTED_EXTENSIONS:
+                raise HTTPException(400, f"Unsupported file type: {file.filename}")
+        stems = [Path(file.filename).stem for file in files]
+        if len(set(stems)) < len(stems):
+            # report.pdf and report.docx would share a doc_id, and a/report.pdf and b/report.pdf one upload path
+            raise HTTPException(400, f"Uploaded file names must have distinct stems: {[f.filename for f in files]}")
+        stats = await state.admission["ingest"].run(_ingest_uploads, state.ingestion, files)
+        return {**asdict(stats), "docs_per_sec": stats.docs_per_sec, "chunks_per_sec": stats.chunks_per_sec}
+
+
+    @app.delete("/documents/{doc_id:path}")
+    async def delete_document(doc_id: str, request: Request):
+        state = request.app.state
+        await state.admission["delete"].run(_delete_document, state.ingestion, doc_id)
+        return {"doc_id": doc_id, "deleted": True}
+
+    return app
+
+
+def _ingest_uploads(ingestion, files):
+    upload_dir = Path(settings.upload_dir)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    documents = []
+    for file in files:
+        path = upload_dir / Path(file.filename).name
+        with open(path, "wb") as out:
+            shutil.copyfileobj(file.file, out)
+        documents.append((str(path), path.stem))
+    return ingestion.ingest(documents)
+
+
+def _delete_document(ingestion, doc_id):
+    ingestion.remove_document(doc_id)
+    ingestion.vector_store.save()
+    ingestion.bm25_store.save()
+    ingestion.manifest.save()
+
+
+app = create_app()
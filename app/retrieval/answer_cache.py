@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib, json, re, threading, time
+import numpy as np
+from app.config import settings
+from app.retrieval.filters import normalize_filter
+from app.retrieval.generation import index_generation
+
+
+def normalize_question(question: str) -> str:
+    # Case, spacing and trailing punctuation don't change what is being asked
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
+
+
+@dataclass
+class _Entry:
+    response: object
+    scope: str  # filter + top_k; a semantic match must share it
+    generation: object  # index_generation.token() when the answer was produced
+    expires: float
+    embedding: np.ndarray | None = None
+
+
+class AnswerCache:
+    """RAG answers keyed by normalized question + filter, optionally matched by question embedding.
+
+    Entries are tied to the index generation of the documents they could have drawn from, so writes
+    to those documents invalidate them; TTL and an LRU size bound cover the rest.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, semantic_threshold=None):
+        self.max_entries = settings.answer_cache_size if max_entries is None else max_entries
+        self.ttl = settings.answer_cache_ttl_s if ttl is None else ttl
+        # 0 disables semantic lookup
+        self.semantic_threshold = settings.answer_cache_semantic_threshold if semantic_threshold is None \
+            else semantic_threshold
+        self._entries = OrderedDict()  # exact key -> _Entry, least recently used first
+        self._lock = threading.Lock()
+        self.exact_hits = self.semantic_hits = self.misses = self.invalidated = 0
+
+
+    @property
+    def semantic(self):
+        return self.semantic_threshold > 0
+
+
+    def _scope(self, doc_filter, top_k):
+        return json.dumps([sorted((normalize_filter(doc_filter) or {}).items()), top_k])
+
+
+    def _key(self, question, scope):
+        return hashlib.sha256(f"{normalize_question(question)}\0{scope}".encode()).hexdigest()
+
+
+    def generation(self, doc_filter=None):
+        # Take this before retrieving, and pass it to put(), so a write during generation isn't missed
+        return index_generation.token((normalize_filter(doc_filter) or {}).get("doc_id"))
+
+
+    def _valid(self, key, entry, generation, now):
+        if entry.expires > now and entry.generation == generation: return True
+        del self._entries[key]
+        self.invalidated += 1
+        return False
+
+
+    def get(self, question, doc_filter=None, top_k=5, embedding=None):
+        """Returns a cached response or None; embedding (of the question) enables the semantic lookup."""
+        scope = self._scope(doc_filter, top_k)
+        key, generation, now = self._key(question, scope), self.generation(doc_filter), time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._valid(key, entry, generation, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.response
+            if self.semantic and embedding is not None:
+                match = self._nearest(np.asarray(embedding, dtype=np.float32), scope, generation, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match].response
+            self.misses += 1
+            return None
+
+
+    def _nearest(self, embedding, scope, generation, now):
+        candidates = [(k, e) for k, e in self._entries.items() if e.scope == scope and e.embedding is not None]
+        candidates = [(k, e) for k, e in candidates if self._valid(k, e, generation, now)]
+        if not candidates: return None
+        matrix = np.stack([e.embedding for _, e in candidates])
+        similarity = matrix @ embedding / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding) + 1e-12)
+        best = int(np.argmax(similarity))
+        return candidates[best][0] if similarity[best] >= self.semantic_threshold else None
+
+
+    def put(self, question, response, doc_filter=None, top_k=5, embedding=None, generation=None):
+        scope = self._scope(doc_filter, top_k)
+        generation = self.generation(doc_filter) if generation is None else generation
+        entry = _Entry(response=response, scope=scope, generation=generation,
+                       expires=time.time() + self.ttl,
+                       embedding=np.asarray(embedding, dtype=np.float32) if self.semantic and embedding is not None
+                       else None)
+        with self._lock:
+            key = self._key(question, scope)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {"entries": len(self._entries), "exact_hits": self.exact_hits,
+                    "semantic_hits": self.semantic_hits, "misses": self.misses, "invalidated": self.invalidated,
+                    "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0}
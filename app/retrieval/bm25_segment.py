@@ -0,0 +1,179 @@
+from bisect import bisect_left
+import json, mmap, os, struct
+import numpy as np
+
+# Segment layout (little endian):
+#   header   magic, version, n_docs, n_terms, total_len, idf_sum
+#   table    (offset, length) for each section in SECTIONS
+#   sections 8-byte aligned, see SECTIONS
+MAGIC = b"DQABM25\x00"
+VERSION = 4
+FACETS = ("doc_id", "chunk_type")
+HEADER = struct.Struct("<8sIIIdd")
+SECTIONS = [
+    ("vocab_offsets", np.uint64),    # n_terms + 1 offsets into vocab_blob, terms sorted
+    ("vocab_blob", np.uint8),        # utf-8 terms
+    ("term_df", np.uint32),          # document frequency per term
+    ("postings_offsets", np.uint64), # n_terms + 1 offsets into postings
+    ("postings", np.uint32),         # per term: df doc-id deltas followed by df term freqs
+    ("doc_len", np.uint32),          # token length per doc (BM25 length norms)
+    ("chunk_ids", np.uint64),        # ChunkStore id per doc
+    ("facet_values", np.uint8),      # utf-8 JSON {facet: [values]}
+] + [(f"{facet}_codes", np.uint32) for facet in FACETS] + [  # per doc index into facet_values
+    ("doc_term_offsets", np.uint64), # n_docs + 1 offsets into doc_terms
+    ("doc_terms", np.uint32),        # per doc: ids of its distinct terms, so a delete can adjust df on its own
+]
+# Older versions are only read to migrate them: version 3 lacked the doc terms, version 2 also held the chunk
+# payloads itself (moved into the chunk store), version 1 also lacked the facets
+V3_SECTIONS = SECTIONS[:-2]
+V2_SECTIONS = V3_SECTIONS[:6] + [("doc_offsets", np.uint64), ("doc_blob", np.uint8)] + V3_SECTIONS[7:]
+V1_SECTIONS = V2_SECTIONS[:8]
+LEGACY_SECTIONS = {1: V1_SECTIONS, 2: V2_SECTIONS, 3: V3_SECTIONS}
+
+
+class _Vocab:
+    # Sequence view over the sorted term table so bisect can search it in place
+    def __init__(self, offsets, blob):
+        self.offsets, self.blob = offsets, blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes()
+
+
+class Segment:
+    """Read-only BM25 segment mapped from disk; pages are shared between processes."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_docs, self.n_terms, self.total_len, self.idf_sum = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a BM25 segment")
+        if version != VERSION and version not in LEGACY_SECTIONS:
+            raise ValueError(f"Unsupported BM25 segment version {version} in {path}, re-run ingestion to rebuild it")
+        self.version = version
+        self._sections = SECTIONS if version == VERSION else LEGACY_SECTIONS[version]
+        table = struct.unpack_from("<" + "QQ" * len(self._sections), self._mm, HEADER.size)
+        for i, (name, dtype) in enumerate(self._sections):
+            offset, length = table[2 * i], table[2 * i + 1]
+            setattr(self, name, np.frombuffer(self._mm, dtype=dtype, count=length, offset=offset))
+        self.vocab = _Vocab(self.vocab_offsets, self.vocab_blob)
+        facet_values = json.loads(self.facet_values.tobytes()) if version > 1 else {}
+        self.facet_codes = {facet: {v: i for i, v in enumerate(values)} for facet, values in facet_values.items()}
+
+
+    def facet_mask(self, facet: str, value) -> np.ndarray:
+        code = self.facet_codes[facet].get(value)
+        codes = getattr(self, f"{facet}_codes")
+        return codes == code if code is not None else np.zeros(self.n_docs, dtype=bool)
+
+
+    def close(self):
+        for name, _ in self._sections:
+            setattr(self, name, None)
+        self.vocab = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # postings still referenced by a running search; unmapped on GC
+
+
+    def term_id(self, term: str) -> int:
+        key = term.encode()
+        i = bisect_left(self.vocab, key)
+        return i if i < self.n_terms and self.vocab[i] == key else -1
+
+
+    def terms(self):
+        for i in range(self.n_terms):
+            yield self.vocab[i].decode()
+
+
+    def doc_terms_of(self, idx: int) -> np.ndarray:
+        return self.doc_terms[int(self.doc_term_offsets[idx]):int(self.doc_term_offsets[idx + 1])]
+
+
+    def read_postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        df = int(self.term_df[term_id])
+        start = int(self.postings_offsets[term_id])
+        ids = np.cumsum(self.postings[start:start + df], dtype=np.int64)
+        return ids, self.postings[start + df:start + 2 * df]
+
+
+    def document(self, idx: int) -> dict:
+        # Versions 1 and 2 only
+        start, end = int(self.doc_offsets[idx]), int(self.doc_offsets[idx + 1])
+        return json.loads(self.doc_blob[start:end].tobytes())
+
+
+def forward_index(term_ids: list[np.ndarray], n_docs: int) -> tuple[np.ndarray, np.ndarray]:
+    """Inverts postings: given the doc ids of each term, returns (n_docs + 1 offsets, term numbers) per doc."""
+    if not term_ids:
+        return np.zeros(n_docs + 1, dtype=np.uint64), np.zeros(0, dtype=np.uint32)
+    ids = np.concatenate(term_ids)
+    terms = np.repeat(np.arange(len(term_ids), dtype=np.uint32), [len(t) for t in term_ids])
+    order = np.argsort(ids, kind="stable")
+    offsets = np.searchsorted(ids[order], np.arange(n_docs + 1))
+    return offsets.astype(np.uint64), terms[order]
+
+
+def write_segment(path, chunk_ids, facets, doc_len, postings, idf_sum):
+    """Atomically write a segment.
+
+    `facets` maps each of FACETS to its value per doc; `postings` yields (term, ids, tfs) in sorted term
+    order with ascending ids.
+    """
+    vocab_offsets, vocab_blob, term_df, postings_offsets, postings_parts = [0], bytearray(), [], [0], []
+    term_ids = []
+    for term, ids, tfs in postings:
+        term_ids.append(ids)
+        vocab_blob += term.encode()
+        vocab_offsets.append(len(vocab_blob))
+        term_df.append(len(ids))
+        postings_parts.append(np.diff(ids, prepend=0).astype(np.uint32))
+        postings_parts.append(np.asarray(tfs, dtype=np.uint32))
+        postings_offsets.append(postings_offsets[-1] + 2 * len(ids))
+
+    facet_codes = {facet: {} for facet in FACETS}
+    codes = {facet: [] for facet in FACETS}
+    for facet in FACETS:
+        values = facet_codes[facet]
+        codes[facet] = [values.setdefault(value, len(values)) for value in facets[facet]]
+    facet_values = json.dumps({facet: list(values) for facet, values in facet_codes.items()}).encode()
+    doc_term_offsets, doc_terms = forward_index(term_ids, len(doc_len))
+
+    sections = {
+        "vocab_offsets": np.asarray(vocab_offsets, dtype=np.uint64),
+        "vocab_blob": np.frombuffer(bytes(vocab_blob), dtype=np.uint8),
+        "term_df": np.asarray(term_df, dtype=np.uint32),
+        "postings_offsets": np.asarray(postings_offsets, dtype=np.uint64),
+        "postings": np.concatenate(postings_parts) if postings_parts else np.zeros(0, dtype=np.uint32),
+        "doc_len": np.asarray(doc_len, dtype=np.uint32),
+        "chunk_ids": np.asarray(chunk_ids, dtype=np.uint64),
+        "facet_values": np.frombuffer(facet_values, dtype=np.uint8),
+        **{f"{facet}_codes": np.asarray(codes[facet], dtype=np.uint32) for facet in FACETS},
+        "doc_term_offsets": doc_term_offsets,
+        "doc_terms": doc_terms,
+    }
+
+    table, offset = [], HEADER.size + struct.calcsize("<" + "QQ" * len(SECTIONS))
+    for name, _ in SECTIONS:
+        offset += -offset % 8
+        table += [offset, len(sections[name])]
+        offset += sections[name].nbytes
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        total_len = float(sum(int(n) for n in doc_len))
+        f.write(HEADER.pack(MAGIC, VERSION, len(doc_len), len(term_df), total_len, idf_sum))
+        f.write(struct.pack("<" + "QQ" * len(SECTIONS), *table))
+        for i, (name, _) in enumerate(SECTIONS):
+            f.write(b"\x00" * (table[2 * i] - f.tell()))
+            f.write(sections[name].tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -1,13 +1,55 @@
-from rank_bm25 import BM25Okapi
-import pickle, os, re
+from array import array
+from collections import Counter
+import heapq, os, pickle, re, threading
+import numpy as np
+from loguru import logger
+from scipy import sparse
+
+from app import tracing
+from app.retrieval.bm25_segment import FACETS, VERSION, Segment, forward_index, write_segment
+from app.retrieval.chunk_store import Hits, shared_chunk_store
+from app.retrieval.filters import normalize_filter
+from app.retrieval.generation import index_generation
 
 
 class BM25Store:
-    def __init__(self, index_path="data/bm25_index.pkl"):
+    """BM25 over chunk text; documents are ChunkStore ids, and searches return Hits."""
+
+    max_partition_ranges = 32  # beyond this many id runs, filter postings with the bitmap instead
+
+    def __init__(self, index_path="data/bm25_index.seg", legacy_path="data/bm25_index.pkl",
+                 k1=1.5, b=0.75, epsilon=0.25, compaction_ratio=0.2, chunks=None):
         self.index_path = index_path
-        self.bm25 = None
-        self.documents = []
-        self.tokenized_docs = []
+        self.legacy_path = legacy_path
+        self.chunks = chunks if chunks is not None else shared_chunk_store()
+        # Same parameters and idf floor as rank_bm25.BM25Okapi so scores stay comparable
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.compaction_ratio = compaction_ratio
+        self._lock = threading.RLock()
+        self._compactor = None
+        self._segment = None
+        self._reset()
+
+
+    def _reset(self, segment=None):
+        # Documents [0, segment.n_docs) live in the mmapped segment, later ones in memory
+        if self._segment is not None and self._segment is not segment:
+            self._segment.close()
+        self._segment = segment
+        self._base = segment.n_docs if segment else 0
+        self._chunk_ids = array("q")  # chunk store id per in-memory doc
+        self._postings = {}  # term -> (array of doc ids, array of term freqs), in-memory docs only
+        self._doc_freq = Counter()  # df of in-memory docs minus tombstoned segment docs
+        self._facets = {facet: {} for facet in FACETS}  # facet -> value -> array of in-memory doc ids
+        self._masks = {}  # (field, value) -> candidate bitmap over all doc ids
+        self._doc_len = array("i")
+        # Forward index of the in-memory docs: distinct terms per doc as numbers into _terms
+        self._terms, self._term_numbers = [], {}
+        self._doc_term_offsets, self._doc_terms = array("q", [0]), array("i")
+        self._deleted = set()
+        self._total_len = segment.total_len if segment else 0
+        self._idf = {}
+        self._idf_floor = None  # recomputed lazily after add/delete
 
 
     def _tokenize(self, text):
@@ -15,29 +57,394 @@ class BM25Store:
         return [t for t in text.split() if len(t) > 2]
 
 
+    @property
+    def doc_count(self):
+        return self._base + len(self._chunk_ids)
+
+
+    @property
+    def live_count(self):
+        return self.doc_count - len(self._deleted)
+
+
+    def _chunk_ids_of(self, idxs) -> np.ndarray:
+        idxs = np.asarray(idxs, dtype=np.int64)
+        out = np.empty(len(idxs), dtype=np.int64)
+        saved = idxs < self._base
+        if saved.any(): out[saved] = self._segment.chunk_ids[idxs[saved]]
+        out[~saved] = np.frombuffer(self._chunk_ids, dtype=np.int64)[idxs[~saved] - self._base]
+        return out
+
+
+    def _invalidate(self):
+        self._idf, self._idf_floor, self._masks = {}, None, {}
+
+
     def add_documents(self, chunks: list[dict]):
-        for chunk in chunks:
-            self.documents.append(chunk)
-            self.tokenized_docs.append(self._tokenize(chunk["text"]))
-        self.bm25 = BM25Okapi(self.tokenized_docs)
+        with self._lock:
+            for chunk_id, chunk in zip(self.chunks.add(chunks).tolist(), chunks):
+                self._index(chunk_id, chunk, self._tokenize(chunk["text"]))
+            self._invalidate()
+        index_generation.bump(chunk.get("doc_id", "") for chunk in chunks)
+
+
+    def _index(self, chunk_id, chunk, tokens):
+        doc_idx = self.doc_count
+        self._chunk_ids.append(chunk_id)
+        self._doc_len.append(len(tokens))
+        self._total_len += len(tokens)
+        self._add_facets(doc_idx, chunk)
+        for term, tf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("i"))
+                self._term_numbers[term] = len(self._terms)
+                self._terms.append(term)
+            postings[0].append(doc_idx)
+            postings[1].append(tf)
+            self._doc_freq[term] += 1
+            self._doc_terms.append(self._term_numbers[term])
+        self._doc_term_offsets.append(len(self._doc_terms))
+
+
+    def _add_facets(self, doc_idx, chunk):
+        for facet in FACETS:
+            ids = self._facets[facet].get(chunk.get(facet, ""))
+            if ids is None:
+                ids = self._facets[facet][chunk.get(facet, "")] = array("i")
+            ids.append(doc_idx)
+
+
+    def delete_document(self, doc_id: str) -> int:
+        return self._delete(doc_id)
+
+
+    def delete_chunks(self, chunk_ids: list[str], doc_id: str = None) -> int:
+        # Same signature as the vector stores; doc_id, when known, narrows the scan to that document
+        return self._delete(doc_id, set(chunk_ids))
+
+
+    def _delete(self, doc_id, chunk_ids=None):
+        # Tombstone matching chunks; postings are dropped later by compact()
+        with self._lock:
+            removed = 0
+            if doc_id is not None:
+                # The doc_id facet narrows the scan to this document's (live) chunks
+                idxs = np.flatnonzero(self._field_mask("doc_id", doc_id))
+            else:
+                idxs = np.setdiff1d(np.arange(self.doc_count), list(self._deleted))
+            ids = self._chunk_ids_of(idxs)
+            if chunk_ids is not None:
+                keep = np.isin(ids, self.chunks.ids_of(chunk_ids))
+                idxs, ids = idxs[keep], ids[keep]
+            # Length and terms come from the index itself: the chunk store may already have dropped the text
+            for idx in idxs.tolist():
+                self._deleted.add(idx)
+                length, terms = self._doc_terms_of(idx)
+                self._total_len -= length
+                for term in terms:
+                    self._doc_freq[term] -= 1
+                    if not self._doc_freq[term]: del self._doc_freq[term]
+                removed += 1
+            if removed:
+                self.chunks.delete(ids)
+                self._invalidate()
+                self._maybe_compact()
+                index_generation.bump(None if doc_id is None else [doc_id])
+            return removed
+
+
+    def _doc_terms_of(self, idx):
+        # (token length, distinct terms) of one doc
+        if idx < self._base:
+            seg = self._segment
+            return int(seg.doc_len[idx]), [seg.vocab[t].decode() for t in seg.doc_terms_of(idx).tolist()]
+        idx -= self._base
+        numbers = self._doc_terms[self._doc_term_offsets[idx]:self._doc_term_offsets[idx + 1]]
+        return self._doc_len[idx], [self._terms[n] for n in numbers]
+
+
+    def _maybe_compact(self):
+        if len(self._deleted) <= self.compaction_ratio * max(self.doc_count, 1): return
+        if self._compactor and self._compactor.is_alive(): return
+        self._compactor = threading.Thread(target=self.compact, daemon=True)
+        self._compactor.start()
+
+
+    def compact(self):
+        # Rebuild the in-memory index without tombstoned documents
+        with self._lock:
+            if not self._deleted: return
+            chunk_ids, doc_len, postings = self._merged()
+            self._reset()
+            self._chunk_ids = array("q", chunk_ids.tobytes())
+            self._doc_len = array("i", doc_len)
+            self._total_len = sum(doc_len)
+            facets = self._facet_values(chunk_ids)
+            for idx in range(len(chunk_ids)):
+                self._add_facets(idx, {facet: values[idx] for facet, values in facets.items()})
+            for term, ids, tfs in postings:
+                self._postings[term] = (array("i", ids.astype(np.int32).tobytes()),
+                                        array("i", tfs.astype(np.int32).tobytes()))
+                self._doc_freq[term] = len(ids)
+                self._term_numbers[term] = len(self._terms)
+                self._terms.append(term)
+            offsets, numbers = forward_index([ids for _, ids, _ in postings], len(chunk_ids))
+            self._doc_term_offsets = array("q", offsets.astype(np.int64).tobytes())
+            self._doc_terms = array("i", numbers.astype(np.int32).tobytes())
+
+
+    def _df(self, term):
+        df = self._doc_freq.get(term, 0)
+        if self._segment:
+            term_id = self._segment.term_id(term)
+            if term_id >= 0: df += int(self._segment.term_df[term_id])
+        return df
+
+
+    def _raw_idf(self, df):
+        n = self.live_count
+        return np.log(n - df + 0.5) - np.log(df + 0.5)
+
+
+    def _floor(self):
+        # epsilon * average idf over the whole vocabulary, as in BM25Okapi
+        if self._idf_floor is None:
+            seg = self._segment
+            if seg and not self._doc_freq and not self._deleted:
+                idf_sum, n_terms = seg.idf_sum, seg.n_terms
+            else:
+                df = seg.term_df.astype(np.int64) if seg else np.zeros(0, dtype=np.int64)
+                extra = []
+                for term, d in self._doc_freq.items():
+                    term_id = seg.term_id(term) if seg else -1
+                    if term_id >= 0: df[term_id] += d
+                    else: extra.append(d)
+                df = np.concatenate([df, np.asarray(extra, dtype=np.int64)])
+                df = df[df > 0]
+                idf_sum, n_terms = float(self._raw_idf(df).sum()), len(df)
+            self._idf_floor = self.epsilon * idf_sum / n_terms if n_terms else 0.0
+        return self._idf_floor
+
+
+    def _term_idf(self, term):
+        if term not in self._idf:
+            df = self._df(term)
+            if df <= 0:
+                self._idf[term] = None
+            else:
+                idf = float(self._raw_idf(df))
+                self._idf[term] = idf if idf >= 0 else self._floor()
+        return self._idf[term]
+
+
+    def _term_postings(self, term):
+        # Yields (doc ids, term freqs, doc lengths, id of doc_len[0]) for the segment and in-memory parts
+        seg = self._segment
+        if seg:
+            term_id = seg.term_id(term)
+            if term_id >= 0:
+                ids, tfs = seg.read_postings(term_id)
+                yield ids, tfs, seg.doc_len, 0
+        postings = self._postings.get(term)
+        if postings is not None:
+            ids = np.frombuffer(postings[0], dtype=np.int32)
+            yield ids, np.frombuffer(postings[1], dtype=np.int32), np.frombuffer(self._doc_len, dtype=np.int32), self._base
+
+
+    def _filter_mask(self, doc_filter):
+        doc_filter = normalize_filter(doc_filter)
+        if not doc_filter: return None
+        mask = None
+        for field, value in doc_filter.items():
+            if (field, value) not in self._masks:
+                self._masks[field, value] = self._field_mask(field, value)
+            mask = self._masks[field, value] if mask is None else mask & self._masks[field, value]
+        return mask
+
+
+    def _field_mask(self, field, value):
+        mask = np.zeros(self.doc_count, dtype=bool)
+        if field in FACETS:
+            if self._segment: mask[:self._base] = self._segment.facet_mask(field, value)
+            ids = self._facets[field].get(value)
+            if ids: mask[np.frombuffer(ids, dtype=np.int32)] = True
+        else:
+            # No bitmap for this field, the chunk store compares its column
+            mask[:] = self.chunks.matches(self._chunk_ids_of(np.arange(self.doc_count)), field, value)
+        if self._deleted: mask[list(self._deleted)] = False
+        return mask
+
+
+    def _partition_ranges(self, mask):
+        # Chunks of one document are indexed together, so a partition is usually a few id runs
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+        if len(edges) // 2 > self.max_partition_ranges: return None
+        return edges[::2], edges[1::2]
+
+
+    def _score(self, tokens, mask=None):
+        # Returns (candidate doc ids in ascending order, score array over all doc ids)
+        scores = np.zeros(self.doc_count)
+        if not self.live_count or (mask is not None and not mask.any()):
+            return np.zeros(0, dtype=np.int64), scores
+        ranges = self._partition_ranges(mask) if mask is not None else None
+        avgdl = self._total_len / self.live_count
+        touched = []
+        for term in tokens:
+            idf = self._term_idf(term)
+            if idf is None: continue
+            for ids, tf, doc_len, base in self._term_postings(term):
+                if ranges is not None:
+                    lo, hi = np.searchsorted(ids, ranges[0]), np.searchsorted(ids, ranges[1])
+                    sel = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+                    ids, tf = ids[sel], tf[sel]
+                elif mask is not None:
+                    sel = mask[ids]
+                    ids, tf = ids[sel], tf[sel]
+                tf = tf.astype(np.float64)
+                norm = self.k1 * (1 - self.b + self.b * doc_len[ids - base] / avgdl)
+                scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+                touched.append(ids)
+        if not touched: return np.zeros(0, dtype=np.int64), scores
+        candidates = np.unique(np.concatenate(touched))
+        if self._deleted and mask is None:
+            candidates = candidates[~np.isin(candidates, list(self._deleted))]
+        return candidates[scores[candidates] > 0], scores
+
+
+    @tracing.traced("BM25Store.search")
+    def search(self, query, top_k=20, doc_filter=None) -> Hits:
+        # doc_filter is applied before scoring, so filtered queries still return a full top_k
+        with self._lock:
+            candidates, scores = self._score(self._tokenize(query), self._filter_mask(doc_filter))
+            top = heapq.nlargest(top_k, candidates.tolist(), key=scores.__getitem__)
+            return Hits(self._chunk_ids_of(top), scores[top])
+
+
+    @tracing.traced("BM25Store.search_batch")
+    def search_batch(self, queries: list[str], top_k=20, doc_filter=None) -> list[Hits]:
+        """search() for many queries at once: one query-term x term-document sparse product scores them all."""
+        with self._lock:
+            scores = self._score_batch([self._tokenize(q) for q in queries], self._filter_mask(doc_filter))
+            out = []
+            for row in range(len(queries)):
+                start, end = scores.indptr[row], scores.indptr[row + 1]
+                candidates, values = scores.indices[start:end], scores.data[start:end]
+                row_scores = dict(zip(candidates.tolist(), values.tolist()))
+                # Candidates in ascending id order, as in _score, so ties break the same way
+                top = heapq.nlargest(top_k, [i for i in candidates.tolist() if row_scores[i] > 0],
+                                     key=row_scores.__getitem__)
+                out.append(Hits(self._chunk_ids_of(top), [row_scores[idx] for idx in top]))
+            return out
+
+
+    def _score_batch(self, token_lists, mask=None):
+        # Returns a CSR matrix of scores, queries x all doc ids, with sorted column indices
+        empty = sparse.csr_matrix((len(token_lists), self.doc_count))
+        if not self.live_count or (mask is not None and not mask.any()):
+            return empty
+        vocab = {}  # query term -> row of the term-document matrix
+        for tokens in token_lists:
+            for term in tokens:
+                if term not in vocab and self._term_idf(term) is not None:
+                    vocab[term] = len(vocab)
+        if not vocab: return empty
+        if mask is None and self._deleted:
+            mask = np.ones(self.doc_count, dtype=bool)
+            mask[list(self._deleted)] = False
+
+        # Term-document weights for the query vocabulary only, computed exactly as in _score
+        avgdl = self._total_len / self.live_count
+        indptr, indices, data, nnz = [0], [], [], 0
+        for term in vocab:
+            idf = self._term_idf(term)
+            for ids, tf, doc_len, base in self._term_postings(term):
+                if mask is not None:
+                    sel = mask[ids]
+                    ids, tf = ids[sel], tf[sel]
+                tf = tf.astype(np.float64)
+                norm = self.k1 * (1 - self.b + self.b * doc_len[ids - base] / avgdl)
+                indices.append(ids)
+                data.append(idf * tf * (self.k1 + 1) / (tf + norm))
+                nnz += len(ids)
+            indptr.append(nnz)
+        term_doc = sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                                     shape=(len(vocab), self.doc_count))
+
+        # Repeated query terms count once per occurrence, like the loop over tokens in _score
+        rows, cols = [], []
+        for row, tokens in enumerate(token_lists):
+            for term in tokens:
+                if term in vocab:
+                    rows.append(row)
+                    cols.append(vocab[term])
+        query_term = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(token_lists), len(vocab)))
+        scores = (query_term @ term_doc).tocsr()
+        scores.sort_indices()
+        return scores
+
+
+    def _merged(self):
+        # Chunk ids and postings of the live segment + memory docs, renumbered without tombstones
+        keep = np.ones(self.doc_count, dtype=bool)
+        if self._deleted: keep[list(self._deleted)] = False
+        new_id = np.cumsum(keep) - 1
+        chunk_ids = self._chunk_ids_of(np.flatnonzero(keep))
+        doc_len = np.concatenate([self._segment.doc_len if self._segment else np.zeros(0, np.uint32),
+                                  np.frombuffer(self._doc_len, dtype=np.int32)]).astype(np.int64)[keep]
+        terms = set(self._postings)
+        if self._segment: terms.update(self._segment.terms())
+
+        def postings():
+            for term in sorted(terms):
+                parts = list(self._term_postings(term))
+                ids = np.concatenate([p[0] for p in parts]).astype(np.int64)
+                tfs = np.concatenate([p[1] for p in parts]).astype(np.int64)
+                live = keep[ids]
+                if live.any():
+                    yield term, new_id[ids[live]], tfs[live]
+        return chunk_ids, doc_len.tolist(), list(postings())
+
+
+    def _facet_values(self, chunk_ids):
+        return {facet: self.chunks.values(chunk_ids, facet) for facet in FACETS}
 
 
-    def search(self, query, top_k=20, doc_filter=None):
-        scores = self.bm25.get_scores(self._tokenize(query))
-        scored = [(i, s) for i, s in enumerate(scores) if s > 0]
-        scored.sort(key=lambda x: x[1], reverse=True)
-        results = []
-        for rank, (idx, score) in enumerate(scored[:top_k], 1):
-            doc = self.documents[idx]
-            if doc_filter and doc.get("doc_id") != doc_filter: continue
-            results.append({**doc, "bm25_score": score, "bm25_rank": rank})
-        return results
+    def save(self):
+        with self._lock:
+            # The segment refers to chunk store ids, so the chunk store goes to disk first
+            self.chunks.save()
+            chunk_ids, doc_len, postings = self._merged()
+            df = np.fromiter((len(ids) for _, ids, _ in postings), dtype=np.int64, count=len(postings))
+            n = len(chunk_ids)
+            idf_sum = float((np.log(n - df + 0.5) - np.log(df + 0.5)).sum())
+            write_segment(self.index_path, chunk_ids, self._facet_values(chunk_ids), doc_len, postings, idf_sum)
+            self._reset(Segment(self.index_path))
+            logger.info(f"Saved BM25 segment with {n} docs and {len(postings)} terms to {self.index_path}")
 
 
-    def save(self): pickle.dump({"docs": self.documents, "tok": self.tokenized_docs}, open(self.index_path, "wb"))
     def load(self):
         if os.path.exists(self.index_path):
-            data = pickle.load(open(self.index_path, "rb"))
-            self.documents, self.tokenized_docs = data["docs"], data["tok"]
-            self.bm25 = BM25Okapi(self.tokenized_docs)
-            
\ No newline at end of file
+            segment = Segment(self.index_path)
+            with self._lock:
+                if segment.version < VERSION:
+                    logger.info(f"Migrating {self.index_path} from version {segment.version} to {VERSION}")
+                    if segment.version < 3:
+                        # One-time move of the chunk payloads a version 1/2 segment held into the chunk store
+                        segment.chunk_ids = self.chunks.add([segment.document(i) for i in range(segment.n_docs)])
+                    self._reset(segment)
+                    self.save()  # rewritten from the postings, which adds the doc terms
+                else:
+                    self._reset(segment)
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            # One-time migration from the pickled BM25Okapi corpus
+            logger.info(f"Migrating {self.legacy_path} to segment format")
+            with open(self.legacy_path, "rb") as f:
+                data = pickle.load(f)
+            with self._lock:
+                self._reset()
+                for chunk_id, doc, tokens in zip(self.chunks.add(data["docs"]).tolist(), data["docs"], data["tok"]):
+                    self._index(chunk_id, doc, tokens)
+                self.save()
+        index_generation.bump()  # the whole index may have changed
@@ -0,0 +1,529 @@
+"""Columnar chunk store: every chunk's text and metadata, kept once and addressed by a stable integer id.
+
+The vector and BM25 indexes store only these ids. Their searches return Hits (ids and scores), and only
+the results that survive fusion are turned back into chunk dicts, by ChunkStore.hydrate().
+
+File layout (little endian), memory-mapped read-only so worker processes share its pages:
+    header   magic, version, rows
+    table    (offset, length) for each section in SECTIONS
+    sections 8-byte aligned: offsets + utf-8 blob per string field, codes into the category_values
+             JSON table per category field, int32 per integer field (MISSING for None), a deleted flag
+             and the id per row, and the ids sorted with their rows
+
+An id is chunk_key(chunk_id), so every process and store derives the same id for a chunk without asking
+this one. A deleted chunk keeps its row, and its text is dropped at the next save. Rows added since the
+last save(), and rewrites of saved rows, are held in memory. Writers in several processes (the CLI, API
+workers) take a lock file around save(), and a writer whose file was replaced since it read it re-applies
+its own changes to the newer file. A reader that is asked for an id it doesn't have re-opens the file if
+it has changed.
+"""
+from contextlib import contextmanager
+from functools import lru_cache
+import hashlib, json, mmap, os, struct, threading
+import numpy as np
+from loguru import logger
+from app.config import settings
+
+MAGIC = b"DQACHNK\x00"
+VERSION = 2
+HEADER = struct.Struct("<8sIQ")
+# Chunk.to_dict() fields, in its order; dict keys outside these are not stored
+FIELDS = ("text", "doc_id", "chunk_index", "page_number", "section_title", "parent_section", "chunk_type",
+          "token_count", "chunk_id")
+STRINGS = ("text", "parent_section", "chunk_id")
+CATEGORIES = ("doc_id", "section_title", "chunk_type")  # few distinct values, stored as codes
+INTEGERS = ("chunk_index", "page_number", "token_count")
+DEFAULTS = {"text": "", "doc_id": "", "chunk_index": None, "page_number": -1, "section_title": "",
+            "parent_section": "", "chunk_type": "", "token_count": 0, "chunk_id": ""}
+MISSING = -2 ** 31  # int32 stand-in for None
+DROPPED = ("text", "parent_section")  # cleared from deleted rows when the file is rewritten
+SECTIONS = [(f"{field}_{part}", dtype) for field in STRINGS
+            for part, dtype in (("offsets", np.uint64), ("blob", np.uint8))] \
+    + [(f"{field}_codes", np.uint32) for field in CATEGORIES] + [("category_values", np.uint8)] \
+    + [(field, np.int32) for field in INTEGERS] \
+    + [("deleted", np.uint8), ("ids", np.int64), ("key_ids", np.int64), ("key_rows", np.uint64)]
+TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+
+
+def chunk_key(chunk_id: str) -> int:
+    """The id of a chunk_id: 63 bits of its blake2b digest, a valid int64 and Qdrant point id."""
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode(), digest_size=8).digest(), "little") >> 1
+
+
+def _id_of(row: dict) -> int:
+    # A chunk without a chunk_id is keyed by its content
+    return chunk_key(row["chunk_id"] or json.dumps(row, sort_keys=True))
+
+
+def _normalize(payload) -> dict:
+    payload = payload.to_dict() if hasattr(payload, "to_dict") else payload
+    return {field: payload.get(field, DEFAULTS[field]) for field in FIELDS}
+
+
+class Hits:
+    """One query's results from an index: chunk ids, best first, and their scores."""
+
+    __slots__ = ("ids", "scores")
+
+    def __init__(self, ids=(), scores=()):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        return isinstance(other, Hits) and np.array_equal(self.ids, other.ids) \
+            and np.array_equal(self.scores, other.scores)
+
+    def __repr__(self):
+        return f"Hits(ids={self.ids.tolist()}, scores={self.scores.round(4).tolist()})"
+
+
+class ChunkSegment:
+    """Read-only chunk columns mapped from disk."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rows = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk store")
+        if version != VERSION:
+            # Version 1 ids were row numbers, which the indexes can't be mapped from
+            raise ValueError(f"Unsupported chunk store version {version} in {path}, "
+                             "delete it with the indexes and re-run ingestion")
+        table = TABLE.unpack_from(self._mm, HEADER.size)
+        for i, (name, dtype) in enumerate(SECTIONS):
+            offset, length = table[2 * i], table[2 * i + 1]
+            setattr(self, name, np.frombuffer(self._mm, dtype=dtype, count=length, offset=offset))
+        self.values = json.loads(self.category_values.tobytes())  # field -> [value per code]
+        self.codes = {field: {v: i for i, v in enumerate(values)} for field, values in self.values.items()}
+        self._by_code = {}  # field -> (rows sorted by code, sorted codes), built on first use
+
+
+    def close(self):
+        for name, _ in SECTIONS:
+            setattr(self, name, None)
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # a column is still referenced by a running read; unmapped on GC
+
+
+    def value(self, row: int, field: str):
+        if field in STRINGS:
+            offsets = getattr(self, f"{field}_offsets")
+            return getattr(self, f"{field}_blob")[int(offsets[row]):int(offsets[row + 1])].tobytes().decode()
+        if field in CATEGORIES:
+            return self.values[field][int(getattr(self, f"{field}_codes")[row])]
+        value = int(getattr(self, field)[row])
+        return None if value == MISSING else value
+
+
+    def row(self, row: int) -> dict:
+        return {field: self.value(row, field) for field in FIELDS}
+
+
+    def rows_of(self, ids: np.ndarray) -> np.ndarray:
+        # Row of each id by binary search over the sorted ids, -1 where absent
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        if not self.rows: return rows
+        pos = np.minimum(np.searchsorted(self.key_ids, ids), self.rows - 1)
+        found = self.key_ids[pos] == ids
+        rows[found] = self.key_rows[pos[found]]
+        return rows
+
+
+    def matches(self, rows: np.ndarray, field: str, value) -> np.ndarray:
+        if field in CATEGORIES:
+            code = self.codes[field].get(value)
+            if code is None: return np.zeros(len(rows), dtype=bool)
+            return getattr(self, f"{field}_codes")[rows] == code
+        if field in INTEGERS:
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                return np.zeros(len(rows), dtype=bool)
+            return getattr(self, field)[rows] == (MISSING if value is None else value)
+        return np.fromiter((self.value(row, field) == value for row in rows.tolist()), dtype=bool, count=len(rows))
+
+
+    def category_rows(self, field: str, value) -> np.ndarray:
+        # Rows with this value, ascending, by binary search over the codes sorted once
+        code = self.codes[field].get(value)
+        if code is None: return np.zeros(0, dtype=np.int64)
+        if field not in self._by_code:
+            codes = getattr(self, f"{field}_codes")
+            order = np.argsort(codes, kind="stable")
+            self._by_code[field] = order, codes[order]
+        order, codes = self._by_code[field]
+        lo, hi = np.searchsorted(codes, [code, code + 1])
+        return order[lo:hi].astype(np.int64)
+
+
+@contextmanager
+def _locked(path):
+    # Exclusive between processes for the read-merge-write of a save
+    import fcntl
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_chunk_segment(path, rows, sections):
+    """Atomically write a chunk store file from finished sections (name -> array, see SECTIONS)."""
+    table, offset = [], HEADER.size + TABLE.size
+    for name, _ in SECTIONS:
+        offset += -offset % 8
+        table += [offset, len(sections[name])]
+        offset += sections[name].nbytes
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rows))
+        f.write(TABLE.pack(*table))
+        for i, (name, dtype) in enumerate(SECTIONS):
+            f.write(b"\x00" * (table[2 * i] - f.tell()))
+            f.write(np.ascontiguousarray(sections[name], dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """Chunk text and metadata by integer id: a mapped file plus the rows written since it was saved.
+
+    path "" keeps everything in memory (save() does nothing).
+    """
+
+    def __init__(self, path=None):
+        self.path = settings.chunk_store_path if path is None else path
+        self._lock = threading.RLock()
+        self._segment = self._stamp = None
+        self._reset(self._open())
+
+
+    def _open(self):
+        if not self.path or not os.path.exists(self.path): return None
+        stat = os.stat(self.path)
+        self._stamp = stat.st_mtime_ns, stat.st_size
+        return ChunkSegment(self.path)
+
+
+    def _reset(self, segment=None):
+        if self._segment is not None and self._segment is not segment:
+            self._segment.close()
+        self._segment = segment
+        self._base = segment.rows if segment else 0
+        self._tail = {field: [] for field in FIELDS}  # rows [_base, count): added since the last save
+        self._tail_ids = []  # id per tail row
+        self._tail_rows = {}  # id -> row, tail rows only
+        self._tail_docs = {}  # doc_id -> rows, tail rows only
+        self._overrides = {}  # row -> chunk dict, saved rows rewritten since the last save
+        self._deleted = bytearray(segment.deleted.tobytes()) if segment else bytearray()
+        self._dirty = False
+
+
+    @property
+    def count(self) -> int:
+        """Rows held, deleted ones included."""
+        return len(self._deleted)
+
+
+    @property
+    def live_count(self) -> int:
+        return self.count - self._deleted.count(1)
+
+
+    def _row_of(self, chunk_id: int) -> int:
+        row = self._tail_rows.get(chunk_id)
+        if row is not None: return row
+        return int(self._segment.rows_of(np.array([chunk_id], dtype=np.int64))[0]) if self._segment else -1
+
+
+    def _rows(self, ids) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = self._segment.rows_of(ids) if self._segment else np.full(len(ids), -1, dtype=np.int64)
+        if self._tail_rows:
+            for pos in np.flatnonzero(rows < 0).tolist():
+                rows[pos] = self._tail_rows.get(int(ids[pos]), -1)
+        return rows
+
+
+    def _ids(self, rows) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        saved = rows < self._base
+        ids = np.empty(len(rows), dtype=np.int64)
+        if saved.any(): ids[saved] = self._segment.ids[rows[saved]]
+        ids[~saved] = np.asarray(self._tail_ids, dtype=np.int64)[rows[~saved] - self._base]
+        return ids
+
+
+    def _value(self, row, field):
+        if row >= self._base:
+            return self._tail[field][row - self._base]
+        override = self._overrides.get(row)
+        return override[field] if override is not None else self._segment.value(row, field)
+
+
+    def _row(self, row) -> dict:
+        if row >= self._base:
+            i = row - self._base
+            return {field: self._tail[field][i] for field in FIELDS}
+        override = self._overrides.get(row)
+        return dict(override) if override is not None else self._segment.row(row)
+
+
+    # -- writes ----------------------------------------------------------------------------------
+
+    def add(self, chunks) -> np.ndarray:
+        """Ids for chunks (Chunk objects or dicts), storing them.
+
+        A chunk_id seen before is undeleted and takes the new metadata; its id is the same either way.
+        """
+        with self._lock:
+            ids = np.empty(len(chunks), dtype=np.int64)
+            for i, chunk in enumerate(chunks):
+                row = _normalize(chunk)
+                ids[i] = self._put(_id_of(row), row)
+            return ids
+
+
+    def _put(self, chunk_id, row) -> int:
+        found = self._row_of(chunk_id)
+        if found < 0:
+            found = self.count
+            for field in FIELDS:
+                self._tail[field].append(row[field])
+            self._deleted.append(0)
+            self._tail_ids.append(chunk_id)
+            self._tail_rows[chunk_id] = found
+            self._tail_docs.setdefault(row["doc_id"], []).append(found)
+            self._dirty = True
+        else:
+            if self._deleted[found]:
+                self._deleted[found] = 0
+                self._dirty = True
+            old = self._row(found)
+            if old != row:
+                self._rewrite(found, old, row)
+        return chunk_id
+
+
+    def _rewrite(self, row, old, new):
+        if row >= self._base:
+            for field in FIELDS:
+                self._tail[field][row - self._base] = new[field]
+            if old["doc_id"] != new["doc_id"]:
+                self._tail_docs[old["doc_id"]].remove(row)
+                self._tail_docs.setdefault(new["doc_id"], []).append(row)
+        else:
+            self._overrides[row] = new
+        self._dirty = True
+
+
+    def delete(self, ids):
+        with self._lock:
+            for row in self._rows(ids).tolist():
+                if row >= 0 and not self._deleted[row]:
+                    self._deleted[row] = 1
+                    self._dirty = True
+
+
+    # -- reads -----------------------------------------------------------------------------------
+
+    def hydrate(self, ids) -> list[dict | None]:
+        """Chunk dicts for ids, in order: None for deleted ids and ids this store doesn't have."""
+        ids = np.fromiter(ids, dtype=np.int64)
+        with self._lock:
+            rows = self._rows(ids)
+            if (rows < 0).any():
+                self.refresh()  # written by another process since this one opened the file
+                rows = self._rows(ids)
+            return [self._row(row) if row >= 0 and not self._deleted[row] else None for row in rows.tolist()]
+
+
+    def values(self, ids, field) -> list:
+        """field for each id, deleted ids included, None for unknown ids."""
+        with self._lock:
+            rows = self._rows(ids)
+            seg = self._segment
+            if field not in CATEGORIES or seg is None:
+                return [self._value(row, field) if row >= 0 else None for row in rows.tolist()]
+            # Saved rows are decoded from the code column in one pass
+            saved = (rows >= 0) & (rows < self._base)
+            table = seg.values[field]
+            decoded = iter([table[code] for code in getattr(seg, f"{field}_codes")[rows[saved]].tolist()])
+            out = []
+            for row, is_saved in zip(rows.tolist(), saved.tolist()):
+                if is_saved:
+                    value = next(decoded)
+                    out.append(value if row not in self._overrides else self._value(row, field))
+                else:
+                    out.append(self._value(row, field) if row >= 0 else None)
+            return out
+
+
+    def matches(self, ids, field, value) -> np.ndarray:
+        """Whether each id's field equals value; the filter for fields an index keeps no bitmap of."""
+        with self._lock:
+            rows = self._rows(ids)
+            out = np.zeros(len(rows), dtype=bool)
+            if field not in FIELDS: return out
+            saved = (rows >= 0) & (rows < self._base)
+            if saved.any():
+                out[saved] = self._segment.matches(rows[saved], field, value)
+            recheck = rows >= self._base
+            if self._overrides:
+                recheck |= np.isin(rows, np.fromiter(self._overrides, dtype=np.int64))
+            for pos in np.flatnonzero(recheck).tolist():
+                out[pos] = self._value(int(rows[pos]), field) == value
+            return out
+
+
+    def document_ids(self, doc_id) -> np.ndarray:
+        """Ids of the live chunks whose doc_id is doc_id."""
+        with self._lock:
+            rows = self._segment.category_rows("doc_id", doc_id) if self._segment else np.zeros(0, dtype=np.int64)
+            if self._overrides:
+                rows = np.union1d(rows, [r for r, row in self._overrides.items() if row["doc_id"] == doc_id])
+                rows = rows[[self._value(int(r), "doc_id") == doc_id for r in rows.tolist()]]
+            rows = np.concatenate([rows, sorted(self._tail_docs.get(doc_id, ()))]).astype(np.int64)
+            return self._ids(rows[np.frombuffer(self._deleted, dtype=np.uint8)[rows] == 0])
+
+
+    def ids_of(self, chunk_ids) -> list[int]:
+        """Ids of the chunk_ids this store has (deleted or not); unknown ones are left out."""
+        with self._lock:
+            return [chunk_id for chunk_id in map(chunk_key, filter(None, chunk_ids)) if self._row_of(chunk_id) >= 0]
+
+
+    # -- persistence -----------------------------------------------------------------------------
+
+    def _replaced(self) -> bool:
+        # Whether another process has saved the file since this one opened it
+        if not os.path.exists(self.path): return False
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size) != self._stamp
+
+
+    def refresh(self):
+        """Re-opens the file if another process has replaced it; rows not yet saved here keep it open."""
+        with self._lock:
+            if self._dirty or not self.path or not self._replaced(): return
+            self._reset(self._open())
+
+
+    def save(self):
+        """Writes every row, deleted ones without their text, and maps the new file in place of the old one."""
+        with self._lock:
+            if not self.path or not self._dirty: return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with _locked(self.path):
+                if self._replaced():
+                    self._rebase()
+                write_chunk_segment(self.path, self.count, self._sections())
+                self._reset(self._open())
+            logger.info(f"Saved chunk store with {self.live_count} live of {self.count} chunks to {self.path}")
+
+
+    def _rebase(self):
+        # Re-applies this store's unsaved rows, rewrites and delete flags on top of the file another process
+        # saved; for a chunk both changed, this save wins
+        seg, base = self._segment, self._base
+        rows = [(chunk_id, self._row(base + i), self._deleted[base + i]) for i, chunk_id in enumerate(self._tail_ids)]
+        flags = []
+        if seg is not None:
+            rows += [(int(seg.ids[row]), override, self._deleted[row]) for row, override in self._overrides.items()]
+            flipped = np.flatnonzero(np.frombuffer(bytes(self._deleted[:base]), dtype=np.uint8) != seg.deleted)
+            flags = [(int(seg.ids[row]), self._deleted[row]) for row in flipped.tolist()]
+        self._reset(self._open())
+        for chunk_id, row, deleted in rows:
+            self._put(chunk_id, row)
+            flags.append((chunk_id, deleted))
+        for chunk_id, deleted in flags:
+            row = self._row_of(chunk_id)
+            if row >= 0: self._deleted[row] = deleted
+        self._dirty = True
+
+
+    def _sections(self) -> dict:
+        seg, base, n = self._segment, self._base, self.count
+        deleted = np.frombuffer(bytes(self._deleted), dtype=np.uint8)
+        # Saved rows whose strings change: rewritten, or deleted since the file was written
+        changed = set(self._overrides)
+        if seg is not None:
+            changed.update(np.flatnonzero(deleted[:base] > seg.deleted).tolist())
+        changed = sorted(changed)
+        sections = {}
+
+        def saved_value(row, field):
+            if deleted[row] and field in DROPPED: return ""
+            return self._overrides[row][field] if row in self._overrides else seg.value(row, field)
+
+        def tail_value(i, field):
+            if deleted[base + i] and field in DROPPED: return ""
+            return self._tail[field][i]
+
+        for field in STRINGS:
+            # Unchanged saved rows are copied from the mapped blob in runs; only changed rows are re-encoded
+            parts, lengths, prev = [], [], 0
+            if seg is not None:
+                offsets, blob = getattr(seg, f"{field}_offsets"), getattr(seg, f"{field}_blob")
+                for row in changed + [base]:
+                    parts.append(blob[int(offsets[prev]):int(offsets[row])].tobytes())
+                    lengths.append(np.diff(offsets[prev:row + 1]).astype(np.int64))
+                    if row < base:
+                        value = saved_value(row, field).encode()
+                        parts.append(value)
+                        lengths.append(np.array([len(value)], dtype=np.int64))
+                    prev = row + 1
+            encoded = [tail_value(i, field).encode() for i in range(n - base)]
+            parts += encoded
+            lengths.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+            sections[f"{field}_offsets"] = np.concatenate([[0], np.cumsum(np.concatenate(lengths))]).astype(np.uint64)
+            sections[f"{field}_blob"] = np.frombuffer(b"".join(parts), dtype=np.uint8)
+
+        values = {}
+        for field in CATEGORIES:
+            table = list(seg.values[field]) if seg is not None else []
+            code_of = {v: i for i, v in enumerate(table)}
+            codes = np.empty(n, dtype=np.uint32)
+            if seg is not None:
+                codes[:base] = getattr(seg, f"{field}_codes")
+            for row in self._overrides:
+                codes[row] = code_of.setdefault(self._overrides[row][field], len(code_of))
+            for i, value in enumerate(self._tail[field]):
+                codes[base + i] = code_of.setdefault(value, len(code_of))
+            sections[f"{field}_codes"] = codes
+            values[field] = list(code_of)
+        sections["category_values"] = np.frombuffer(json.dumps(values).encode(), dtype=np.uint8)
+
+        for field in INTEGERS:
+            column = np.empty(n, dtype=np.int32)
+            if seg is not None:
+                column[:base] = getattr(seg, field)
+            for row, override in self._overrides.items():
+                column[row] = MISSING if override[field] is None else override[field]
+            column[base:] = [MISSING if v is None else v for v in self._tail[field]]
+            sections[field] = column
+
+        sections["deleted"] = deleted
+        ids = np.concatenate([seg.ids if seg is not None else np.zeros(0, np.int64),
+                              np.asarray(self._tail_ids, dtype=np.int64)])
+        order = np.argsort(ids, kind="stable")
+        sections["ids"], sections["key_ids"], sections["key_rows"] = ids, ids[order], order.astype(np.uint64)
+        return sections
+
+
+@lru_cache(maxsize=None)
+def _shared(path):
+    return ChunkStore(path)
+
+
+def shared_chunk_store() -> ChunkStore:
+    # One per process and path, so the vector and BM25 indexes resolve ids against the same rows
+    return _shared(settings.chunk_store_path)
@@ -0,0 +1,29 @@
+"""Process-wide API clients, created on first use and shared by every store and pipeline.
+
+Each client keeps its own connection pool, so one per process (per endpoint and key) lets concurrent
+requests reuse warm connections. The client libraries are imported here, on first use, not at import time.
+"""
+from functools import lru_cache
+from app.config import settings
+
+
+@lru_cache(maxsize=None)
+def _qdrant(host, port, grpc_port, prefer_grpc):
+    from qdrant_client import QdrantClient
+    return QdrantClient(host=host, port=port, grpc_port=grpc_port, prefer_grpc=prefer_grpc)
+
+
+def qdrant_client():
+    # gRPC skips JSON encoding of vectors and payloads, which dominates REST time for batch searches and upserts
+    return _qdrant(settings.qdrant_host, settings.qdrant_port, settings.qdrant_grpc_port, settings.qdrant_prefer_grpc)
+
+
+@lru_cache(maxsize=None)
+def _openai(api_key, base_url, max_retries):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url or None, max_retries=max_retries)
+
+
+def openai_client(max_retries=2):
+    # max_retries=0 for callers that retry themselves (the embedding scheduler); 2 is the SDK default
+    return _openai(settings.openai_api_key, settings.openai_base_url, max_retries)
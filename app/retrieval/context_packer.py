@@ -0,0 +1,123 @@
+from dataclasses import dataclass, field
+import re
+from app.config import settings
+from app.ingestion.preprocessor import TextPreprocessor
+
+SEPARATOR = "\n\n---\n\n"
+_SENTENCE_END = re.compile(r"[.!?](?= |$)")
+
+
+def overlap_length(previous: str, text: str) -> int:
+    """Length of the longest sentence-aligned prefix of text that previous ends with (the chunker's overlap)."""
+    for match in reversed(list(_SENTENCE_END.finditer(text, 0, min(len(text), len(previous))))):
+        if previous.endswith(text[:match.end()]):
+            return match.end()
+    return 0
+
+
+def source_label(n: int, source: dict) -> str:
+    return f"[Source {n}] Section: {source['section_title']} (Page {source['page_number']})"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    sources: list[dict]  # one per [Source N] label, adjacent chunks merged
+    tokens: int
+    raw_tokens: int  # every result in full, as the prompt was built before packing
+    dropped: int = 0  # results left out to stay within the budget
+    chunk_ids: list[list[str]] = field(default_factory=list)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.raw_tokens - self.tokens
+
+    def stats(self) -> dict:
+        return {"tokens": self.tokens, "raw_tokens": self.raw_tokens, "saved_tokens": self.saved_tokens,
+                "dropped": self.dropped}
+
+
+class ContextPacker:
+    """Builds the prompt context: merges neighbouring chunks, strips their overlap, fills a token budget by rank."""
+
+    def __init__(self, budget_tokens=None, preprocessor=None):
+        self.budget_tokens = budget_tokens or settings.context_token_budget
+        self.preprocessor = preprocessor or TextPreprocessor()
+
+
+    def pack(self, results: list[dict]) -> PackedContext:
+        # results arrive most relevant first; duplicates of a chunk keep their best rank
+        results = list({(r.get("doc_id"), r.get("chunk_index"), r["text"]): r for r in reversed(results)}.values())[::-1]
+        raw = self._render([(r, r["text"]) for r in results])
+        if not results:
+            return PackedContext(text="", sources=[], tokens=0, raw_tokens=0)
+
+        pred = self._predecessors(results)
+        stripped = [r["text"][overlap_length(results[pred[i]]["text"], r["text"]):].lstrip() if pred[i] is not None
+                    else r["text"] for i, r in enumerate(results)]
+        counts = self.preprocessor.count_tokens_batch(
+            [r["text"] for r in results] + stripped + [source_label(1, r) for r in results] + [SEPARATOR])
+        n = len(results)
+        full_tokens, stripped_tokens, label_tokens, sep_tokens = counts[:n], counts[n:2 * n], counts[2 * n:3 * n], counts[-1]
+
+        def cost(selected):
+            total = 0
+            for i in selected:
+                if pred[i] in selected:
+                    total += stripped_tokens[i] + 1
+                else:  # starts a group: label + separator
+                    total += full_tokens[i] + label_tokens[i] + sep_tokens
+            return total
+
+        # Greedy by rank; a result that doesn't fit is skipped and smaller, lower-ranked ones may still fit
+        selected, dropped = set(), 0
+        for i in range(n):
+            if not selected or cost(selected | {i}) <= self.budget_tokens:
+                selected.add(i)
+            else:
+                dropped += 1
+
+        groups = self._groups(selected, pred)
+        packed = self._render([(results[g[0]], " ".join([results[g[0]]["text"]] + [stripped[i] for i in g[1:]]))
+                               for g in groups])
+        tokens = self.preprocessor.count_tokens(packed)
+        if tokens > self.budget_tokens and len(groups) == 1 and len(groups[0]) == 1:
+            # The top result alone is over budget: keep its head rather than send nothing
+            encoder = self.preprocessor.encoder
+            label = f"{source_label(1, results[groups[0][0]])}\n"
+            head = encoder.decode(encoder.encode_ordinary(label + results[groups[0][0]]["text"])[:self.budget_tokens])
+            packed, tokens = head, self.preprocessor.count_tokens(head)
+
+        sources = [{**results[g[0]], "text": " ".join([results[g[0]]["text"]] + [stripped[i] for i in g[1:]])}
+                   for g in groups]
+        return PackedContext(text=packed, sources=sources, tokens=tokens,
+                             raw_tokens=self.preprocessor.count_tokens(raw), dropped=dropped,
+                             chunk_ids=[[results[i].get("chunk_id", "") for i in g] for g in groups])
+
+
+    def _predecessors(self, results):
+        # Index of the result holding the previous chunk of the same document section, if it was retrieved
+        position = {(r.get("doc_id"), r.get("section_title"), r.get("chunk_index")): i for i, r in enumerate(results)}
+        pred = []
+        for r in results:
+            index = r.get("chunk_index")
+            pred.append(None if index is None
+                        else position.get((r.get("doc_id"), r.get("section_title"), index - 1)))
+        return pred
+
+
+    def _groups(self, selected, pred):
+        # Runs of consecutive selected chunks; groups keep the rank of their best member
+        heads = sorted(i for i in selected if pred[i] not in selected)
+        succ = {pred[i]: i for i in selected if pred[i] in selected}
+        groups = []
+        for head in heads:
+            group = [head]
+            while group[-1] in succ:
+                group.append(succ[group[-1]])
+            groups.append(group)
+        return sorted(groups, key=min)
+
+
+    def _render(self, parts):
+        return SEPARATOR.join(f"{source_label(n, source)}\n{text}" for n, (source, text) in enumerate(parts, 1))
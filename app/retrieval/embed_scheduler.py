@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+import random, threading, time
+from loguru import logger
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+
+class RateLimiter:
+    """Token buckets for requests-per-minute and tokens-per-minute, shared by all in-flight requests.
+
+    A limit of 0 (or less) means unlimited: that bucket is never checked.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm, self.tpm = max(rpm, 0), max(tpm, 0)
+        self._requests, self._tokens = float(self.rpm), float(self.tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if self.rpm: self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm: self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+        self._updated = now
+
+
+    def acquire(self, tokens: int):
+        if self.tpm:
+            tokens = min(tokens, self.tpm)  # an oversized request waits for a full bucket instead of forever
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    requests_ok = not self.rpm or self._requests >= 1
+                    tokens_ok = not self.tpm or self._tokens >= tokens
+                    if requests_ok and tokens_ok:
+                        if self.rpm: self._requests -= 1
+                        if self.tpm: self._tokens -= tokens
+                        return
+                    wait = max((1 - self._requests) * 60 / self.rpm if not requests_ok else 0,
+                               (tokens - self._tokens) * 60 / self.tpm if not tokens_ok else 0)
+            time.sleep(wait)
+
+
+    def pause(self, seconds: float):
+        # Server said slow down: hold back every request, not just the one that was rejected
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class EmbeddingScheduler:
+    """Packs texts into token-bounded batches and keeps several embedding requests in flight."""
+
+    retryable = (RateLimitError, APIConnectionError, APITimeoutError)
+
+    def __init__(self, client, model, preprocessor, max_batch_tokens=100_000, max_batch_items=2048,
+                 max_input_tokens=8191, max_in_flight=4, rpm=3000, tpm=1_000_000, max_retries=6,
+                 backoff_base=0.5, backoff_cap=30.0, dimensions=None):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions  # reduced output size for text-embedding-3 models
+        self.preprocessor = preprocessor
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_input_tokens = max_input_tokens
+        self.max_in_flight = max_in_flight
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.backoff_base, self.backoff_cap = backoff_base, backoff_cap
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts: return []
+        texts, counts = self._fit(texts)
+        batches = self._pack(counts)
+        if len(batches) == 1:
+            return self._request([texts[i] for i in batches[0]], sum(counts))
+        results = [None] * len(texts)
+        futures = [(batch, self._executor().submit(self._request, [texts[i] for i in batch],
+                                                   sum(counts[i] for i in batch)))
+                   for batch in batches]
+        for batch, future in futures:
+            for i, embedding in zip(batch, future.result()):
+                results[i] = embedding
+        return results
+
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed")
+            return self._pool
+
+
+    def _fit(self, texts):
+        # Token counts per input; inputs over the model's context are truncated rather than failing the batch
+        encoded = self.preprocessor.encoder.encode_ordinary_batch(texts)
+        counts = [len(tokens) for tokens in encoded]
+        if max(counts) > self.max_input_tokens:
+            texts = list(texts)
+            for i, tokens in enumerate(encoded):
+                if len(tokens) > self.max_input_tokens:
+                    logger.warning(f"Truncating embedding input from {len(tokens)} to {self.max_input_tokens} tokens")
+                    texts[i] = self.preprocessor.encoder.decode(tokens[:self.max_input_tokens])
+                    counts[i] = self.max_input_tokens
+        return texts, counts
+
+
+    def _pack(self, counts) -> list[list[int]]:
+        batches, current, current_tokens = [], [], 0
+        for i, count in enumerate(counts):
+            if current and (current_tokens + count > self.max_batch_tokens or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += count
+        batches.append(current)
+        return batches
+
+
+    def _request(self, batch: list[str], tokens: int) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                extra = {"dimensions": self.dimensions} if self.dimensions else {}
+                response = self.client.embeddings.create(model=self.model, input=batch, **extra)
+                return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+            except Exception as e:
+                if attempt == self.max_retries or not self._should_retry(e): raise
+                delay = self._retry_after(e)
+                if delay is None:
+                    # Full jitter keeps concurrent workers from retrying in lockstep
+                    delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                else:
+                    self.limiter.pause(delay)
+                logger.warning(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+
+    def _should_retry(self, error) -> bool:
+        if isinstance(error, self.retryable): return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+    def _retry_after(self, error) -> float | None:
+        response = getattr(error, "response", None)
+        if response is None: return None
+        headers = response.headers
+        try:
+            if "retry-after-ms" in headers: return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers: return float(headers["retry-after"])
+        except ValueError:
+            pass  # HTTP-date form, fall back to backoff
+        return None
@@ -0,0 +1,495 @@
+"""In-process vector index with the VectorStore interface, for running without a Qdrant server.
+
+Layout under settings.embedded_index_path:
+
+    meta.json       dimension, dtype, and how many rows hnsw.bin covers
+    vectors.<dtype> one unit-normalized vector per row, float16 or int8, appended and memory-mapped
+    scales.f32      per-row int8 scale (int8 only)
+    payloads.jsonl  append-only log: {"row", "id", "fields"} for writes, {"delete": id} for deletes; ids are
+                    ChunkStore ids and fields the INDEXED_FIELDS values, the rest of the chunk is in the chunk store
+    hnsw.bin        HNSW graph over the rows, once the index has embedded_hnsw_threshold live vectors
+
+Rewritten or deleted points leave dead rows behind; save() compacts once they are a large share.
+"""
+import json, os, threading
+import numpy as np
+from loguru import logger
+from app import tracing
+from app.config import settings
+from app.ingestion.chunker import Chunk
+from app.retrieval.chunk_store import Hits, shared_chunk_store
+from app.retrieval.embedder import EmbeddingService
+from app.retrieval.filters import normalize_filter
+from app.retrieval.generation import index_generation
+
+INDEXED_FIELDS = ("doc_id", "section_title", "chunk_type")  # same payload indexes as the Qdrant collection
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _indexed(chunk) -> dict:
+    payload = chunk.to_dict() if hasattr(chunk, "to_dict") else chunk
+    return {field: payload[field] for field in INDEXED_FIELDS if field in payload}
+
+
+class EmbeddedVectorStore:
+    """Exact search over a memory-mapped float16/int8 matrix, switching to HNSW for larger corpora.
+
+    Exact searches run outside the write lock on a snapshot of the row count, so they overlap with ingestion.
+    """
+
+    block_rows = 16384  # rows converted to float32 at a time during exact search
+
+    def __init__(self, path=None, embedder=None, dtype=None, hnsw_threshold=None, hnsw_ef=None,
+                 hnsw_m=16, hnsw_ef_construction=200, compaction_ratio=0.3, cache_mb=None, chunks=None):
+        self.path = path or settings.embedded_index_path
+        self.embedder = embedder or EmbeddingService()
+        self.chunks = chunks if chunks is not None else shared_chunk_store()
+        self.dtype = np.dtype(dtype or settings.embedded_index_dtype)
+        if self.dtype not in (np.float16, np.int8):
+            raise ValueError(f"Unsupported embedded index dtype: {self.dtype}")
+        self.dimension = self.embedder.dimension
+        self.hnsw_threshold = settings.embedded_hnsw_threshold if hnsw_threshold is None else hnsw_threshold
+        self.hnsw_ef = hnsw_ef or settings.embedded_hnsw_ef
+        self.hnsw_m, self.hnsw_ef_construction = hnsw_m, hnsw_ef_construction
+        self.compaction_ratio = compaction_ratio
+        self.cache_bytes = (settings.embedded_index_cache_mb if cache_mb is None else cache_mb) * 2 ** 20
+        self._cache_lock = threading.Lock()
+        self.collection = os.path.basename(os.path.normpath(self.path))
+        self._lock = threading.RLock()
+        self._load()
+
+
+    # -- persistence -----------------------------------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+
+    @property
+    def _vectors_name(self):
+        return f"vectors.{'f16' if self.dtype == np.float16 else 'i8'}"
+
+
+    def _reset(self):
+        self._epoch = getattr(self, "_epoch", -1) + 1  # row numbers change on compaction: cached blocks expire
+        with self._cache_lock:
+            self._cache, self._cache_used = {}, 0  # (epoch, start, end) -> float32 rows
+        self._n = 0  # rows written, live or dead
+        self._ids, self._fields = [], []  # per row: chunk store id, INDEXED_FIELDS values
+        self._row_of = {}  # chunk store id -> live row
+        self._live = np.zeros(1024, dtype=bool)
+        self._field_rows = {field: {} for field in INDEXED_FIELDS}  # field -> value -> live rows
+        self._matrix = self._scales = None
+        self._hnsw, self._hnsw_rows = None, 0
+
+
+    def _load(self):
+        self._reset()
+        os.makedirs(self.path, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._file("meta.json")):
+            with open(self._file("meta.json")) as f:
+                meta = json.load(f)
+            if (meta["dimension"], meta["dtype"]) != (self.dimension, self.dtype.name):
+                raise ValueError(f"{self.path} holds {meta['dtype']} vectors of dimension {meta['dimension']}, "
+                                 f"not {self.dtype.name} x {self.dimension}")
+        else:
+            self._write_meta()
+
+        legacy = False
+        if os.path.exists(self._file("payloads.jsonl")):
+            with open(self._file("payloads.jsonl")) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if "payload" in record or isinstance(record.get("delete"), str):
+                            record, legacy = self._upgrade(record), True
+                        self._apply(record)
+        # Vectors are appended before their log lines, so rows past the log are from an interrupted write
+        for name, width in ((self._vectors_name, self.dimension * self.dtype.itemsize), ("scales.f32", 4)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > self._n * width:
+                os.truncate(self._file(name), self._n * width)
+        self._remap()
+
+        if legacy:
+            # The payloads now live in the chunk store; rewrite the log against its ids
+            self.chunks.save()
+            self.compact()
+        elif self.live_count and (self._n - self.live_count) / self._n > self.compaction_ratio:
+            self.compact()
+        elif meta.get("hnsw_rows") and os.path.exists(self._file("hnsw.bin")):
+            self._load_hnsw(meta["hnsw_rows"])
+        elif self.live_count >= self.hnsw_threshold:
+            self._build_hnsw()
+        logger.info(f"Embedded vector index {self.path}: {self.live_count} vectors "
+                    f"({'hnsw' if self._hnsw is not None else 'exact'})")
+
+
+    def _write_meta(self):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"dimension": self.dimension, "dtype": self.dtype.name, "hnsw_rows": self._hnsw_rows}, f)
+        os.replace(tmp, self._file("meta.json"))
+
+
+    def _remap(self):
+        # A new mapping after each append; searches holding the previous one keep a valid view
+        if not self._n:
+            self._matrix = self._scales = None
+            return
+        self._matrix = np.memmap(self._file(self._vectors_name), dtype=self.dtype, mode="r",
+                                 shape=(self._n, self.dimension))
+        if self.dtype == np.int8:
+            self._scales = np.memmap(self._file("scales.f32"), dtype=np.float32, mode="r", shape=(self._n,))
+
+
+    def save(self):
+        """Flushes the log and persists the HNSW graph; compacts first when dead rows pile up."""
+        with self._lock:
+            self.chunks.save()  # the log refers to its ids
+            if self._n and (self._n - self.live_count) / self._n > self.compaction_ratio:
+                self.compact()
+                return
+            self._save_hnsw()
+
+
+    def _save_hnsw(self):
+        if self._hnsw is not None and self._hnsw_rows != self._n:
+            self._hnsw.save_index(self._file("hnsw.bin"))
+            self._hnsw_rows = self._n
+            self._write_meta()
+
+
+    def compact(self):
+        """Rewrites the files with live rows only and rebuilds the HNSW graph."""
+        with self._lock:
+            rows = np.flatnonzero(self._live[:self._n])
+            records = [{"row": new, "id": self._ids[row], "fields": dict(zip(INDEXED_FIELDS, self._fields[row]))}
+                       for new, row in enumerate(rows.tolist())]
+            for name, source in ((self._vectors_name, self._matrix), ("scales.f32", self._scales)):
+                if source is None: continue
+                with open(self._file(f"{name}.tmp"), "wb") as f:
+                    for start in range(0, len(rows), self.block_rows):
+                        f.write(np.ascontiguousarray(source[rows[start:start + self.block_rows]]).tobytes())
+            with open(self._file("payloads.jsonl.tmp"), "w") as f:
+                f.writelines(json.dumps(r) + "\n" for r in records)
+            for name in (self._vectors_name, "scales.f32", "payloads.jsonl"):
+                if os.path.exists(self._file(f"{name}.tmp")):
+                    os.replace(self._file(f"{name}.tmp"), self._file(name))
+            if os.path.exists(self._file("hnsw.bin")):
+                os.remove(self._file("hnsw.bin"))
+            logger.info(f"Compacted {self.path}: {self._n} -> {len(rows)} rows")
+            self._reset()
+            for record in records:
+                self._apply(record)
+            self._remap()
+            if self.live_count >= self.hnsw_threshold:
+                self._build_hnsw()
+            self._write_meta()
+
+
+    def _upgrade(self, record):
+        # A record from before the chunk store: string chunk_id and the whole payload
+        if "delete" in record:
+            ids = self.chunks.ids_of([record["delete"]])
+            self.chunks.delete(ids)
+            return {"delete": ids[0] if ids else -1}
+        payload = {**record["payload"], "chunk_id": record["payload"].get("chunk_id") or record["id"]}
+        return {"row": record["row"], "id": int(self.chunks.add([payload])[0]), "fields": _indexed(payload)}
+
+
+    def _apply(self, record):
+        # Replays one log record into the in-memory state
+        if "delete" in record:
+            row = self._row_of.pop(record["delete"], None)
+            if row is not None: self._kill(row)
+            return
+        row, chunk_id, fields = record["row"], record["id"], record["fields"]
+        values = tuple(fields.get(field) for field in INDEXED_FIELDS)
+        old = self._row_of.get(chunk_id)
+        if old is not None and old != row:
+            self._kill(old)
+        if row >= self._n:  # a new row; otherwise a payload rewrite of an existing one
+            self._n = row + 1
+            if self._n > len(self._live):
+                self._live = np.concatenate([self._live, np.zeros(len(self._live), dtype=bool)])
+            self._ids.append(chunk_id)
+            self._fields.append(values)
+        else:
+            self._unindex(row)
+            self._fields[row] = values
+        self._row_of[chunk_id] = row
+        self._live[row] = True
+        for field, value in zip(INDEXED_FIELDS, values):
+            if field in fields:
+                self._field_rows[field].setdefault(value, set()).add(row)
+
+
+    def _kill(self, row):
+        self._live[row] = False
+        self._unindex(row)
+        if self._hnsw is not None and row < self._hnsw.get_current_count():
+            self._hnsw.mark_deleted(row)
+
+
+    def _unindex(self, row):
+        for field, value in zip(INDEXED_FIELDS, self._fields[row]):
+            rows = self._field_rows[field].get(value)
+            if rows is not None: rows.discard(row)
+
+
+    def _log(self, records):
+        with open(self._file("payloads.jsonl"), "a") as f:
+            f.writelines(json.dumps(r) + "\n" for r in records)
+
+
+    @property
+    def live_count(self) -> int:
+        return len(self._row_of)
+
+
+    # -- HNSW ------------------------------------------------------------------------------------
+
+    def _new_hnsw(self, capacity):
+        import hnswlib
+        index = hnswlib.Index(space="ip", dim=self.dimension)
+        index.init_index(max_elements=max(capacity, 1024), M=self.hnsw_m, ef_construction=self.hnsw_ef_construction)
+        index.set_ef(self.hnsw_ef)
+        return index
+
+
+    def _hnsw_add(self, index, start, end):
+        # Labels are row numbers; dead rows are added and marked so labels stay aligned with rows
+        if end > index.get_max_elements():
+            index.resize_index(max(end, 2 * index.get_max_elements()))
+        for lo in range(start, end, self.block_rows):
+            hi = min(lo + self.block_rows, end)
+            index.add_items(self._dequantize(lo, hi), np.arange(lo, hi), num_threads=1)
+            for row in np.flatnonzero(~self._live[lo:hi]) + lo:
+                index.mark_deleted(int(row))
+
+
+    def _build_hnsw(self):
+        logger.info(f"Building HNSW graph over {self.live_count} vectors")
+        index = self._new_hnsw(2 * self._n)
+        self._hnsw_add(index, 0, self._n)
+        self._hnsw = index
+        # Only the graph: the shared chunk store is saved by whoever owns the write (ingest, delete)
+        self._save_hnsw()
+
+
+    def _load_hnsw(self, rows):
+        import hnswlib
+        index = hnswlib.Index(space="ip", dim=self.dimension)
+        index.load_index(self._file("hnsw.bin"), max_elements=max(2 * self._n, 1024))
+        index.set_ef(self.hnsw_ef)
+        for row in np.flatnonzero(~self._live[:rows]):
+            try:
+                index.mark_deleted(int(row))
+            except RuntimeError:
+                pass  # already marked when the graph was saved
+        self._hnsw, self._hnsw_rows = index, rows
+        self._hnsw_add(index, rows, self._n)
+
+
+    def _dequantize(self, start, end) -> np.ndarray:
+        block = self._matrix[start:end].astype(np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:end, None]
+        return block
+
+
+    # -- writes ----------------------------------------------------------------------------------
+
+    @tracing.traced("EmbeddedVectorStore.add_chunks")
+    def add_chunks(self, chunks: list[Chunk]) -> int:
+        embeddings = self.embedder.embed_batch([c.text for c in chunks])
+        return self.upsert_embedded(chunks, embeddings)
+
+
+    @tracing.traced("EmbeddedVectorStore.upsert_embedded")
+    def upsert_embedded(self, chunks: list[Chunk], embeddings: list[list[float]]) -> int:
+        if not chunks: return 0
+        vectors = _normalize(embeddings)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+        if self.dtype == np.int8:
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+        else:
+            scales, stored = None, vectors.astype(np.float16)
+
+        with self._lock:
+            start = self._n
+            # A chunk_id seen before keeps its chunk store id, so its old row is replaced
+            records = [{"row": start + i, "id": chunk_id, "fields": _indexed(chunk)}
+                       for i, (chunk_id, chunk) in enumerate(zip(self.chunks.add(chunks).tolist(), chunks))]
+            with open(self._file(self._vectors_name), "ab") as f:
+                f.write(stored.tobytes())
+            if scales is not None:
+                with open(self._file("scales.f32"), "ab") as f:
+                    f.write(scales.astype(np.float32).tobytes())
+            self._log(records)
+            for record in records:
+                self._apply(record)
+            self._remap()
+            if self._hnsw is not None:
+                self._hnsw_add(self._hnsw, start, self._n)
+            elif self.live_count >= self.hnsw_threshold:
+                self._build_hnsw()
+        index_generation.bump(c.doc_id for c in chunks)
+        return len(chunks)
+
+
+    def update_payloads(self, chunks: list[Chunk]):
+        # Same vector, new position: a log record pointing at the existing row
+        with self._lock:
+            records = [{"row": self._row_of[chunk_id], "id": chunk_id, "fields": _indexed(c)}
+                       for chunk_id, c in zip(self.chunks.add(chunks).tolist(), chunks) if chunk_id in self._row_of]
+            self._log(records)
+            for record in records:
+                self._apply(record)
+        index_generation.bump(c.doc_id for c in chunks)
+
+
+    def delete_chunks(self, chunk_ids: list[str], doc_id: str = None):
+        self._delete(self.chunks.ids_of(chunk_ids), doc_id)
+
+
+    def delete_document(self, doc_id: str):
+        with self._lock:
+            rows = self._field_rows["doc_id"].get(doc_id, ())
+            self._delete([self._ids[row] for row in sorted(rows)], doc_id)
+
+
+    def _delete(self, ids, doc_id):
+        with self._lock:
+            records = [{"delete": chunk_id} for chunk_id in ids if chunk_id in self._row_of]
+            self._log(records)
+            for record in records:
+                self._apply(record)
+            self.chunks.delete([record["delete"] for record in records])
+        index_generation.bump(None if doc_id is None else [doc_id])
+
+
+    # -- search ----------------------------------------------------------------------------------
+
+    @tracing.traced("EmbeddedVectorStore.search")
+    def search(self, query: str, top_k=20, doc_filter=None) -> Hits:
+        return self.search_vectors([self.embedder.embed_text(query)], top_k, doc_filter)[0]
+
+
+    @tracing.traced("EmbeddedVectorStore.search_batch")
+    def search_batch(self, queries: list[str], top_k=20, doc_filter=None) -> list[Hits]:
+        if not queries: return []
+        return self.search_vectors(self.embedder.embed_queries(queries), top_k, doc_filter)
+
+
+    @tracing.traced("EmbeddedVectorStore.search_vectors")
+    def search_vectors(self, vectors, top_k=20, doc_filter=None) -> list[Hits]:
+        """Top-k chunk store ids by cosine similarity for each query vector."""
+        queries = _normalize(vectors)
+        with self._lock:
+            # Snapshot: rows appended after this point aren't searched, and these mappings stay valid
+            n, matrix, scales, hnsw, epoch = self._n, self._matrix, self._scales, self._hnsw, self._epoch
+            ids = self._ids  # replaced, not changed in place, on compaction
+            rows = self._filter_rows(doc_filter)
+            live = self._live[:n].copy() if rows is None else None
+        count = self.live_count if rows is None else len(rows)
+        if not n or not count or matrix is None:
+            return [Hits() for _ in queries]
+        k = min(top_k, count)
+
+        # Selective filters are cheaper to scan exactly than to walk the graph with a rejecting filter
+        hits = None
+        if hnsw is not None and count >= self.hnsw_threshold:
+            hits = self._graph(hnsw, queries, k, rows)
+        if hits is None:
+            hits = self._exact(queries, k, matrix, scales, n, rows, live, epoch)
+        return [Hits([ids[row] for row, _ in found], [score for _, score in found]) for found in hits]
+
+
+    def _filter_rows(self, doc_filter) -> np.ndarray | None:
+        # Live rows matching every {field: value}, or None for no filter; called under the lock
+        doc_filter = normalize_filter(doc_filter)
+        if not doc_filter: return None
+        selected = None
+        for field, value in doc_filter.items():
+            if field in self._field_rows:
+                rows = self._field_rows[field].get(value, set())
+            else:
+                live = np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))
+                ids = np.fromiter(self._row_of, dtype=np.int64, count=len(self._row_of))
+                rows = set(live[self.chunks.matches(ids, field, value)].tolist())
+            selected = set(rows) if selected is None else selected & rows
+        return np.fromiter(sorted(selected), dtype=np.int64, count=len(selected))
+
+
+    def _graph(self, hnsw, queries, k, rows):
+        allowed = None if rows is None else set(rows.tolist())
+        # hnswlib can't search while the graph is being resized, so graph queries share the write lock
+        with self._lock:
+            try:
+                labels, distances = hnsw.knn_query(queries, k=k, num_threads=1,
+                                                   filter=None if allowed is None else allowed.__contains__)
+            except RuntimeError:
+                return None  # fewer than k reachable through the graph; the exact scan finds them
+        return [list(zip(labels[i].tolist(), (1 - distances[i]).tolist())) for i in range(len(queries))]
+
+
+    def _cached(self, key):
+        with self._cache_lock:
+            return self._cache.get(key)
+
+
+    def _block(self, epoch, matrix, scales, start, end) -> np.ndarray:
+        # Rows [start, end) as float32. Written rows never change, so converted blocks are kept while the
+        # cache has room; converting float16/int8 costs more than the matrix product itself.
+        key = (epoch, start, end)
+        block = self._cached(key)
+        if block is not None: return block
+        block = matrix[start:end].astype(np.float32)
+        if scales is not None:
+            block *= scales[start:end, None]
+        with self._cache_lock:
+            # A partial last block is superseded once more rows are appended
+            for stale in [k for k in self._cache if k[0] != epoch or (k[1] == start and k[2] != end)]:
+                self._cache_used -= self._cache.pop(stale).nbytes
+            if self._cache_used + block.nbytes <= self.cache_bytes:
+                self._cache[key] = block
+                self._cache_used += block.nbytes
+        return block
+
+
+    def _exact(self, queries, k, matrix, scales, n, rows, live, epoch):
+        total = n if rows is None else len(rows)
+        scores = np.empty((total, len(queries)), dtype=np.float32)
+        for start in range(0, n, self.block_rows):
+            end = min(start + self.block_rows, n)
+            if rows is None:
+                scores[start:end] = self._block(epoch, matrix, scales, start, end) @ queries.T
+                continue
+            # Filtered: only the selected rows, read from a cached block if there is one
+            lo, hi = np.searchsorted(rows, [start, end])
+            if lo == hi: continue
+            selected, cached = rows[lo:hi], self._cached((epoch, start, end))
+            if cached is not None:
+                block = cached[selected - start]
+            else:
+                block = matrix[selected].astype(np.float32)
+                if scales is not None:
+                    block *= scales[selected, None]
+            scores[lo:hi] = block @ queries.T
+        if live is not None:
+            scores[~live] = -np.inf
+        hits = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top], kind="stable")]
+            found = [(int(i if rows is None else rows[i]), float(column[i])) for i in top]
+            hits.append([(row, score) for row, score in found if score > -np.inf])
+        return hits
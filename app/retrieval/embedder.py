@@ -1,30 +1,102 @@
-from openai import OpenAI
+from app import tracing
 from app.config import settings
-import time
+from app.ingestion.preprocessor import TextPreprocessor
+from app.retrieval.clients import openai_client
+from app.retrieval.embedding_cache import EmbeddingCache
 
+# Native output sizes; text-embedding-3 models can also be asked for fewer dimensions
+OPENAI_DIMENSIONS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
 
-class EmbeddingService:
+
+class OpenAIEmbeddingBackend:
     def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
-        self.model = settings.embedding_model
-        self.batch_size = 100
+        from app.retrieval.embed_scheduler import EmbeddingScheduler  # imports openai
+        # Retries are handled by the scheduler so they respect the shared rate limits
+        self.client = openai_client(max_retries=0)
+        self.model_name = settings.embedding_model
+        native = OPENAI_DIMENSIONS.get(self.model_name, 1536)
+        self.dimension = settings.embedding_dimension or native
+        self.scheduler = EmbeddingScheduler(
+            self.client, self.model_name, TextPreprocessor(self.model_name),
+            max_batch_tokens=settings.embedding_batch_tokens,
+            max_in_flight=settings.embedding_max_in_flight,
+            rpm=settings.embedding_rpm, tpm=settings.embedding_tpm,
+            dimensions=self.dimension if self.dimension != native else None,
+        )
+
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return self.scheduler.embed(texts)
+
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.scheduler.embed([text])[0]
+
+
+def create_embedding_backend():
+    if settings.embedding_backend == "openai":
+        return OpenAIEmbeddingBackend()
+    if settings.embedding_backend == "local":
+        from app.retrieval.local_embedder import LocalEmbeddingBackend  # torch is only imported when selected
+        return LocalEmbeddingBackend()
+    raise ValueError(f"Unsupported embedding backend: {settings.embedding_backend}")
 
 
+class EmbeddingService:
+    def __init__(self, backend=None):
+        self.backend = backend or create_embedding_backend()
+        self.model = self.backend.model_name
+        self.dimension = self.backend.dimension
+        self.cache = None
+        if settings.embedding_cache_path:
+            self.cache = EmbeddingCache(settings.embedding_cache_path,
+                                        max_entries=settings.embedding_cache_max_entries,
+                                        hot_size=settings.query_embedding_cache_size)
+
+
+    def _cache_key(self, text: str) -> str:
+        return EmbeddingCache.key(self.model, self.dimension, text)
+
+
+    @tracing.traced("EmbeddingService.embed_text")
     def embed_text(self, text: str) -> list[float]:
-        response = self.client.embeddings.create(model=self.model, input=text)
-        return response.data[0].embedding
+        if self.cache is None:
+            return self.backend.embed_query(text)
+        # Queries repeat a lot, so check the in-process tier before SQLite
+        key = self._cache_key(text)
+        embedding = self.cache.get_hot(key) or self.cache.get_many([key]).get(key)
+        if embedding is None:
+            embedding = self.backend.embed_query(text)
+            self.cache.put_many({key: embedding})
+        self.cache.put_hot(key, embedding)
+        return embedding
+
+
+    @tracing.traced("EmbeddingService.embed_queries")
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        # embed_text for many queries: hot-tier hits are served locally, the rest go out as one batch
+        if self.cache is None:
+            return self.backend.embed(texts)
+        keys = [self._cache_key(t) for t in texts]
+        hot = {k: e for k in keys if (e := self.cache.get_hot(k)) is not None}
+        missing = [t for k, t in zip(keys, texts) if k not in hot]
+        fresh = dict(zip([k for k in keys if k not in hot], self.embed_batch(missing))) if missing else {}
+        for key, embedding in fresh.items():
+            self.cache.put_hot(key, embedding)
+        return [hot.get(k) or fresh[k] for k in keys]
 
 
+    @tracing.traced("EmbeddingService.embed_batch")
     def embed_batch(self, texts: list[str]) -> list[list[float]]:
-        all_embeddings = []
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i+self.batch_size]
-            for attempt in range(3):  # Retry with exponential backoff
-                try:
-                    response = self.client.embeddings.create(model=self.model, input=batch)
-                    all_embeddings.extend([d.embedding for d in response.data])
-                    break
-                except Exception as e:
-                    if attempt < 2: time.sleep(2 ** attempt)
-                    else: raise
-        return all_embeddings
+        if self.cache is None:
+            return self.backend.embed(texts)
+        # Only cache misses go over the wire; results are merged back in input order
+        keys = [self._cache_key(t) for t in texts]
+        cached = self.cache.get_many(keys)
+        missing = list({k: t for k, t in zip(keys, texts) if k not in cached}.items())
+        if missing:
+            embeddings = self.backend.embed([t for _, t in missing])
+            fresh = {k: e for (k, _), e in zip(missing, embeddings)}
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+        return [cached[k] for k in keys]
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import hashlib, os, sqlite3, threading, time
+import numpy as np
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: SQLite on disk with LRU eviction, plus a small in-process hot tier."""
+
+    def __init__(self, path, max_entries=200_000, hot_size=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.hot_size = hot_size
+        self.hits = self.misses = self.hot_hits = 0
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                         "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+    @staticmethod
+    def key(model: str, dimension: int, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{model}\0{dimension}\0{normalized}".encode()).hexdigest()
+
+
+    def get_hot(self, key):
+        with self._lock:
+            vector = self._hot.get(key)
+            if vector is not None:
+                self._hot.move_to_end(key)
+                self.hot_hits += 1
+                self.hits += 1
+            return vector
+
+
+    def put_hot(self, key, vector):
+        with self._lock:
+            self._hot[key] = vector
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+                batch = unique[i:i+500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in found])
+                self._db.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+
+    def put_many(self, items: dict[str, list[float]]):
+        if not items: return
+        now = time.time()
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()])
+            self._count += self._db.total_changes - before
+            if self._count > self.max_entries:
+                # Evict least recently used entries
+                excess = self._count - self.max_entries
+                self._db.execute("DELETE FROM embeddings WHERE key IN "
+                                 "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                self._count -= excess
+            self._db.commit()
+
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hot_hits": self.hot_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._count, "hot_entries": len(self._hot)}
@@ -0,0 +1,5 @@
+def normalize_filter(doc_filter) -> dict | None:
+    # Callers pass either a bare doc_id or a {payload_field: value} dict
+    if not doc_filter: return None
+    if isinstance(doc_filter, str): return {"doc_id": doc_filter}
+    return dict(doc_filter)
@@ -0,0 +1,35 @@
+from collections import Counter
+import threading
+
+
+class IndexGeneration:
+    """Counts index writes, overall and per doc_id, so cached answers can tell when their inputs changed.
+
+    In-process only: a store written by another process (e.g. the ingestion CLI) is not seen here,
+    which is what the answer cache's TTL is for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total = 0
+        self._docs = Counter()
+        self._unscoped = 0  # writes whose documents aren't known, e.g. a whole index reload
+
+
+    def bump(self, doc_ids=None):
+        with self._lock:
+            self._total += 1
+            if doc_ids is None:
+                self._unscoped += 1
+            else:
+                for doc_id in set(doc_ids):
+                    self._docs[doc_id] += 1
+
+
+    def token(self, doc_id=None):
+        # An answer restricted to one document only depends on writes to that document
+        with self._lock:
+            return self._total if doc_id is None else (self._docs[doc_id], self._unscoped)
+
+
+index_generation = IndexGeneration()
@@ -1,27 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading, time
+from loguru import logger
+from app import tracing
+from app.config import settings
+from app.retrieval.chunk_store import shared_chunk_store
+from app.retrieval.filters import normalize_filter
+
+
+class HybridResults(list):
+    """Fused results; partial is set when a leg timed out or failed and its results are missing."""
+
+    def __init__(self, results=(), missing=()):
+        super().__init__(results)
+        self.missing = list(missing)
+        self.partial = bool(self.missing)
+
+
 class HybridRetriever:
-    def __init__(self, vector_store, bm25_store):
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, vector_store, bm25_store, leg_timeout=None, chunks=None):
         self.vector_store = vector_store
         self.bm25_store = bm25_store
+        # Both legs return ids into the same chunk store; the fused results are read from it
+        if chunks is None:
+            chunks = getattr(vector_store, "chunks", None) or shared_chunk_store()
+        self.chunks = chunks
         self.rrf_k = 60  # Standard RRF constant
+        self.leg_timeout = settings.hybrid_leg_timeout_ms / 1000 if leg_timeout is None else leg_timeout
+
+
+    @classmethod
+    def _executor(cls):
+        # One pool for every retriever; a leg that overruns its timeout keeps a worker until it finishes
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(max_workers=settings.hybrid_workers, thread_name_prefix="hybrid")
+            return cls._pool
+
 
+    @tracing.traced("HybridRetriever.search")
+    def search(self, query, top_k=5, doc_filter=None) -> HybridResults:
+        # Both legs filter before scoring, so each returns a full list from the matching partition
+        doc_filter = normalize_filter(doc_filter)
+        results, missing = self._run_legs({
+            "vector": lambda: self.vector_store.search(query, top_k=20, doc_filter=doc_filter),
+            "bm25": lambda: self.bm25_store.search(query, top_k=20, doc_filter=doc_filter),
+        })
+        return self._fuse(results, missing, top_k)
 
-    def search(self, query, top_k=5, doc_filter=None):
-        vector_results = self.vector_store.search(query, top_k=20, doc_filter=doc_filter)
-        bm25_results = self.bm25_store.search(query, top_k=20, doc_filter=doc_filter)
 
+    @tracing.traced("HybridRetriever.search_batch")
+    def search_batch(self, queries, top_k=5, doc_filter=None) -> list[HybridResults]:
+        # Each leg handles all queries in one call; fusion is per query, as in search()
+        doc_filter = normalize_filter(doc_filter)
+        results, missing = self._run_legs({
+            "vector": lambda: self.vector_store.search_batch(queries, top_k=20, doc_filter=doc_filter),
+            "bm25": lambda: self.bm25_store.search_batch(queries, top_k=20, doc_filter=doc_filter),
+        })
+        return [self._fuse({name: leg[i] for name, leg in results.items()}, missing, top_k)
+                for i in range(len(queries))]
 
-        rrf_scores = {}  # text_key -> {score, data}
-        for rank, r in enumerate(vector_results, 1):
-            key = r["text"][:100]
-            rrf_scores.setdefault(key, {"score": 0, "data": r})
-            rrf_scores[key]["score"] += 1.0 / (self.rrf_k + rank)
 
+    def _run_legs(self, legs):
+        # The legs run concurrently, so latency is the slower leg rather than the sum
+        pool = self._executor()
+        futures = {name: pool.submit(tracing.bind(fn)) for name, fn in legs.items()}
+        deadline = time.monotonic() + self.leg_timeout
+        results, missing, errors = {}, [], []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                logger.warning(f"Hybrid {name} leg exceeded {self.leg_timeout:.2f}s, fusing without it")
+                missing.append(name)
+            except Exception as e:
+                logger.warning(f"Hybrid {name} leg failed ({type(e).__name__}: {e}), fusing without it")
+                missing.append(name)
+                errors.append(e)
+        if len(errors) == len(legs):
+            raise errors[0]
+        return results, missing
 
-        for rank, r in enumerate(bm25_results, 1):
-            key = r["text"][:100]
-            rrf_scores.setdefault(key, {"score": 0, "data": r})
-            rrf_scores[key]["score"] += 1.0 / (self.rrf_k + rank)
 
+    @tracing.traced("HybridRetriever.fuse")
+    def _fuse(self, results, missing, top_k) -> HybridResults:
+        # RRF over chunk ids; only the fused top_k are read from the chunk store
+        rrf_scores = {}  # chunk id -> fused score, in first-seen order so ties keep the vector leg's order
+        vector_scores, bm25_scores = {}, {}  # chunk id -> leg score (and rank)
+        for name in ("vector", "bm25"):
+            hits = results.get(name)
+            if hits is None: continue
+            for rank, (chunk_id, score) in enumerate(zip(hits.ids.tolist(), hits.scores.tolist()), 1):
+                rrf_scores[chunk_id] = rrf_scores.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank)
+                if name == "vector": vector_scores[chunk_id] = score
+                else: bm25_scores[chunk_id] = score, rank
 
-        sorted_results = sorted(rrf_scores.values(), key=lambda x: x["score"], reverse=True)
-        return [{"hybrid_score": item["score"], **item["data"]} for item in sorted_results[:top_k]]
+        ranked = sorted(rrf_scores, key=rrf_scores.__getitem__, reverse=True)
+        fused, start = [], 0
+        while len(fused) < top_k and start < len(ranked):
+            batch = ranked[start:start + top_k - len(fused)]
+            start += len(batch)
+            for chunk_id, chunk in zip(batch, self.chunks.hydrate(batch)):
+                if chunk is None: continue  # deleted after the leg found it
+                result = {"hybrid_score": rrf_scores[chunk_id], **chunk}
+                if chunk_id in vector_scores:
+                    result["score"] = vector_scores[chunk_id]
+                if chunk_id in bm25_scores:
+                    result["bm25_score"], result["bm25_rank"] = bm25_scores[chunk_id]
+                fused.append(result)
+        return HybridResults(fused, missing=missing)
@@ -0,0 +1,85 @@
+from concurrent.futures import Future
+import queue, threading, time
+from loguru import logger
+from app.config import settings
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-text requests into one model call."""
+
+    def __init__(self, fn, max_batch=32, max_wait=0.002):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True, name="embed-batcher")
+        self._worker.start()
+
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0: break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                results = self.fn([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class LocalEmbeddingBackend:
+    """sentence-transformers model on CPU, optionally through ONNX Runtime or int8 dynamic quantization."""
+
+    def __init__(self, model_name=None, threads=None, runtime=None, quantize=None, batch_size=None, batch_wait_ms=None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name or settings.local_embedding_model
+        threads = settings.local_embedding_threads if threads is None else threads
+        runtime = runtime or settings.local_embedding_runtime
+        quantize = settings.local_embedding_quantize if quantize is None else quantize
+        self.batch_size = batch_size or settings.local_embedding_batch_size
+        if threads:
+            torch.set_num_threads(threads)
+
+        if runtime == "onnx":
+            # Needs `pip install sentence-transformers[onnx]`; quantized repos ship e.g. onnx/model_qint8_avx512_vnni.onnx
+            model_kwargs = {"file_name": settings.local_embedding_onnx_file} if settings.local_embedding_onnx_file else None
+            self._model = SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+        elif runtime == "torch":
+            self._model = SentenceTransformer(self.model_name, device="cpu")
+            if quantize:
+                self._model = torch.ao.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            raise ValueError(f"Unsupported local embedding runtime: {runtime}")
+        self.dimension = self._model.get_sentence_embedding_dimension()
+        logger.info(f"Loaded {self.model_name} ({runtime}{', int8' if quantize and runtime == 'torch' else ''}, "
+                    f"{self.dimension}-d, {torch.get_num_threads()} threads)")
+
+        wait_ms = settings.local_embedding_batch_wait_ms if batch_wait_ms is None else batch_wait_ms
+        self._batcher = MicroBatcher(self.embed, max_batch=self.batch_size, max_wait=wait_ms / 1000)
+
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        # encode() sorts by length internally, so padding per batch stays small
+        return self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                  convert_to_numpy=True, show_progress_bar=False).tolist()
+
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._batcher.submit(text).result()
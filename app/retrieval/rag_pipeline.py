@@ -1,53 +1,231 @@
-from openai import OpenAI
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import asdict, dataclass, field, replace
+from typing import Iterator
+import threading, time
+from loguru import logger
 
+from app import tracing
 from app.config import settings
-from app.retrieval.vector_store import VectorStore
+from app.retrieval.answer_cache import AnswerCache
+from app.retrieval.bm25_store import BM25Store
+from app.retrieval.clients import openai_client
+from app.retrieval.context_packer import ContextPacker
+from app.retrieval.hybrid import HybridResults, HybridRetriever
+from app.retrieval.vector_store import create_vector_store
 
 @dataclass
 class RAGResponse:
     answer: str
     sources: list[dict]
     query: str
+    cached: bool = False
+    context: dict | None = None  # PackedContext.stats(): prompt tokens before and after packing
+    timings: dict | None = None  # seconds per traced stage, when tracing is enabled
+    partial: bool = False  # a retrieval leg timed out or failed; the answer is from the others only
+    missing: list[str] = field(default_factory=list)  # the legs that are missing
+
+
+@dataclass
+class StreamMetrics:
+    retrieval_s: float = 0.0
+    ttft_s: float | None = None  # query start to first answer token, what the user waits for
+    llm_ttft_s: float | None = None  # completion request to first token
+    tokens: int = 0
+    tokens_per_s: float = 0.0  # after the first token
+    total_s: float = 0.0
+    context_tokens: int = 0
+    context_saved_tokens: int = 0  # removed by the context packer (overlap, merged labels, budget)
+    cached: bool = False
+    cancelled: bool = False
+    partial: bool = False  # as in RAGResponse
+    missing: list[str] = field(default_factory=list)
+
+
+def degraded(results) -> tuple[bool, list[str]]:
+    # (partial, missing legs) of retrieval results; plain lists come from retrievers without legs
+    return getattr(results, "partial", False), list(getattr(results, "missing", ()))
+
+
+SYSTEM_PROMPT = """Answer based on the provided context only.
+If the answer isn't in the context, say so clearly.
+Cite sources using [Source N] references. Be concise but thorough."""
 
 
 class RAGPipeline:
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.llm = OpenAI(api_key=settings.openai_api_key)
+    def __init__(self, vector_store=None, bm25_store=None, reranker=None, llm=None, answer_cache=None,
+                 context_packer=None):
+        self.vector_store = vector_store or create_vector_store()
+        if bm25_store is None:
+            bm25_store = BM25Store()
+            bm25_store.load()
+        self.retriever = HybridRetriever(self.vector_store, bm25_store)
+        if reranker is None and settings.rerank_backend != "none":
+            from app.retrieval.reranker import Reranker  # the local backend pulls in torch
+            try:
+                reranker = Reranker()
+            except (ImportError, OSError) as e:
+                # Missing torch/cohere or a model that can't be downloaded: answer from fused order instead
+                logger.warning(f"Reranker '{settings.rerank_backend}' unavailable, serving without reranking: {e}")
+        self.reranker = reranker
+        self.llm = llm or openai_client()
+        if answer_cache is None and settings.answer_cache_size > 0:
+            answer_cache = AnswerCache()
+        self.answer_cache = answer_cache
+        self.context_packer = context_packer or ContextPacker()
+        self.stream_metrics = deque(maxlen=1000)  # most recent query_stream requests
 
 
     def query(self, question: str, doc_filter=None, top_k=5) -> RAGResponse:
-        # Step 1: Retrieve relevant chunks
-        results = self.vector_store.search(question, top_k, doc_filter)
-        if not results:
-            return RAGResponse(answer="No relevant info found.", sources=[], query=question)
+        with tracing.span("RAGPipeline.query", top_k=top_k) as span:
+            response = self._query(question, doc_filter, top_k)
+            span.set(cached=response.cached)
+        timings = span.breakdown()
+        return response if timings is None else replace(response, timings=timings)
 
 
-        # Step 2: Build context with source labels
-        context_parts = []
-        for i, r in enumerate(results):
-            label = f"[Source {i+1}] Section: {r['section_title']} (Page {r['page_number']})"
-            context_parts.append(f"{label}\n{r['text']}")
-        context = "\n\n---\n\n".join(context_parts)
+    def _query(self, question, doc_filter, top_k):
+        cache = self.answer_cache
+        if cache is None:
+            return self._answer(question, doc_filter, top_k)
+        generation = cache.generation(doc_filter)
+        # The query embedding lands in the embedder's hot tier, so retrieval on a miss reuses it
+        embedding = self.vector_store.embedder.embed_text(question) if cache.semantic else None
+        cached = cache.get(question, doc_filter, top_k, embedding)
+        if cached is not None:
+            return replace(cached, query=question, cached=True)
+        response = self._answer(question, doc_filter, top_k)
+        if not response.partial:  # a degraded answer would outlive the failed leg's recovery
+            cache.put(question, response, doc_filter, top_k, embedding, generation)
+        return response
 
 
-        # Step 3: Generate answer
-        system = """Answer based on the provided context only.
-If the answer isn't in the context, say so clearly.
-Cite sources using [Source N] references. Be concise but thorough."""
+    def query_stream(self, question: str, doc_filter=None, top_k=5, cancel: threading.Event = None) -> Iterator[dict]:
+        """Yields {"type": "sources"}, then {"type": "token"} events as the answer streams, then {"type": "done"}.
+
+        Closing the generator (a client disconnect) or setting cancel stops generation and closes the
+        completion stream, so the model stops producing tokens nobody will read.
+        """
+        metrics, start = StreamMetrics(), time.perf_counter()
+        cache = self.answer_cache
+        if cache is not None:
+            generation = cache.generation(doc_filter)
+            embedding = self.vector_store.embedder.embed_text(question) if cache.semantic else None
+            cached = cache.get(question, doc_filter, top_k, embedding)
+            if cached is not None:
+                metrics.cached = True
+                yield {"type": "sources", "sources": cached.sources, "partial": False, "missing": []}
+                metrics.ttft_s = time.perf_counter() - start
+                yield {"type": "token", "text": cached.answer}
+                yield from self._finish(metrics, start)
+                return
 
+        results = self._retrieve(question, doc_filter, top_k)
+        metrics.retrieval_s = time.perf_counter() - start
+        metrics.partial, metrics.missing = degraded(results)
+        marks = {"partial": metrics.partial, "missing": metrics.missing}
+        if not results:
+            yield {"type": "sources", "sources": [], **marks}
+            yield {"type": "token", "text": "No relevant info found."}
+            yield from self._finish(metrics, start)
+            return
+        messages, packed = self._messages(question, results)
+        metrics.context_tokens, metrics.context_saved_tokens = packed.tokens, packed.saved_tokens
+        yield {"type": "sources", "sources": packed.sources, **marks}
 
-        response = self.llm.chat.completions.create(
-            model=settings.llm_model,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
-            ],
-            temperature=0.1, max_tokens=1000
+        requested = time.perf_counter()
+        stream = self.llm.chat.completions.create(
+            model=settings.llm_model, messages=messages,
+            temperature=0.1, max_tokens=1000, stream=True, stream_options={"include_usage": True}
         )
+        parts, usage_tokens, closed = [], None, False
+        try:
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    metrics.cancelled = True
+                    break
+                if chunk.usage is not None:
+                    usage_tokens = chunk.usage.completion_tokens
+                if not chunk.choices or not chunk.choices[0].delta.content: continue
+                if metrics.ttft_s is None:
+                    first = time.perf_counter()
+                    metrics.ttft_s, metrics.llm_ttft_s = first - start, first - requested
+                parts.append(chunk.choices[0].delta.content)
+                yield {"type": "token", "text": parts[-1]}
+        except GeneratorExit:
+            metrics.cancelled = closed = True
+            raise
+        finally:
+            stream.close()  # drops the HTTP connection if we stopped early
+            metrics.tokens = usage_tokens or len(parts)
+            if metrics.ttft_s is not None and len(parts) > 1:
+                metrics.tokens_per_s = (metrics.tokens - 1) / max(time.perf_counter() - first, 1e-9)
+            if closed:
+                self._record(metrics, start)  # nobody is left to receive a done event
+
+        if cache is not None and not metrics.cancelled and not metrics.partial:
+            cache.put(question, RAGResponse(answer="".join(parts), sources=packed.sources, query=question,
+                                            context=packed.stats()),
+                      doc_filter, top_k, embedding, generation)
+        yield from self._finish(metrics, start)
+
+
+    def _finish(self, metrics, start):
+        self._record(metrics, start)
+        yield {"type": "done", "metrics": asdict(metrics)}
+
+
+    def _record(self, metrics, start):
+        metrics.total_s = time.perf_counter() - start
+        self.stream_metrics.append(metrics)
+        # Streams get no spans: a span held open across yields would outlive the context that set it
+        tracing.observe("RAGPipeline.query_stream", metrics.total_s)
+        ttft = f"{metrics.ttft_s * 1000:.0f}ms" if metrics.ttft_s is not None else "n/a"
+        logger.info(f"query_stream ttft={ttft} tokens={metrics.tokens} tok/s={metrics.tokens_per_s:.1f} "
+                    f"context={metrics.context_tokens} (-{metrics.context_saved_tokens}) total={metrics.total_s:.2f}s cached={metrics.cached} cancelled={metrics.cancelled}")
+
+
+    def _retrieve(self, question, doc_filter, top_k):
+        # A wide hybrid candidate set narrowed down by the reranker
+        if self.reranker:
+            candidates = self.retriever.search(question, settings.top_k_retrieval, doc_filter)
+            with tracing.span("Reranker.rerank", candidates=len(candidates)):
+                reranked = self.reranker.rerank(question, candidates, top_k)
+            # Still marked when a leg was missing from the candidates
+            return HybridResults(reranked, missing=degraded(candidates)[1])
+        return self.retriever.search(question, top_k, doc_filter)
+
+
+    def _messages(self, question, results):
+        # Context with source labels, packed into the token budget; packed.sources match the labels
+        with tracing.span("ContextPacker.pack"):
+            packed = self.context_packer.pack(results)
+        logger.debug(f"Context {packed.tokens} tokens, saved {packed.saved_tokens} of {packed.raw_tokens} "
+                     f"({packed.dropped} results over budget)")
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Context:\n{packed.text}\n\nQuestion: {question}"}
+        ], packed
+
+
+    def _answer(self, question: str, doc_filter=None, top_k=5) -> RAGResponse:
+        # Step 1: Retrieve relevant chunks
+        results = self._retrieve(question, doc_filter, top_k)
+        partial, missing = degraded(results)
+        if not results:
+            return RAGResponse(answer="No relevant info found.", sources=[], query=question, partial=partial,
+                               missing=missing)
+
+
+        # Step 2: Generate answer from the labelled context
+        messages, packed = self._messages(question, results)
+        with tracing.span("LLM.completion", model=settings.llm_model, context_tokens=packed.tokens):
+            response = self.llm.chat.completions.create(
+                model=settings.llm_model,
+                messages=messages,
+                temperature=0.1, max_tokens=1000
+            )
 
         return RAGResponse(
             answer=response.choices[0].message.content,
-            sources=results, query=question
+            sources=packed.sources, query=question, context=packed.stats(), partial=partial, missing=missing
         )
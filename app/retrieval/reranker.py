@@ -0,0 +1,127 @@
+from collections import OrderedDict
+import hashlib, threading
+from loguru import logger
+from app.config import settings
+
+
+def padded_batches(lengths: list[int], max_tokens: int) -> list[list[int]]:
+    # Sorting by length keeps padding small; a batch grows while batch size x longest pair fits the budget
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches, current = [], []
+    for i in order:
+        if current and (len(current) + 1) * lengths[i] > max_tokens:
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current: batches.append(current)
+    return batches
+
+
+class CohereRerankBackend:
+    def __init__(self, model_name=None):
+        import cohere
+        self.client = cohere.Client(api_key=settings.cohere_api_key)
+        self.model_name = model_name or settings.cohere_rerank_model
+
+
+    def score(self, query: str, passages: list[str]) -> list[float]:
+        # The API batches server side: one request per call, scores returned in input order
+        response = self.client.rerank(model=self.model_name, query=query, documents=passages, top_n=len(passages))
+        scores = [0.0] * len(passages)
+        for result in response.results:
+            scores[result.index] = result.relevance_score
+        return scores
+
+
+class LocalCrossEncoderBackend:
+    """sentence-transformers CrossEncoder on CPU, fed length-sorted batches under a padded-token budget."""
+
+    def __init__(self, model_name=None, batch_tokens=None, max_length=512, threads=None):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name or settings.local_rerank_model
+        self.batch_tokens = batch_tokens or settings.rerank_batch_tokens
+        self.max_length = max_length
+        threads = settings.local_embedding_threads if threads is None else threads
+        if threads:
+            torch.set_num_threads(threads)
+        self._model = CrossEncoder(self.model_name, device="cpu", max_length=max_length)
+        logger.info(f"Loaded {self.model_name} ({torch.get_num_threads()} threads)")
+
+
+    def score(self, query: str, passages: list[str]) -> list[float]:
+        lengths = [len(ids) for ids in self._model.tokenizer([query] * len(passages), passages, truncation=True,
+                                                             max_length=self.max_length)["input_ids"]]
+        scores = [0.0] * len(passages)
+        for batch in padded_batches(lengths, self.batch_tokens):
+            predicted = self._model.predict([(query, passages[i]) for i in batch], batch_size=len(batch),
+                                            show_progress_bar=False, convert_to_numpy=True)
+            for i, score in zip(batch, predicted.tolist()):
+                scores[i] = score
+        return scores
+
+
+def create_rerank_backend():
+    if settings.rerank_backend == "cohere":
+        return CohereRerankBackend()
+    if settings.rerank_backend == "local":
+        return LocalCrossEncoderBackend()
+    raise ValueError(f"Unsupported rerank backend: {settings.rerank_backend}")
+
+
+class Reranker:
+    def __init__(self, backend=None, cache_size=None, round_size=None, early_stop=None):
+        self.backend = backend or create_rerank_backend()
+        self.cache_size = settings.rerank_cache_size if cache_size is None else cache_size
+        self.round_size = round_size or settings.rerank_round_size
+        self.early_stop = settings.rerank_early_stop if early_stop is None else early_stop
+        self._cache = OrderedDict()  # (query hash, chunk id) -> score, least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+
+    def _key(self, query_hash, candidate):
+        # Chunk ids are stable across re-ingests; fall back to the text for results that lack one
+        return query_hash, candidate.get("chunk_id") or hashlib.sha256(candidate["text"].encode()).hexdigest()
+
+
+    def rerank(self, query: str, candidates: list[dict], top_k=None) -> list[dict]:
+        """Returns the top_k candidates by cross-encoder score, each with a rerank_score."""
+        top_k = top_k or settings.top_k_rerank
+        query_hash = hashlib.sha256(query.encode()).hexdigest()
+        scored, top = {}, []
+        # Candidates arrive in retrieval order, so with early stopping the lower ranks are the ones skipped.
+        # Without it everything is scored in one call, which gives the backend the largest batches.
+        step = self.round_size if self.early_stop else max(len(candidates), 1)
+        for start in range(0, len(candidates), step):
+            round_idx = range(start, min(start + step, len(candidates)))
+            scored.update(self._score(query, query_hash, candidates, round_idx))
+            previous, top = top, sorted(scored, key=lambda i: (-scored[i], i))[:top_k]
+            if self.early_stop and len(previous) == top_k and previous == top:
+                logger.debug(f"Rerank stopped early after {len(scored)} of {len(candidates)} candidates")
+                break
+        return [{**candidates[i], "rerank_score": scored[i]} for i in top]
+
+
+    def _score(self, query, query_hash, candidates, indices) -> dict:
+        keys = {i: self._key(query_hash, candidates[i]) for i in indices}
+        scores, missing = {}, []
+        with self._lock:
+            for i, key in keys.items():
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                else:
+                    missing.append(i)
+            self.hits += len(scores)
+            self.misses += len(missing)
+        if missing:
+            fresh = self.backend.score(query, [candidates[i]["text"] for i in missing])
+            with self._lock:
+                for i, score in zip(missing, fresh):
+                    scores[i] = self._cache[keys[i]] = score
+                    self._cache.move_to_end(keys[i])
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
@@ -1,53 +1,199 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue
-import uuid
+# qdrant_client takes ~2s to import, so its models are imported in the methods that build requests
+import threading, weakref
+import numpy as np
+from loguru import logger
+from app import tracing
 from app.config import settings
+from app.retrieval.chunk_store import Hits, shared_chunk_store
+from app.retrieval.clients import qdrant_client
 from app.retrieval.embedder import EmbeddingService
+from app.retrieval.filters import normalize_filter
+from app.retrieval.generation import index_generation
 from app.ingestion.chunker import Chunk
 
+def matryoshka(vector, dimension: int) -> list[float]:
+    # Leading dimensions of a Matryoshka embedding, re-normalized: a smaller embedding of the same text
+    head = np.asarray(vector[:dimension], dtype=np.float32)
+    return (head / (np.linalg.norm(head) or 1.0)).tolist()
+
+
+def create_vector_store(embedder=None):
+    if settings.vector_backend == "qdrant":
+        return VectorStore(embedder=embedder)
+    if settings.vector_backend == "embedded":
+        from app.retrieval.embedded_store import EmbeddedVectorStore
+        return EmbeddedVectorStore(embedder=embedder)
+    raise ValueError(f"Unsupported vector backend: {settings.vector_backend}")
+
+
+def _layout(sizes: dict) -> str:
+    return " + ".join(f"{name}[{size}]" if name else f"[{size}]" for name, size in sorted(sizes.items()))
+
+
+def _quantization_kind(config) -> str:
+    from qdrant_client.models import BinaryQuantization, ScalarQuantization
+    if config is None: return "none"
+    if isinstance(config, ScalarQuantization): return "scalar"
+    if isinstance(config, BinaryQuantization): return "binary"
+    return type(config).__name__
+
+
+# Collections known to exist, per client: only the first VectorStore on a client pays the round trips
+_known_collections = weakref.WeakKeyDictionary()
+_known_lock = threading.Lock()
+
+
 class VectorStore:
-    def __init__(self):
-        self.client = QdrantClient(host=settings.qdrant_host, port=settings.qdrant_port)
+    """Qdrant points keyed by ChunkStore id; searches return Hits.
+
+    Payloads keep the whole chunk, though searches don't fetch them: they are what restore_chunks() rebuilds
+    a lost chunk store from.
+    """
+
+    def __init__(self, client=None, embedder=None, chunks=None):
+        self.client = client or qdrant_client()
+        self.chunks = chunks if chunks is not None else shared_chunk_store()
         self.collection = settings.collection_name
-        self.embedder = EmbeddingService()
-        self._ensure_collection()
+        self.embedder = embedder or EmbeddingService()
+        coarse = settings.matryoshka_dimension
+        self.coarse_dimension = coarse if 0 < coarse < self.embedder.dimension else 0
+        with _known_lock:
+            known = self.collection in _known_collections.get(self.client, ())
+            if not known:
+                self._ensure_collection()
+                _known_collections.setdefault(self.client, set()).add(self.collection)
+                if not self.chunks.count and self.client.count(self.collection, exact=False).count:
+                    logger.warning(f"Chunk store {self.chunks.path or '(memory)'} is empty but "
+                                   f"{self.collection} has points; restoring it from their payloads")
+                    self.restore_chunks()
 
 
     def _ensure_collection(self):
+        from qdrant_client.models import VectorParams, Distance, HnswConfigDiff, KeywordIndexParams, KeywordIndexType
         distance_metric = Distance.COSINE
-        vector_dimension = settings.embedding_dimension
+        vector_dimension = self.embedder.dimension  # follows the configured embedding model
         collection_name = settings.collection_name
 
         # Create collection with cosine distance if not exists
         existing = [c.name for c in self.client.get_collections().collections]
         if collection_name not in existing:
+            vectors_config = VectorParams(size=vector_dimension, distance=distance_metric,
+                                          on_disk=settings.qdrant_on_disk)
+            quantization_config = self._quantization_config()
+            if self.coarse_dimension:
+                # Graph and quantization only on the coarse vector; the full one is read just to rescore
+                vectors_config = {
+                    "coarse": VectorParams(size=self.coarse_dimension, distance=distance_metric,
+                                           quantization_config=quantization_config),
+                    "full": VectorParams(size=vector_dimension, distance=distance_metric, on_disk=True,
+                                         hnsw_config=HnswConfigDiff(m=0)),
+                }
+                quantization_config = None
+            # payload_m builds extra HNSW links per doc_id partition so single-filing queries
+            # traverse only that filing's graph; m keeps the global graph for unfiltered search
             self.client.create_collection(
                 collection_name=collection_name,
-                vectors_config=VectorParams(size=vector_dimension, distance=distance_metric)
+                vectors_config=vectors_config,
+                hnsw_config=HnswConfigDiff(m=settings.hnsw_m, ef_construct=settings.hnsw_ef_construct,
+                                           payload_m=settings.hnsw_payload_m),
+                quantization_config=quantization_config
+            )
+
+            # doc_id is the tenant key: Qdrant co-locates each document's points on disk
+            self.client.create_payload_index(
+                collection_name=collection_name,
+                field_name="doc_id",
+                field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True)
             )
 
-            # Create payload indexes on: doc_id, section_title, chunk_type
-            payload_indices = ["doc_id", "section_title", "chunk_type"]
+            # Create payload indexes on: section_title, chunk_type
+            payload_indices = ["section_title", "chunk_type"]
             for field in payload_indices:
                 self.client.create_payload_index(
                     collection_name=collection_name,
                     field_name=field,
                     field_schema={"type": "keyword"}
                 )
+        else:
+            self._check_collection(collection_name)
+
+
+    def _check_collection(self, collection_name):
+        # An existing collection keeps the layout it was created with: writing or searching vectors of another
+        # size or naming fails, or worse, silently returns neighbours from another embedding space
+        config = self.client.get_collection(collection_name).config
+        vectors = config.params.vectors
+        quantization = config.quantization_config
+        if isinstance(vectors, dict):
+            quantization = getattr(vectors.get("coarse"), "quantization_config", None) or quantization
+            found = {name: params.size for name, params in vectors.items()}
+        else:
+            found = {"": vectors.size}
+        expected = {"coarse": self.coarse_dimension, "full": self.embedder.dimension} if self.coarse_dimension \
+            else {"": self.embedder.dimension}
+        if set(found) != set(expected):
+            # Named coarse/full vectors can't be added to (or dropped from) an existing collection in place
+            was = "with coarse/full named vectors" if "coarse" in found else "without a coarse vector"
+            raise ValueError(f"Collection {collection_name} was created {was} but MATRYOSHKA_DIMENSION is "
+                             f"{settings.matryoshka_dimension}; set it back, or set COLLECTION_NAME to a new "
+                             f"collection and re-ingest")
+        if found != expected:
+            raise ValueError(f"Collection {collection_name} holds vectors {_layout(found)} but {self.embedder.model} "
+                             f"writes {_layout(expected)}; set COLLECTION_NAME to a new collection and re-ingest, "
+                             f"or drop {collection_name}")
+        # Local mode accepts but doesn't keep quantization, so only a server's report is checked
+        options = getattr(self.client, "init_options", {})
+        local = options.get("location") == ":memory:" or options.get("path")
+        kind = _quantization_kind(quantization)
+        if not local and kind != settings.qdrant_quantization:
+            raise ValueError(f"Collection {collection_name} was created with {kind} quantization but "
+                             f"QDRANT_QUANTIZATION is {settings.qdrant_quantization}; set it to {kind} "
+                             f"or re-create the collection")
+
+
+
+    def _quantization_config(self):
+        # Quantized vectors stay in RAM even when the originals are on disk
+        from qdrant_client.models import (BinaryQuantization, BinaryQuantizationConfig, ScalarQuantization,
+                                          ScalarQuantizationConfig, ScalarType)
+        if settings.qdrant_quantization == "none":
+            return None
+        if settings.qdrant_quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99,
+                                                                      always_ram=True))
+        if settings.qdrant_quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        raise ValueError(f"Unsupported Qdrant quantization: {settings.qdrant_quantization}")
 
 
+    def _search_params(self):
+        from qdrant_client.models import QuantizationSearchParams, SearchParams
+        quantization = None
+        if settings.qdrant_quantization != "none":
+            quantization = QuantizationSearchParams(rescore=settings.qdrant_rescore,
+                                                    oversampling=settings.qdrant_oversampling)
+        return SearchParams(hnsw_ef=settings.hnsw_ef or None, quantization=quantization)
 
+
+    @tracing.traced("VectorStore.add_chunks")
     def add_chunks(self, chunks: list[Chunk]) -> int:
         # 1. Embed all chunk texts in batch
         chunk_texts = [c.text for c in chunks]
         embeddings = self.embedder.embed_batch(chunk_texts)
+        return self.upsert_embedded(chunks, embeddings)
+
 
-        # 2. Create PointStruct for each (uuid, vector, payload=chunk.to_dict())
+    @tracing.traced("VectorStore.upsert_embedded")
+    def upsert_embedded(self, chunks: list[Chunk], embeddings: list[list[float]]) -> int:
+        # 2. Create PointStruct for each (chunk store id, vector, payload=chunk)
+        from qdrant_client.models import PointStruct
         points_to_upsert = []
-        for chunk, vector in zip(chunks, embeddings):
+        # The id is derived from chunk_id, so re-ingesting a chunk overwrites its point
+        for point_id, chunk, vector in zip(self.chunks.add(chunks).tolist(), chunks, embeddings):
             point = PointStruct(
-                id=str(uuid.uuid4()),
-                vector=vector,
+                id=point_id,
+                vector={"coarse": matryoshka(vector, self.coarse_dimension), "full": list(vector)}
+                if self.coarse_dimension else vector,
                 payload=chunk.to_dict()
             )
             points_to_upsert.append(point)
@@ -56,53 +202,115 @@ class VectorStore:
         for i in range(0, len(points_to_upsert), 100):
             batch = points_to_upsert[i:i+100]
             self.client.upsert(collection_name=self.collection, points=batch)
+        index_generation.bump(c.doc_id for c in chunks)
 
         # Return count of points added
         return len(points_to_upsert)
 
 
-    def search(self, query: str, top_k=20, doc_filter=None) -> list[dict]:
+    @tracing.traced("VectorStore.search")
+    def search(self, query: str, top_k=20, doc_filter=None) -> Hits:
         # 1. Embed the query
         query_vector = self.embedder.embed_text(query)
 
-        # 2. Build optional Filter if doc_filter provided
-        if doc_filter:
-            filter_conditions = []
-            for key, value in doc_filter.items():
-                condition = FieldCondition(
-                    key=key,
-                    match=MatchValue(value=value)
-                )
-                filter_conditions.append(condition)
-            qdrant_filter = Filter(must=filter_conditions)
-        else:
-            qdrant_filter = None
+        # 2. Search collection with query_vector, limit, filter
+        return self.search_vectors([query_vector], top_k, doc_filter)[0]
 
-        # 3. Search collection with query_vector, limit, filter
-        search_results = self.client.search(
-            collection_name=self.collection,
-            query_vector=query_vector,
-            limit=top_k,
-            query_filter=qdrant_filter
-        )
 
-        # 4. Return list of {text, score, doc_id, page_number, section_title}
-        results = []
-        for res in search_results:
-            payload = res.payload
-            results.append({
-                "text": payload.get("text", ""),
-                "score": res.score,
-                "doc_id": payload.get("doc_id", ""),
-                "page_number": payload.get("page_number", -1),
-                "section_title": payload.get("section_title", "")
-            })
-        return results
+    @tracing.traced("VectorStore.search_batch")
+    def search_batch(self, queries: list[str], top_k=20, doc_filter=None) -> list[Hits]:
+        # One embedding request and one Qdrant round trip for all queries
+        if not queries: return []
+        return self.search_vectors(self.embedder.embed_queries(queries), top_k, doc_filter)
+
+
+    @tracing.traced("VectorStore.search_vectors")  # the Qdrant round trip, without embedding
+    def search_vectors(self, vectors, top_k=20, doc_filter=None) -> list[Hits]:
+        if self.coarse_dimension:
+            return self._search_two_stage(vectors, top_k, doc_filter)
+        from qdrant_client.models import SearchRequest
+        query_filter, params = self._build_filter(doc_filter), self._search_params()
+        requests = [SearchRequest(vector=list(map(float, vector)), filter=query_filter, limit=top_k, params=params,
+                                  with_payload=False)
+                    for vector in vectors]
+        batch_results = self.client.search_batch(collection_name=self.collection, requests=requests)
+        return [self._hits(results) for results in batch_results]
+
+
+    def _search_two_stage(self, vectors, top_k, doc_filter) -> list[Hits]:
+        # Prefetch candidates on the coarse vector, then rank them by the full one, in one request per query
+        from qdrant_client.models import Prefetch, QueryRequest
+        query_filter, params = self._build_filter(doc_filter), self._search_params()
+        requests = [QueryRequest(prefetch=Prefetch(query=matryoshka(vector, self.coarse_dimension), using="coarse",
+                                                   filter=query_filter, params=params,
+                                                   limit=top_k * settings.matryoshka_candidates),
+                                 query=list(map(float, vector)), using="full", filter=query_filter, limit=top_k,
+                                 offset=0, with_payload=False)  # local mode fails on offset=None
+                    for vector in vectors]
+        batch_results = self.client.query_batch_points(collection_name=self.collection, requests=requests)
+        return [self._hits(results.points) for results in batch_results]
+
+
+    def _build_filter(self, doc_filter):
+        # Optional Filter from doc_filter (a doc_id or {field: value})
+        from qdrant_client.models import Filter, FieldCondition, MatchValue
+        doc_filter = normalize_filter(doc_filter)
+        if not doc_filter: return None
+        return Filter(must=[FieldCondition(key=key, match=MatchValue(value=value)) for key, value in doc_filter.items()])
+
+
+    def _hits(self, points) -> Hits:
+        # Points from before the chunk store have UUID ids; they go when their document is re-ingested
+        points = [point for point in points if isinstance(point.id, int)]
+        return Hits([point.id for point in points], [point.score for point in points])
+
+
+    def update_payloads(self, chunks: list[Chunk]):
+        # Chunk text unchanged but its position moved: rewrite the metadata, keep the vector
+        from qdrant_client.models import OverwritePayloadOperation, SetPayload
+        operations = [OverwritePayloadOperation(overwrite_payload=SetPayload(payload=c.to_dict(),
+                                                                             points=[point_id]))
+                      for point_id, c in zip(self.chunks.add(chunks).tolist(), chunks)]
+        for i in range(0, len(operations), 100):
+            self.client.batch_update_points(collection_name=self.collection, update_operations=operations[i:i+100])
+        index_generation.bump(c.doc_id for c in chunks)
+
+
+    def delete_chunks(self, chunk_ids: list[str], doc_id: str = None):
+        from qdrant_client.models import PointIdsList
+        ids = self.chunks.ids_of(chunk_ids)
+        for i in range(0, len(ids), 1000):
+            self.client.delete(collection_name=self.collection, points_selector=PointIdsList(points=ids[i:i+1000]))
+        self.chunks.delete(ids)
+        index_generation.bump(None if doc_id is None else [doc_id])
 
 
     def delete_document(self, doc_id: str):
         # Delete all points where payload doc_id matches
+        from qdrant_client.models import FilterSelector
         self.client.delete(
             collection_name=self.collection,
-            filter=Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))])
+            points_selector=FilterSelector(filter=self._build_filter(doc_id))
         )
+        self.chunks.delete(self.chunks.document_ids(doc_id))
+        index_generation.bump([doc_id])
+
+
+    def restore_chunks(self) -> int:
+        """Adds every point's payload to the chunk store, e.g. after its file was lost; returns the count."""
+        restored, offset = 0, None
+        while True:
+            points, offset = self.client.scroll(self.collection, limit=1000, offset=offset, with_payload=True,
+                                                with_vectors=False)
+            # Points written without text can't be restored; their documents need re-ingesting
+            chunks = [point.payload for point in points if isinstance(point.id, int) and "text" in point.payload]
+            self.chunks.add(chunks)
+            restored += len(chunks)
+            if offset is None: break
+        self.chunks.save()
+        return restored
+
+
+    def save(self):
+        # The Qdrant server persists points itself; the chunk store they refer to is flushed here
+        self.chunks.save()
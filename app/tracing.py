@@ -0,0 +1,240 @@
+"""Per-stage spans and latency histograms for the ingestion and query paths.
+
+    with tracing.span("VectorStore.search", top_k=top_k):
+        ...
+
+    @tracing.traced("BM25Store.search")
+    def search(...): ...
+
+Off unless TRACING_ENABLED=true: span() then returns a shared no-op, so an instrumented call costs an
+attribute check. When on, every finished span is observed into a Prometheus histogram
+(prometheus_text(), served at /metrics), and each trace is exported once its root span ends, as an
+OTLP/JSON ExportTraceServiceRequest: kept in tracer.recent and, with TRACE_EXPORT_PATH set, appended to that
+file one line per trace, which the OpenTelemetry collector's file receiver reads.
+
+Spans nest through a ContextVar; bind(fn) carries the current span into a worker thread.
+"""
+from collections import deque
+import contextvars, functools, json, random, threading, time
+
+from app.config import settings
+
+SERVICE_NAME = "document-rag"
+# Seconds; finer at the low end, where embedding lookups, BM25 and fusion land
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per stage label, rendered in the Prometheus text format."""
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name, self.help, self.buckets = name, help_text, buckets
+        self._lock = threading.Lock()
+        self._series = {}  # stage -> [bucket counts..., +Inf count, sum]
+
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            series = self._series.get(stage)
+            if series is None:
+                series = self._series[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {stage: list(values) for stage, values in sorted(self._series.items())}
+        for stage, values in series.items():
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {values[-2]}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {values[-1]:.6f}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {values[-2]}')
+        return lines
+
+
+class Span:
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id", "parent", "trace", "start_ns",
+                 "_start", "duration", "error", "_token")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer, self.name, self.attributes = tracer, name, attributes
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.trace = self.parent.trace if self.parent else []  # finished spans, shared by the whole trace
+        self.duration, self.error = 0.0, None
+
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+    def __enter__(self):
+        self.start_ns, self._start = time.time_ns(), time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.trace.append(self)
+        self.tracer._finish(self)
+        return False
+
+
+    def breakdown(self) -> dict:
+        """Seconds per stage across this span's trace so far, summed over spans with the same name."""
+        stages = {}
+        for span in list(self.trace):
+            stages[span.name] = round(stages.get(span.name, 0.0) + span.duration, 6)
+        return stages
+
+
+class _NoopSpan:
+    duration, error = 0.0, None
+
+    def set(self, **attributes):
+        pass
+
+
+    def breakdown(self):
+        return None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, enabled=None, export_path=None, keep=100):
+        self.enabled = settings.tracing_enabled if enabled is None else enabled
+        self.export_path = settings.trace_export_path if export_path is None else export_path
+        self.histogram = Histogram("rag_stage_duration_seconds", "Time spent per ingestion and query stage")
+        self.errors = {}  # stage -> spans that raised
+        self.recent = deque(maxlen=keep)  # OTLP/JSON requests of the most recent traces
+        self._lock = threading.Lock()
+
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, attributes)
+
+
+    def observe(self, name, seconds):
+        """Records a duration measured elsewhere, e.g. in a worker process."""
+        if self.enabled:
+            self.histogram.observe(name, seconds)
+
+
+    def _finish(self, span):
+        self.histogram.observe(span.name, span.duration)
+        if span.error is not None:
+            with self._lock:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+        if span.parent is None:
+            self._export(span.trace)
+
+
+    def _export(self, spans):
+        request = otlp_request(spans)
+        self.recent.append(request)
+        if self.export_path:
+            line = json.dumps(request, separators=(",", ":"))
+            with self._lock, open(self.export_path, "a") as out:
+                out.write(line + "\n")
+
+
+    def prometheus_text(self) -> str:
+        lines = self.histogram.render()
+        with self._lock:
+            errors = dict(self.errors)
+        lines += ["# HELP rag_stage_errors_total Stage calls that raised", "# TYPE rag_stage_errors_total counter"]
+        lines += [f'rag_stage_errors_total{{stage="{stage}"}} {count}' for stage, count in sorted(errors.items())]
+        return "\n".join(lines) + "\n"
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_request(spans) -> dict:
+    # OTLP/JSON encoding: hex ids, nanosecond timestamps as strings, kind 1 = INTERNAL, status code 2 = ERROR
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [{
+            "traceId": s.trace_id, "spanId": s.span_id, "parentSpanId": s.parent.span_id if s.parent else "",
+            "name": s.name, "kind": 1, "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.start_ns + int(s.duration * 1e9)),
+            "attributes": [_attribute(k, v) for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {},
+        } for s in spans]}],
+    }]}
+
+
+tracer = Tracer()
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def observe(name, seconds):
+    tracer.observe(name, seconds)
+
+
+def prometheus_text() -> str:
+    return tracer.prometheus_text()
+
+
+def traced(name):
+    """Decorator form of span(): the whole call is one span named name."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def bind(fn):
+    # Thread pools don't inherit context variables; run fn under the caller's current span instead
+    parent = _current.get() if tracer.enabled else None
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def under_parent(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return under_parent
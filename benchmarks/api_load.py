@@ -0,0 +1,127 @@
+"""API load test: requests/sec, latency percentiles and 429 shedding under concurrent clients.
+
+Serves app.main with uvicorn over Qdrant in :memory: and the fake OpenAI server (fixed embedding
+latency, streamed answers), then drives it with --concurrency clients for --duration seconds.
+
+    python -m benchmarks.api_load --endpoint query --concurrency 64 --limit 16 --duration 10
+"""
+import argparse, asyncio, json, os, socket, tempfile, threading, time
+
+import httpx
+import uvicorn
+from qdrant_client import QdrantClient
+
+from app.config import settings
+from benchmarks.common import percentiles, sample_chunk_texts
+from tests.fake_openai import FakeOpenAIServer
+
+
+def build_app(chunks):
+    from app.ingestion.chunker import Chunk
+    from app.ingestion.manifest import IngestManifest
+    from app.ingestion.pipeline import IngestionPipeline
+    from app.main import create_app
+    from app.retrieval.bm25_store import BM25Store
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.embedder import EmbeddingService
+    from app.retrieval.rag_pipeline import RAGPipeline
+    from app.retrieval.vector_store import VectorStore
+
+    workdir = tempfile.mkdtemp()
+    chunks = [Chunk(text=t, doc_id=f"doc-{i % 7}", chunk_index=i, page_number=1, chunk_id=str(i))
+              for i, t in enumerate(chunks)]
+    chunk_store = ChunkStore(os.path.join(workdir, "chunks.seg"))
+    vector_store = VectorStore(client=QdrantClient(":memory:"), embedder=EmbeddingService(), chunks=chunk_store)
+    vector_store.add_chunks(chunks)
+    bm25 = BM25Store(index_path=os.path.join(workdir, "bm25.seg"), legacy_path=None, chunks=chunk_store)
+    bm25.add_documents([c.to_dict() for c in chunks])
+    ingestion = IngestionPipeline(vector_store, bm25, manifest=IngestManifest(os.path.join(workdir, "manifest.json")))
+    return create_app(RAGPipeline(vector_store, bm25), ingestion)
+
+
+def serve(app):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def drive(url, endpoint, questions, concurrency, duration):
+    latencies, ttfts, statuses = [], [], {}
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client, worker):
+        i = worker
+        while time.perf_counter() < deadline:
+            body = {"question": questions[i % len(questions)]}
+            i += concurrency
+            start = time.perf_counter()
+            try:
+                if endpoint == "stream":
+                    first = None
+                    async with client.stream("POST", "/query/stream", json=body) as response:
+                        async for line in response.aiter_lines():
+                            if first is None and line.startswith('data: {"type": "token"'):
+                                first = time.perf_counter() - start
+                        status = response.status_code
+                    if first is not None:
+                        ttfts.append(first)
+                else:
+                    status = (await client.post("/query", json=body)).status_code
+            except httpx.HTTPError:
+                status = "error"
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            elif status == 429:
+                await asyncio.sleep(0.05)  # a well-behaved client backs off briefly
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, ttfts, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint", choices=["query", "stream"], default="query")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--limit", type=int, default=16, help="admission limit for the endpoint")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--token-delay-ms", type=float, default=2)
+    parser.add_argument("--answer-cache", action="store_true", help="leave the answer cache on")
+    args = parser.parse_args()
+
+    answer = " ".join(["Revenue grew 12% year over year [Source 1]."] * 10)
+    with FakeOpenAIServer(dimension=256, latency=args.embed_latency_ms / 1000, answer=answer,
+                          token_delay=args.token_delay_ms / 1000) as fake:
+        settings.openai_base_url, settings.openai_api_key = fake.url, "bench"
+        settings.embedding_cache_path, settings.embedding_dimension = "", 256
+        settings.rerank_backend = "none"
+        settings.answer_cache_size = settings.answer_cache_size if args.answer_cache else 0
+        settings.api_query_concurrency = settings.api_stream_concurrency = args.limit
+
+        server, url = serve(build_app(sample_chunk_texts(args.chunks)))
+        questions = [" ".join(t.split()[:10]) for t in sample_chunk_texts()[-500:]]
+        latencies, ttfts, statuses, elapsed = asyncio.run(
+            drive(url, args.endpoint, questions, args.concurrency, args.duration))
+        server.should_exit = True
+
+    results = {"endpoint": args.endpoint, "concurrency": args.concurrency, "limit": args.limit,
+               "requests_per_s": round(len(latencies) / elapsed, 2), "statuses": statuses,
+               "latency": percentiles(latencies) if latencies else None}
+    if ttfts:
+        results["ttft"] = percentiles(ttfts)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
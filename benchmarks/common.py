@@ -0,0 +1,21 @@
+import pickle, time
+import numpy as np
+
+
+def percentiles(samples_s: list[float]) -> dict:
+    ms = np.asarray(samples_s) * 1000
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 3), "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "mean_ms": round(float(ms.mean()), 3)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def sample_chunk_texts(limit=None, path="data/bm25_index.pkl") -> list[str]:
+    # Chunk texts from the sample filings, as stored by the original BM25 index
+    with open(path, "rb") as f:
+        texts = [d["text"] for d in pickle.load(f)["docs"]]
+    return texts[:limit] if limit else texts
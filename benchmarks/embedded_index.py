@@ -0,0 +1,116 @@
+"""Embedded vector index vs Qdrant local mode: build time, recall@k and per-query latency.
+
+Clustered synthetic vectors, so neighbours are meaningful; recall is measured against exact float32
+search. Filtered queries select one of --docs documents by doc_id.
+
+    python -m benchmarks.embedded_index --vectors 50000 --dimension 384 --queries 200
+"""
+import argparse, json, tempfile, time, uuid
+
+import numpy as np
+
+from benchmarks.common import percentiles, timed
+
+
+class VectorsOnly:
+    # The benchmark passes vectors directly; the store only needs the dimension
+    model = "benchmark"
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+
+
+def make_vectors(n, dimension, clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(found, truth):
+    return round(float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])), 4)
+
+
+def bench_embedded(vectors, doc_ids, top_k, dtype, hnsw_threshold):
+    from app.ingestion.chunker import Chunk
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.embedded_store import EmbeddedVectorStore
+
+    # A fresh chunk store numbers the chunks in insertion order, so result ids are row numbers
+    store = EmbeddedVectorStore(path=tempfile.mkdtemp(), embedder=VectorsOnly(vectors.shape[1]), dtype=dtype,
+                                hnsw_threshold=hnsw_threshold, chunks=ChunkStore(""))
+    start = time.perf_counter()
+    for lo in range(0, len(vectors), 10_000):
+        chunks = [Chunk(text="", doc_id=doc_ids[i], chunk_index=i, page_number=1, chunk_id=str(i))
+                  for i in range(lo, min(lo + 10_000, len(vectors)))]
+        store.upsert_embedded(chunks, vectors[lo:lo + 10_000])
+    build_s = time.perf_counter() - start
+    search = lambda q, f=None: store.search_vectors([q], top_k, f)[0].ids.tolist()
+    return build_s, search
+
+
+def bench_qdrant(vectors, doc_ids, top_k):
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import (Distance, FieldCondition, Filter, MatchValue, PointStruct, VectorParams)
+
+    client = QdrantClient(":memory:")
+    client.create_collection("bench", vectors_config=VectorParams(size=vectors.shape[1], distance=Distance.COSINE))
+    client.create_payload_index("bench", "doc_id", field_schema="keyword")
+    start = time.perf_counter()
+    for lo in range(0, len(vectors), 1000):
+        client.upsert("bench", points=[PointStruct(id=str(uuid.UUID(int=i)), vector=vectors[i].tolist(),
+                                                   payload={"doc_id": doc_ids[i], "row": i})
+                                       for i in range(lo, min(lo + 1000, len(vectors)))])
+    build_s = time.perf_counter() - start
+
+    def search(q, doc_filter=None):
+        query_filter = Filter(must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_filter))]) \
+            if doc_filter else None
+        return [p.payload["row"] for p in client.search("bench", query_vector=q.tolist(), limit=top_k,
+                                                        query_filter=query_filter)]
+    return build_s, search
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=50_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--skip-qdrant", action="store_true")
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+    doc_ids = [f"doc-{i % args.docs}" for i in range(args.vectors)]
+    doc_mask = np.array([i % args.docs == 0 for i in range(args.vectors)])
+    scores = queries @ vectors.T
+    truth = [np.argsort(-s)[:args.top_k].tolist() for s in scores]
+    filtered = np.where(doc_mask, scores, -np.inf)
+    filtered_truth = [np.argsort(-s)[:args.top_k].tolist() for s in filtered]
+
+    backends = {
+        "embedded_float16_exact": lambda: bench_embedded(vectors, doc_ids, args.top_k, "float16", 10 ** 9),
+        "embedded_int8_exact": lambda: bench_embedded(vectors, doc_ids, args.top_k, "int8", 10 ** 9),
+        # The graph serves unfiltered queries; a one-document filter is below the threshold and scans exactly
+        "embedded_float16_hnsw": lambda: bench_embedded(vectors, doc_ids, args.top_k, "float16", args.vectors // 2),
+    }
+    if not args.skip_qdrant:
+        backends["qdrant_local"] = lambda: bench_qdrant(vectors, doc_ids, args.top_k)
+
+    results = {"vectors": args.vectors, "dimension": args.dimension, "top_k": args.top_k}
+    for name, setup in backends.items():
+        build_s, search = setup()
+        search(queries[0])  # warm up
+        found, times = zip(*[timed(search, q) for q in queries])
+        found_f, times_f = zip(*[timed(search, q, "doc-0") for q in queries])
+        results[name] = {"build_s": round(build_s, 2), f"recall@{args.top_k}": recall(found, truth),
+                         "latency": percentiles(times),
+                         f"filtered_recall@{args.top_k}": recall(found_f, filtered_truth),
+                         "filtered_latency": percentiles(times_f)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
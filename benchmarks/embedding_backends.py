@@ -0,0 +1,48 @@
+"""Compare embedding backends: bulk throughput and single-query latency.
+
+    python -m benchmarks.embedding_backends --backends openai local --chunks 512 --queries 200
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse, json
+
+from app.config import settings
+from benchmarks.common import percentiles, sample_chunk_texts, timed
+
+
+def make_backend(name):
+    settings.embedding_backend = name
+    from app.retrieval.embedder import create_embedding_backend
+    return create_embedding_backend()
+
+
+def run(backend, chunks, queries, concurrency):
+    backend.embed(chunks[:8])  # warm up connections / model weights
+    _, bulk_s = timed(backend.embed, chunks)
+    latencies = [timed(backend.embed_query, q)[1] for q in queries]
+    with ThreadPoolExecutor(concurrency) as pool:
+        _, concurrent_s = timed(lambda: list(pool.map(backend.embed_query, queries)))
+    return {
+        "dimension": backend.dimension,
+        "bulk_texts_per_s": round(len(chunks) / bulk_s, 1),
+        "query_latency": percentiles(latencies),
+        f"queries_per_s_at_{concurrency}_threads": round(len(queries) / concurrent_s, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["openai", "local"])
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    chunks = sample_chunk_texts(args.chunks)
+    # Distinct short questions built from chunk text, so no backend-side caching helps
+    queries = [" ".join(t.split()[:12]) for t in sample_chunk_texts()[-args.queries:]]
+    results = {name: run(make_backend(name), chunks, queries, args.concurrency) for name in args.backends}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
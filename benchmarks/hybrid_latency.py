@@ -0,0 +1,72 @@
+"""Hybrid retrieval latency: legs run back to back vs concurrently, and per-query cost of search_batch.
+
+Uses the fake OpenAI server (fixed embedding latency) and Qdrant in :memory: over the sample chunk texts.
+
+    python -m benchmarks.hybrid_latency --queries 200 --embed-latency-ms 40 --bm25-scale 20
+
+--bm25-scale replicates the corpus in the BM25 leg only, to model a keyword index much larger than the sample.
+"""
+import argparse, json, os, tempfile
+
+from qdrant_client import QdrantClient
+
+from app.config import settings
+from benchmarks.common import percentiles, sample_chunk_texts, timed
+from tests.fake_openai import FakeOpenAIServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--embed-latency-ms", type=float, default=40)
+    parser.add_argument("--bm25-scale", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    with FakeOpenAIServer(dimension=256, latency=args.embed_latency_ms / 1000) as server:
+        settings.openai_base_url, settings.openai_api_key = server.url, "bench"
+        settings.embedding_cache_path, settings.embedding_dimension = "", 256
+        from app.ingestion.chunker import Chunk
+        from app.retrieval.bm25_store import BM25Store
+        from app.retrieval.chunk_store import ChunkStore
+        from app.retrieval.embedder import EmbeddingService
+        from app.retrieval.hybrid import HybridRetriever
+        from app.retrieval.vector_store import VectorStore
+
+        texts = sample_chunk_texts(args.chunks)
+        chunks = [Chunk(text=t, doc_id=f"doc-{i % 7}", chunk_index=i, page_number=1, chunk_id=str(i))
+                  for i, t in enumerate(texts)]
+        chunk_store = ChunkStore("")
+        vector_store = VectorStore(client=QdrantClient(":memory:"), embedder=EmbeddingService(), chunks=chunk_store)
+        vector_store.add_chunks(chunks)
+        bm25 = BM25Store(index_path=os.path.join(tempfile.mkdtemp(), "bm25.seg"), legacy_path=None,
+                         chunks=chunk_store)
+        # Copies beyond the first are extra chunks that only the BM25 leg holds
+        bm25.add_documents([{**c.to_dict(), "doc_id": f"{c.doc_id}-{copy}", "chunk_id": f"{c.chunk_id}-{copy}"}
+                            if copy else c.to_dict() for copy in range(args.bm25_scale) for c in chunks])
+        retriever = HybridRetriever(vector_store, bm25)
+
+        queries = [" ".join(t.split()[:10]) for t in sample_chunk_texts()[-args.queries:]]
+        retriever.search(queries[0])  # warm up
+
+        def sequential(q):
+            vector_store.search(q, top_k=20)
+            bm25.search(q, top_k=20)
+
+        results = {
+            "vector_leg": percentiles([timed(vector_store.search, q, 20)[1] for q in queries]),
+            "bm25_leg": percentiles([timed(bm25.search, q, 20)[1] for q in queries]),
+            "sequential": percentiles([timed(sequential, q)[1] for q in queries]),
+            "concurrent": percentiles([timed(retriever.search, q)[1] for q in queries]),
+        }
+        batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+        batch_s = sum(timed(retriever.search_batch, batch)[1] for batch in batches)
+        results[f"search_batch_{args.batch_size}_ms_per_query"] = round(batch_s * 1000 / len(queries), 3)
+        assert [[r["text"] for r in rs] for rs in retriever.search_batch(queries[:8])] == \
+               [[r["text"] for r in retriever.search(q)] for q in queries[:8]]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Two-stage Matryoshka search vs single-stage full-vector search over the sample filings.
+
+For each --dims, a collection stores a truncated "coarse" vector for candidate search and the full vector
+for rescoring (MATRYOSHKA_DIMENSION). Recall@k is measured against exact full-dimension search;
+"coarse_only_recall" is what the truncated vector alone would return, without the rescoring stage.
+
+--embedder openai embeds with the configured text-embedding-3 model. The offline default, lsa, embeds
+with TF-IDF + SVD fitted on the filings: SVD orders dimensions by variance, so its prefixes are smaller
+embeddings in the same way Matryoshka prefixes are.
+
+Latency is measured in Qdrant's local mode, which scans exactly and runs the query API in Python, so it
+shows the cost of the extra stage but not the smaller graph and RAM footprint a server gets from it.
+
+    python -m benchmarks.matryoshka --dims 64 128 256 --candidates 10 --queries 200
+"""
+import argparse, json
+
+import numpy as np
+
+from app.config import settings
+from benchmarks.common import percentiles, sample_chunk_texts, timed
+from benchmarks.embedded_index import VectorsOnly, recall
+
+
+def lsa_embeddings(texts, queries, dimension):
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    tfidf = TfidfVectorizer(sublinear_tf=True, ngram_range=(1, 2), min_df=2, stop_words="english")
+    svd = TruncatedSVD(n_components=min(dimension, len(texts) - 1), random_state=0)
+    vectors = svd.fit_transform(tfidf.fit_transform(texts))
+    return vectors, svd.transform(tfidf.transform(queries))
+
+
+def openai_embeddings(texts, queries):
+    from app.retrieval.embedder import EmbeddingService
+    embedder = EmbeddingService()
+    return np.array(embedder.embed_batch(texts)), np.array(embedder.embed_batch(queries))
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_store(name, coarse_dimension, vectors, doc_ids, texts):
+    from qdrant_client import QdrantClient
+    from app.ingestion.chunker import Chunk
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.vector_store import VectorStore
+
+    settings.collection_name, settings.matryoshka_dimension = f"bench_{name}", coarse_dimension
+    # A fresh chunk store numbers the chunks in insertion order, so point ids are row numbers
+    store = VectorStore(client=QdrantClient(":memory:"), embedder=VectorsOnly(vectors.shape[1]), chunks=ChunkStore(""))
+    for lo in range(0, len(vectors), 1000):
+        rows = range(lo, min(lo + 1000, len(vectors)))
+        store.upsert_embedded([Chunk(text=texts[i], doc_id=doc_ids[i], chunk_index=i, page_number=1,
+                                     chunk_id=str(i)) for i in rows], vectors[lo:rows.stop].tolist())
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedder", choices=["lsa", "openai"], default="lsa")
+    parser.add_argument("--dimension", type=int, default=1024, help="full dimension of the lsa embedder")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--candidates", type=int, default=settings.matryoshka_candidates)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    texts = sample_chunk_texts()
+    queries = [" ".join(t.split()[:12]) for t in texts[-args.queries:]]
+    vectors, query_vectors = openai_embeddings(texts, queries) if args.embedder == "openai" \
+        else lsa_embeddings(texts, queries, args.dimension)
+    # Chunks with no vocabulary in common with the rest (tables of figures) embed to zero under lsa
+    kept, kept_q = np.linalg.norm(vectors, axis=1) > 0, np.linalg.norm(query_vectors, axis=1) > 0
+    texts, vectors, query_vectors = [t for t, k in zip(texts, kept) if k], vectors[kept], query_vectors[kept_q]
+    vectors, query_vectors = normalize(vectors).astype(np.float32), normalize(query_vectors).astype(np.float32)
+    doc_ids = [f"doc-{i // 250}" for i in range(len(vectors))]
+    truth = [np.argsort(-s)[:args.top_k].tolist() for s in query_vectors @ vectors.T]
+    settings.matryoshka_candidates, settings.qdrant_quantization = args.candidates, "none"
+
+    results = {"embedder": args.embedder, "vectors": len(vectors), "dimension": vectors.shape[1],
+               "top_k": args.top_k, "candidates_per_result": args.candidates}
+    for coarse in [0] + args.dims:
+        name = f"two_stage_{coarse}" if coarse else "single_stage"
+        store = build_store(name, coarse, vectors, doc_ids, texts)
+        search = lambda q: store.search_vectors([q], args.top_k)[0].ids.tolist()
+        search(query_vectors[0])  # warm up
+        found, times = zip(*[timed(search, q) for q in query_vectors])
+        results[name] = {f"recall@{args.top_k}": recall(found, truth), "latency": percentiles(times)}
+        if coarse:
+            scores = normalize(query_vectors[:, :coarse]) @ normalize(vectors[:, :coarse]).T
+            results[name]["coarse_only_recall"] = recall([np.argsort(-s)[:args.top_k] for s in scores], truth)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Qdrant collection profiles: recall@k and per-query latency of VectorStore.search_vectors.
+
+Each profile is a set of Settings overrides applied before its collection is created. "default" is the
+previous setup: Qdrant's default HNSW, float32 vectors in RAM and no quantization. Searches return point
+ids only, the chunks themselves are read from the chunk store.
+
+Local mode (the default, `:memory:`) searches exactly and keeps vectors in process memory, so it ignores
+HNSW, quantization and on-disk settings. Point --host at a Qdrant server to measure them, and add --grpc
+for gRPC instead of REST.
+
+    python -m benchmarks.qdrant_profile --vectors 20000 --dimension 384 --queries 200
+    python -m benchmarks.qdrant_profile --host localhost --vectors 200000 --dimension 1536 --grpc
+"""
+import argparse, json, time
+from contextlib import contextmanager
+
+import numpy as np
+
+from benchmarks.common import percentiles, sample_chunk_texts, timed
+from benchmarks.embedded_index import VectorsOnly, make_vectors, recall
+
+BASE = {"qdrant_quantization": "none", "qdrant_oversampling": 2.0, "qdrant_rescore": True, "qdrant_on_disk": False,
+        "hnsw_m": 16, "hnsw_ef_construct": 100, "hnsw_ef": 0}
+PROFILES = {
+    "default": {},
+    "tuned": {"hnsw_ef_construct": 128, "hnsw_ef": 128},
+    "scalar": {"qdrant_quantization": "scalar", "hnsw_ef_construct": 128, "hnsw_ef": 128},
+    "scalar_on_disk": {"qdrant_quantization": "scalar", "hnsw_ef_construct": 128, "hnsw_ef": 128,
+                       "qdrant_on_disk": True},
+    # Binary codes lose most of the ranking on their own; rescoring 4x the candidates recovers it
+    "binary": {"qdrant_quantization": "binary", "qdrant_oversampling": 4.0, "hnsw_ef_construct": 128, "hnsw_ef": 128},
+}
+
+
+@contextmanager
+def profile(name):
+    # Settings are read when the collection is created and on every search, so each call applies its profile
+    from app.config import settings
+    overrides = {**BASE, **PROFILES[name], "collection_name": f"bench_{name}"}
+    previous = {key: getattr(settings, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            setattr(settings, key, value)
+
+
+def bench_profile(name, client, vectors, texts, doc_ids, top_k, server):
+    from app.ingestion.chunker import Chunk
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.vector_store import VectorStore
+
+    with profile(name):
+        # A fresh chunk store numbers the chunks in insertion order, so point ids are row numbers
+        store = VectorStore(client=client, embedder=VectorsOnly(vectors.shape[1]), chunks=ChunkStore(""))
+        start = time.perf_counter()
+        for lo in range(0, len(vectors), 1000):
+            chunks = [Chunk(text=texts[i % len(texts)], doc_id=doc_ids[i], chunk_index=i, page_number=1,
+                            section_title="Results of Operations", parent_section="Item 7",
+                            chunk_id=str(i))
+                      for i in range(lo, min(lo + 1000, len(vectors)))]
+            store.upsert_embedded(chunks, vectors[lo:lo + 1000].tolist())
+        if server:
+            wait_for_index(client, store.collection)
+        build_s = time.perf_counter() - start
+
+    def search(q, doc_filter=None):
+        with profile(name):
+            return store.search_vectors([q], top_k, doc_filter)[0].ids.tolist()
+    return build_s, search
+
+
+def wait_for_index(client, collection, timeout_s=600):
+    # A server builds the graph and quantized vectors in the background; searching before then scans
+    deadline = time.monotonic() + timeout_s
+    while client.get_collection(collection).status != "green" and time.monotonic() < deadline:
+        time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--host", default="", help="Qdrant server; empty runs local mode in memory")
+    parser.add_argument("--port", type=int, default=6333)
+    parser.add_argument("--grpc", action="store_true")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    client = QdrantClient(host=args.host, port=args.port, prefer_grpc=args.grpc) if args.host \
+        else QdrantClient(":memory:")
+
+    vectors = make_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+    texts = sample_chunk_texts()
+    doc_ids = [f"doc-{i % args.docs}" for i in range(args.vectors)]
+    scores = queries @ vectors.T
+    truth = [np.argsort(-s)[:args.top_k].tolist() for s in scores]
+    filtered = np.where(np.arange(args.vectors) % args.docs == 0, scores, -np.inf)
+    filtered_truth = [np.argsort(-s)[:args.top_k].tolist() for s in filtered]
+
+    mode = f"server {args.host}:{args.port}{' grpc' if args.grpc else ''}" if args.host else "local"
+    results = {"mode": mode, "vectors": args.vectors, "dimension": args.dimension, "top_k": args.top_k}
+    for name in args.profiles.split(","):
+        build_s, search = bench_profile(name, client, vectors, texts, doc_ids, args.top_k, bool(args.host))
+        search(queries[0])  # warm up
+        found, times = zip(*[timed(search, q) for q in queries])
+        found_f, times_f = zip(*[timed(search, q, "doc-0") for q in queries])
+        results[name] = {"build_s": round(build_s, 2), f"recall@{args.top_k}": recall(found, truth),
+                         "latency": percentiles(times),
+                         f"filtered_recall@{args.top_k}": recall(found_f, filtered_truth),
+                         "filtered_latency": percentiles(times_f)}
+        client.delete_collection(f"bench_{name}")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
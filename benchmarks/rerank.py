@@ -0,0 +1,43 @@
+"""Rerank latency against candidate count, to choose the retrieval depth (TOP_K_RETRIEVAL).
+
+Every query is distinct and the score cache is disabled, so each measurement is a cold rerank.
+
+    python -m benchmarks.rerank --backends local cohere --depths 10 20 40 80 --queries 30
+"""
+import argparse, json
+
+from app.config import settings
+from benchmarks.common import percentiles, sample_chunk_texts, timed
+
+
+def make_reranker(name, early_stop):
+    settings.rerank_backend = name
+    from app.retrieval.reranker import Reranker
+    return Reranker(cache_size=0, early_stop=early_stop)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["local"])
+    parser.add_argument("--depths", nargs="+", type=int, default=[10, 20, 40, 80])
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--early-stop", action="store_true")
+    args = parser.parse_args()
+
+    texts = sample_chunk_texts()
+    queries = [" ".join(t.split()[:12]) for t in texts[-args.queries:]]
+    results = {}
+    for name in args.backends:
+        reranker = make_reranker(name, args.early_stop)
+        reranker.rerank("warm up", [{"text": t} for t in texts[:4]])
+        results[name] = {}
+        for depth in args.depths:
+            # Candidates are a sliding window over the corpus so passages vary between queries
+            latencies = [timed(reranker.rerank, q, [{"text": t} for t in texts[i * 7:i * 7 + depth]], 5)[1]
+                         for i, q in enumerate(queries)]
+            results[name][f"depth_{depth}"] = percentiles(latencies)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
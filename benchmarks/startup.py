@@ -0,0 +1,82 @@
+"""Cold start: import time of the entry-point modules and time to first query, each in a fresh process.
+
+The query run uses Qdrant in :memory: and the fake OpenAI server; the few chunks it indexes (with
+precomputed vectors) are timed separately and left out of time_to_first_query_s.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+MODULES = ["app.ingestion.chunker", "app.ingestion.pipeline", "app.retrieval.vector_store",
+           "app.retrieval.rag_pipeline", "app.main"]
+
+
+def import_time(module, runs):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = [float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                                    text=True).stdout) for _ in range(runs)]
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def first_query():
+    # Runs in the child process; everything app-related is imported here, after the clock starts
+    start = time.perf_counter()
+    from app.retrieval.rag_pipeline import RAGPipeline
+    imported = time.perf_counter()
+
+    import tempfile
+    from qdrant_client import QdrantClient
+    from app.ingestion.chunker import Chunk
+    from app.retrieval.bm25_store import BM25Store
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.vector_store import VectorStore
+    chunk_store = ChunkStore("")
+    vector_store = VectorStore(client=QdrantClient(":memory:"), chunks=chunk_store)
+    bm25 = BM25Store(index_path=os.path.join(tempfile.mkdtemp(), "bm25.seg"), legacy_path=None, chunks=chunk_store)
+    stores = time.perf_counter()
+
+    chunks = [Chunk(text=f"Segment {i} revenue grew {i}% on higher services demand.", doc_id="doc", chunk_index=i,
+                    page_number=1, chunk_id=str(i)) for i in range(50)]
+    # Vectors straight from the fake embedder: indexing must not warm the tokenizer or client the query needs
+    from tests.fake_openai import fake_embedding
+    vector_store.upsert_embedded(chunks, [fake_embedding(c.text, vector_store.embedder.dimension).tolist()
+                                          for c in chunks])
+    bm25.add_documents([c.to_dict() for c in chunks])
+    indexed = time.perf_counter()
+
+    pipeline = RAGPipeline(vector_store, bm25)
+    ready = time.perf_counter()
+    pipeline.query("How much did revenue grow?")
+    answered = time.perf_counter()
+    pipeline.query("Which segment grew fastest?")
+    warm = time.perf_counter() - answered
+
+    init = (stores - imported) + (ready - indexed)
+    print(json.dumps({"import_ms": round((imported - start) * 1000, 1), "init_ms": round(init * 1000, 1),
+                      "first_query_ms": round((answered - ready) * 1000, 1), "warm_query_ms": round(warm * 1000, 1),
+                      "index_ms": round((indexed - stores) * 1000, 1),
+                      "time_to_first_query_ms": round((answered - start - (indexed - stores)) * 1000, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement (median reported)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return first_query()
+
+    from tests.fake_openai import FakeOpenAIServer
+    results = {"import_ms": {m: import_time(m, args.runs) for m in MODULES}}
+    with FakeOpenAIServer(dimension=256) as fake:
+        env = {**os.environ, "OPENAI_BASE_URL": fake.url, "OPENAI_API_KEY": "bench", "EMBEDDING_DIMENSION": "256",
+               "EMBEDDING_CACHE_PATH": "", "RERANK_BACKEND": "none", "ANSWER_CACHE_SIZE": "0"}
+        runs = [json.loads(subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"], env=env,
+                                          check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+                for _ in range(args.runs)]
+    results["first_query"] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
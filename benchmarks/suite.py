@@ -0,0 +1,242 @@
+"""End-to-end benchmark suite: parsing, chunking, BM25 at several sizes, hybrid retrieval and RAG queries.
+
+Runs offline and deterministically: synthetic filings (benchmarks/synthetic.py), the fake OpenAI server for
+embeddings and completions, and Qdrant in :memory:. Results are written as JSON and compared with a stored
+baseline; the exit status is 1 when a metric is worse than the baseline by more than --tolerance.
+
+    python -m benchmarks.suite                                   # run, write results, compare
+    python -m benchmarks.suite --bm25-sizes 10000 100000 1000000 # include the 1M-chunk BM25 index
+    python -m benchmarks.suite --runs 3 --save-baseline          # accept the current numbers as the baseline
+
+Baselines are machine-specific: record one on the machine that runs the comparison. Timings on a shared
+machine move by 20% or more between runs; --runs takes each metric's median to damp that.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import argparse, gc, json, os, platform, sys, tempfile, time
+
+import numpy as np
+from loguru import logger
+
+from app.config import settings
+from benchmarks.common import percentiles, timed
+from benchmarks.synthetic import SyntheticCorpus
+from tests.fake_openai import FakeOpenAIServer
+
+BASELINE_PATH = "benchmarks/baseline.json"
+RESULTS_PATH = "benchmarks/results/latest.json"
+# Compared metrics; p99 on a short run is too noisy to gate on
+LOWER_IS_BETTER = ("p50_ms", "mean_ms")
+HIGHER_IS_BETTER = ("_per_s",)
+STAGES = ["parsing", "chunker", "bm25", "hybrid", "rag"]
+
+
+def bench_parsing(workdir, corpus, pages, repeat):
+    from app.ingestion.parser import DOCXParser, PDFParser
+    results, docs = {}, []
+    for name, parser, write in [("pdf", PDFParser(parallel_workers=1), corpus.write_pdf),
+                                ("docx", DOCXParser(), corpus.write_docx)]:
+        path = os.path.join(workdir, f"synthetic.{name}")
+        write(path, pages)
+        runs = [timed(parser.parse, path, f"synthetic-{name}") for _ in range(repeat)]
+        best = min(elapsed for _, elapsed in runs)
+        docs.append(runs[0][0])
+        results[name] = {"pages": pages, "blocks": len(runs[0][0].blocks), "best_s": round(best, 3),
+                         "pages_per_s": round(pages / best, 1)}
+    return results, docs
+
+
+def bench_chunker(docs, repeat):
+    from app.ingestion.chunker import StructureAwareChunker
+    chunker = StructureAwareChunker()
+    chunker.chunk_document(docs[0])  # warm up the tokenizer
+    blocks = sum(len(d.blocks) for d in docs)
+    best, chunks = float("inf"), 0
+    for _ in range(repeat):
+        runs = [timed(chunker.chunk_document, d) for d in docs]
+        best = min(best, sum(elapsed for _, elapsed in runs))
+        chunks = sum(len(c) for c, _ in runs)
+    return {"blocks": blocks, "chunks": chunks, "blocks_per_s": round(blocks / best, 1),
+            "chunks_per_s": round(chunks / best, 1)}
+
+
+def bench_bm25(workdir, corpus, size, queries, batch=100_000):
+    # Built in batches, saved as a segment and reopened, so queries run on the mmapped index as in production
+    from app.retrieval.bm25_store import BM25Store
+    from app.retrieval.chunk_store import ChunkStore
+    gc.collect()  # the previous size's index would otherwise be collected in the middle of this build
+    path, chunks_path = os.path.join(workdir, f"bm25-{size}.seg"), os.path.join(workdir, f"chunks-{size}.seg")
+    store = BM25Store(index_path=path, legacy_path=None, chunks=ChunkStore(chunks_path))
+    build_s = 0.0
+    for lo in range(0, size, batch):
+        texts = corpus.chunk_texts(min(batch, size - lo))
+        chunks = [{"text": t, "doc_id": f"doc-{(lo + i) // 500}", "chunk_id": str(lo + i), "page_number": 1}
+                  for i, t in enumerate(texts)]
+        build_s += timed(store.add_documents, chunks)[1]
+    save_s = timed(store.save)[1]
+    del store
+    reopened = BM25Store(index_path=path, legacy_path=None, chunks=ChunkStore(chunks_path))
+    load_s = timed(reopened.load)[1]
+    reopened.search(queries[0])  # warm up
+    latencies = [timed(reopened.search, q, 20)[1] for q in queries]
+    filtered = [timed(reopened.search, q, 20, "doc-1")[1] for q in queries]
+    return {"build_s": round(build_s, 2), "chunks_per_s": round(size / build_s, 1), "save_s": round(save_s, 2),
+            "load_s": round(load_s, 3), "query": percentiles(latencies), "filtered_query": percentiles(filtered)}
+
+
+def build_retrieval(workdir, corpus, n_chunks):
+    from qdrant_client import QdrantClient
+    from app.ingestion.chunker import Chunk
+    from app.retrieval.bm25_store import BM25Store
+    from app.retrieval.chunk_store import ChunkStore
+    from app.retrieval.embedder import EmbeddingService
+    from app.retrieval.vector_store import VectorStore
+
+    chunks = [Chunk(text=t, doc_id=f"doc-{i // 100}", chunk_index=i % 100, page_number=1 + i % 100 // 4,
+                    section_title=f"Section {i // 20}", chunk_id=str(i))
+              for i, t in enumerate(corpus.chunk_texts(n_chunks))]
+    chunk_store = ChunkStore(os.path.join(workdir, "hybrid-chunks.seg"))
+    vector_store = VectorStore(client=QdrantClient(":memory:"), embedder=EmbeddingService(), chunks=chunk_store)
+    vector_store.add_chunks(chunks)
+    bm25 = BM25Store(index_path=os.path.join(workdir, "hybrid.seg"), legacy_path=None, chunks=chunk_store)
+    bm25.add_documents([c.to_dict() for c in chunks])
+    return vector_store, bm25
+
+
+def bench_hybrid(vector_store, bm25, queries):
+    from app.retrieval.hybrid import HybridRetriever
+    retriever = HybridRetriever(vector_store, bm25)
+    retriever.search(queries[0])  # warm up
+    return {"chunks": bm25.live_count, "query": percentiles([timed(retriever.search, q, 20)[1] for q in queries])}
+
+
+def bench_rag(vector_store, bm25, queries):
+    # No reranker and no answer cache: every query retrieves, packs and calls the (fake) LLM
+    from app.retrieval.rag_pipeline import RAGPipeline
+    rag = RAGPipeline(vector_store, bm25)
+    rag.query(queries[0])  # warm up
+    return {"query": percentiles([timed(rag.query, q)[1] for q in queries])}
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    yield
+    print(f"{name}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+def run(args) -> dict:
+    # Each stage draws from its own corpus, so its data does not depend on which stages ran before it
+    corpus = lambda: SyntheticCorpus(seed=args.seed)
+    queries = SyntheticCorpus(seed=args.seed + 1).queries(args.queries)
+    results = {"config": {"seed": args.seed, "pages": args.pages, "bm25_sizes": args.bm25_sizes,
+                          "hybrid_chunks": args.hybrid_chunks, "queries": args.queries,
+                          "latency_ms": args.latency_ms, "stages": args.stages, "runs": args.runs},
+               "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                               "cpus": os.cpu_count()}}
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeOpenAIServer(dimension=256, latency=args.latency_ms / 1000) as server:
+        settings.openai_base_url, settings.openai_api_key = server.url, "bench"
+        settings.embedding_backend, settings.embedding_cache_path, settings.embedding_dimension = "openai", "", 256
+        settings.vector_backend, settings.rerank_backend, settings.answer_cache_size = "qdrant", "none", 0
+
+        if {"parsing", "chunker"} & set(args.stages):
+            with stage("parsing"):
+                parsing, docs = bench_parsing(workdir, corpus(), args.pages, args.repeat)
+            if "parsing" in args.stages:
+                results["parsing"] = parsing
+        if "chunker" in args.stages:
+            with stage("chunker"):
+                results["chunker"] = bench_chunker(docs, args.repeat)
+        if "bm25" in args.stages:
+            with stage("bm25"):
+                results["bm25"] = {str(size): bench_bm25(workdir, corpus(), size, queries)
+                                   for size in args.bm25_sizes}
+        if {"hybrid", "rag"} & set(args.stages):
+            vector_store, bm25 = build_retrieval(workdir, corpus(), args.hybrid_chunks)
+        if "hybrid" in args.stages:
+            with stage("hybrid"):
+                results["hybrid"] = bench_hybrid(vector_store, bm25, queries)
+        if "rag" in args.stages:
+            with stage("rag"):
+                results["rag"] = bench_rag(vector_store, bm25, queries)
+    return results
+
+
+def flatten(results, prefix="") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def median_results(runs: list[dict]) -> dict:
+    # Per-metric median over repeated runs, the same shape as one run
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_results([r[key] for r in runs]) for key in first}
+    if isinstance(first, (int, float)) and any(r != first for r in runs):
+        return round(float(np.median(runs)), 3)
+    return first  # config, counts and other values every run agrees on
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Metrics worse than the baseline by more than tolerance (a fraction); only metrics in both are compared."""
+    regressions = []
+    now, before = flatten(current), flatten(baseline)
+    for key in sorted(now.keys() & before.keys()):
+        if key.startswith(("config.", "environment.")) or not before[key]:
+            continue
+        change = now[key] / before[key] - 1
+        if key.endswith(LOWER_IS_BETTER) and change > tolerance or \
+                key.endswith(HIGHER_IS_BETTER) and change < -tolerance:
+            regressions.append({"metric": key, "baseline": before[key], "current": now[key],
+                                "change": f"{change:+.0%}"})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--bm25-sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--hybrid-chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every fake OpenAI request")
+    parser.add_argument("--runs", type=int, default=1, help="report each metric's median over this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = median_results([run(args) for _ in range(args.runs)])
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+        return
+    print(json.dumps(results, indent=2))
+    if not Path(args.baseline).exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one", file=sys.stderr)
+        return
+    baseline = json.loads(Path(args.baseline).read_text())
+    if baseline.get("config") != results["config"]:
+        print("Baseline was recorded with a different config; only common metrics are compared", file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']})", file=sys.stderr)
+    print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
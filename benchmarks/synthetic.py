@@ -0,0 +1,125 @@
+"""Deterministic synthetic corpora: chunk texts, PDFs and DOCX files that look like quarterly filings.
+
+Words are drawn from a Zipf distribution over a fixed vocabulary (common filing terms first, then
+generated terms), so term frequencies and posting-list lengths resemble real text at any corpus size.
+"""
+import numpy as np
+
+FILING_WORDS = """revenue net income operating expenses segment customers payments growth quarter fiscal year
+million billion percent increase decrease compared prior period results operations cash flows financing
+investing activities balance sheet assets liabilities equity stock compensation interest rate risk
+management discussion analysis guidance margin adjusted ebitda transaction volume processing fees
+subscription platform spend card float funds held customer deposits credit losses allowance goodwill
+intangible amortization depreciation tax provision effective deferred lease obligations commitments
+contingencies litigation regulatory compliance acquisition integration headcount restructuring""".split()
+
+SYLLABLES = ["ac", "ble", "cor", "da", "en", "fi", "gra", "hol", "in", "ja", "ket", "lo", "man", "nu", "or",
+             "pre", "qua", "ri", "sto", "tri", "un", "ver", "wo", "xe", "yi", "zo"]
+
+
+def vocabulary(size=20_000, seed=0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    words, seen = list(FILING_WORDS), set(FILING_WORDS)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class SyntheticCorpus:
+    def __init__(self, seed=0, vocabulary_size=20_000, zipf=1.1):
+        self.rng = np.random.default_rng(seed)
+        self.words = np.array(vocabulary(vocabulary_size, seed))
+        weights = 1 / np.arange(1, len(self.words) + 1) ** zipf
+        self.cdf = np.cumsum(weights / weights.sum())
+
+
+    def sentence(self, min_words=8, max_words=24) -> str:
+        n = int(self.rng.integers(min_words, max_words + 1))
+        ranks = np.minimum(np.searchsorted(self.cdf, self.rng.random(n)), len(self.words) - 1)
+        words = self.words[ranks]
+        return " ".join(words).capitalize() + "."
+
+
+    def paragraph(self, sentences=(3, 7)) -> str:
+        return " ".join(self.sentence() for _ in range(int(self.rng.integers(*sentences))))
+
+
+    def heading(self) -> str:
+        return " ".join(self.sentence(2, 4)[:-1].split()).title()
+
+
+    def chunk_texts(self, n, sentences=(3, 7), words=(8, 24)) -> list[str]:
+        # paragraph() n times, with the random draws done in bulk: a million chunks in seconds, not minutes
+        per_chunk = self.rng.integers(*sentences, size=n)
+        lengths = self.rng.integers(words[0], words[1] + 1, size=int(per_chunk.sum()))
+        ranks = np.minimum(np.searchsorted(self.cdf, self.rng.random(int(lengths.sum()))), len(self.words) - 1)
+        tokens = self.words[ranks].tolist()
+        sentence_ends = np.cumsum(lengths).tolist()
+        out, start, s = [], 0, 0
+        for count in per_chunk.tolist():
+            parts = []
+            for end in sentence_ends[s:s + count]:
+                parts.append(" ".join(tokens[start:end]).capitalize() + ".")
+                start = end
+            s += count
+            out.append(" ".join(parts))
+        return out
+
+
+    def queries(self, n) -> list[str]:
+        return [self.sentence(3, 8)[:-1] for _ in range(n)]
+
+
+    def write_pdf(self, path, pages, paragraphs_per_page=4):
+        # 20pt bold headings open a section (the parser's threshold is 14pt bold); one table every third page
+        import fitz
+        pdf = fitz.open()
+        for page_no in range(pages):
+            page = pdf.new_page()
+            y = 60
+            if page_no % 2 == 0:
+                page.insert_text((50, y), self.heading(), fontsize=20, fontname="hebo")
+                y += 30
+            for _ in range(paragraphs_per_page):
+                page.insert_textbox(fitz.Rect(50, y, 550, y + 100), self.paragraph((2, 4)),
+                                    fontsize=9, fontname="helv")
+                y += 105
+            if page_no % 3 == 0:
+                self._pdf_table(page, y + 10)
+        pdf.save(path)
+        pdf.close()
+
+
+    def _pdf_table(self, page, top, rows=4, cols=3):
+        import fitz
+        for r in range(rows + 1):
+            page.draw_line((50, top + r * 20), (50 + cols * 120, top + r * 20))
+        for c in range(cols + 1):
+            page.draw_line((50 + c * 120, top), (50 + c * 120, top + rows * 20))
+        for r in range(rows):
+            for c in range(cols):
+                text = self.heading() if c == 0 else f"{self.rng.integers(1, 9999):,}"
+                page.insert_textbox(fitz.Rect(54 + c * 120, top + r * 20 + 4, 166 + c * 120, top + r * 20 + 20),
+                                    text[:20], fontsize=8, fontname="helv")
+
+
+    def write_docx(self, path, pages, paragraphs_per_page=4):
+        # A page break after every page's worth of paragraphs, so pages/sec compares with the PDF parser
+        from docx import Document
+        from docx.enum.text import WD_BREAK
+        doc = Document()
+        for page_no in range(pages):
+            if page_no % 2 == 0:
+                doc.add_heading(self.heading(), level=1 if page_no % 10 == 0 else 2)
+            for _ in range(paragraphs_per_page):
+                paragraph = doc.add_paragraph(self.paragraph((2, 4)))
+            if page_no % 3 == 0:
+                table = doc.add_table(rows=4, cols=3)
+                for row in table.rows:
+                    for c, cell in enumerate(row.cells):
+                        cell.text = self.heading() if c == 0 else f"{self.rng.integers(1, 9999):,}"
+            paragraph.add_run().add_break(WD_BREAK.PAGE)
+        doc.save(path)
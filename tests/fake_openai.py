@@ -0,0 +1,147 @@
+import base64, hashlib, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def fake_embedding(text: str, dimension: int) -> np.ndarray:
+    # Deterministic unit vector seeded by the text
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI REST API. Use as a context manager and point base_url at .url.
+
+    Serves /embeddings and /chat/completions; streamed completions send answer word by word,
+    token_delay apart, and count clients that hang up mid-stream in .disconnects.
+    """
+
+    def __init__(self, dimension=1536, latency=0.0, answer="Revenue was $1.2 billion [Source 1].", token_delay=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.answer = answer
+        self.token_delay = token_delay
+        self.disconnects = 0
+        self.requests = []
+        self.failures = []  # queued (status, headers) responses served before real ones
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}/v1"
+
+
+    def fail_next(self, count=1, status=429, headers=None):
+        self.failures.extend([(status, headers or {})] * count)
+
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for i, chunk in enumerate(chunks):
+                        if i and fake.token_delay: time.sleep(fake.token_delay)
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    with fake._lock:
+                        fake.disconnects += 1
+                self.close_connection = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake._lock:
+                    fake.requests.append((self.path, body))
+                    failure = fake.failures.pop(0) if fake.failures else None
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    if fake.latency: time.sleep(fake.latency)
+                    if failure:
+                        status, headers = failure
+                        return self._send_json(status, {"error": {"message": "fake failure", "type": "rate_limit"}}, headers)
+                    if self.path.endswith("/embeddings"):
+                        return self._send_json(200, fake._embeddings(body))
+                    if self.path.endswith("/chat/completions"):
+                        if body.get("stream"):
+                            return self._stream(fake._chat_chunks(body))
+                        return self._send_json(200, fake._chat(body))
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+        return Handler
+
+
+    def _embeddings(self, body):
+        inputs = [body["input"]] if isinstance(body["input"], str) else body["input"]
+        dimension = body.get("dimensions", self.dimension)
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dimension)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(t.split()) for t in inputs)
+        return {"object": "list", "data": data, "model": body["model"],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+    def _tokens(self):
+        words = self.answer.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+
+    def _chat(self, body):
+        tokens = self._tokens()
+        return {"id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}}
+
+
+    def _chat_chunks(self, body):
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body["model"]}
+        tokens = self._tokens()
+        yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+        for token in tokens:
+            yield {**base, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if body.get("stream_options", {}).get("include_usage"):
+            yield {**base, "choices": [], "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens),
+                                                   "total_tokens": len(tokens)}}
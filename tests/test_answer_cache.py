@@ -0,0 +1,56 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.retrieval.answer_cache import AnswerCache
+from app.retrieval.bm25_store import BM25Store
+from app.retrieval.generation import index_generation
+
+
+# test_answer_cache.py
+def test_exact_hit_ignores_case_spacing_and_punctuation():
+    cache = AnswerCache(max_entries=10, ttl=60, semantic_threshold=0)
+    cache.put("What was total revenue?", "answer", doc_filter="q1-cache")
+    assert cache.get("  what was TOTAL revenue ", doc_filter="q1-cache") == "answer"
+    assert cache.get("What was total revenue?", doc_filter="q2-cache") is None
+    assert cache.get("What was total revenue?", doc_filter="q1-cache", top_k=10) is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_writes_invalidate_only_affected_answers():
+    cache = AnswerCache(max_entries=10, ttl=60, semantic_threshold=0)
+    cache.put("revenue", "q1 answer", doc_filter="q1-gen")
+    cache.put("revenue", "q2 answer", doc_filter="q2-gen")
+    cache.put("revenue", "global answer")
+    BM25Store().add_documents([{"text": "Total revenue grew", "doc_id": "q1-gen"}])
+    assert cache.get("revenue", doc_filter="q1-gen") is None
+    assert cache.get("revenue", doc_filter="q2-gen") == "q2 answer"
+    assert cache.get("revenue") is None
+    assert cache.stats()["invalidated"] == 2
+
+
+def test_generation_taken_before_answering_wins():
+    cache = AnswerCache(max_entries=10, ttl=60, semantic_threshold=0)
+    generation = cache.generation("q3-gen")
+    index_generation.bump(["q3-gen"])  # document rewritten while the answer was being generated
+    cache.put("revenue", "stale answer", doc_filter="q3-gen", generation=generation)
+    assert cache.get("revenue", doc_filter="q3-gen") is None
+
+
+def test_ttl_and_size_bound():
+    cache = AnswerCache(max_entries=2, ttl=0.05, semantic_threshold=0)
+    for q in ("a", "b", "c"):
+        cache.put(q, q)
+    assert cache.get("a") is None and cache.get("c") == "c"
+    time.sleep(0.06)
+    assert cache.get("c") is None
+
+
+def test_semantic_lookup_above_threshold():
+    cache = AnswerCache(max_entries=10, ttl=60, semantic_threshold=0.95)
+    cache.put("What was total revenue?", "answer", embedding=[1.0, 0.0, 0.0])
+    assert cache.get("How much revenue in total?", embedding=[0.99, 0.05, 0.0]) == "answer"
+    assert cache.get("What was net loss?", embedding=[0.6, 0.8, 0.0]) is None
+    assert cache.stats()["semantic_hits"] == 1
@@ -0,0 +1,102 @@
+import sys
+import json
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.ingestion.pipeline import IngestionStats
+from app.main import create_app
+from app.retrieval.rag_pipeline import RAGResponse
+
+
+# test_api.py
+class StubRAG:
+    answer_cache = None
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+        self.closed = threading.Event()
+
+    def query(self, question, doc_filter=None, top_k=5):
+        self.started.set()
+        self.release.wait(5)
+        return RAGResponse(answer=f"answer to {question}", sources=[], query=question)
+
+    def query_stream(self, question, doc_filter=None, top_k=5):
+        try:
+            yield {"type": "sources", "sources": []}
+            yield {"type": "token", "text": "Revenue"}
+            yield {"type": "done", "metrics": {"cancelled": False}}
+        finally:
+            self.closed.set()
+
+
+class StubIngestion:
+    def __init__(self):
+        self.ingested, self.removed = [], []
+        self.vector_store = self.bm25_store = self.manifest = self
+
+    def ingest(self, documents):
+        self.ingested.extend(documents)
+        return IngestionStats(docs=len(documents), chunks=3)
+
+    def remove_document(self, doc_id):
+        self.removed.append(doc_id)
+
+    def save(self):
+        pass
+
+
+def test_query_and_stream():
+    rag = StubRAG()
+    with TestClient(create_app(rag, StubIngestion())) as client:
+        response = client.post("/query", json={"question": "revenue?", "doc_filter": "q1"})
+        assert response.status_code == 200 and response.json()["answer"] == "answer to revenue?"
+        assert client.post("/query", json={"question": ""}).status_code == 422
+
+        with client.stream("POST", "/query/stream", json={"question": "revenue?"}) as stream:
+            assert stream.headers["content-type"].startswith("text/event-stream")
+            events = [json.loads(line[len("data: "):]) for line in stream.iter_lines() if line]
+        assert [e["type"] for e in events] == ["sources", "token", "done"]
+        assert rag.closed.is_set()
+        assert client.get("/health").json()["admission"]["stream"]["in_flight"] == 0
+
+
+def test_query_over_limit_gets_429(monkeypatch):
+    monkeypatch.setattr(settings, "api_query_concurrency", 1)
+    rag = StubRAG()
+    rag.release.clear()
+    with TestClient(create_app(rag, StubIngestion())) as client:
+        first = {}
+        worker = threading.Thread(target=lambda: first.update(r=client.post("/query", json={"question": "a"})))
+        worker.start()
+        assert rag.started.wait(5)
+        rejected = client.post("/query", json={"question": "b"})
+        assert rejected.status_code == 429 and rejected.headers["retry-after"] == "1"
+        rag.release.set()
+        worker.join(5)
+        assert first["r"].status_code == 200
+        admission = client.get("/health").json()["admission"]["query"]
+        assert admission["rejected"] == 1 and admission["in_flight"] == 0
+
+
+def test_ingest_and_delete(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    ingestion = StubIngestion()
+    with TestClient(create_app(StubRAG(), ingestion)) as client:
+        response = client.post("/ingest", files=[("files", ("q1-report.docx", b"docx bytes"))])
+        assert response.status_code == 200 and response.json()["chunks"] == 3
+        assert ingestion.ingested == [(str(tmp_path / "q1-report.docx"), "q1-report")]
+        assert (tmp_path / "q1-report.docx").read_bytes() == b"docx bytes"
+        assert client.post("/ingest", files=[("files", ("notes.txt", b"x"))]).status_code == 400
+        same_stem = [("files", ("q2.pdf", b"pdf bytes")), ("files", ("q2.docx", b"docx bytes"))]
+        assert client.post("/ingest", files=same_stem).status_code == 400 and len(ingestion.ingested) == 1
+        assert client.delete("/documents/q1-report").json() == {"doc_id": "q1-report", "deleted": True}
+        assert client.delete("/documents/2023/q1-report").json()["doc_id"] == "2023/q1-report"
+        assert ingestion.removed == ["q1-report", "2023/q1-report"]
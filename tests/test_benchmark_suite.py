@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ingestion.parser import BlockType, DOCXParser, PDFParser
+from benchmarks.suite import compare
+from benchmarks.synthetic import SyntheticCorpus
+
+
+# test_benchmark_suite.py
+def test_synthetic_corpus_is_deterministic_and_parseable(tmp_path):
+    assert SyntheticCorpus(seed=3).chunk_texts(50) == SyntheticCorpus(seed=3).chunk_texts(50)
+    assert SyntheticCorpus(seed=3).chunk_texts(50) != SyntheticCorpus(seed=4).chunk_texts(50)
+
+    corpus = SyntheticCorpus()
+    corpus.write_pdf(str(tmp_path / "synthetic.pdf"), pages=6)
+    corpus.write_docx(str(tmp_path / "synthetic.docx"), pages=6)
+    pdf = PDFParser(parallel_workers=1).parse(str(tmp_path / "synthetic.pdf"), "pdf")
+    docx = DOCXParser().parse(str(tmp_path / "synthetic.docx"), "docx")
+    assert pdf.total_pages == 6
+    for doc in (pdf, docx):
+        types = {b.block_type for b in doc.blocks}
+        assert {BlockType.HEADING, BlockType.PARAGRAPH, BlockType.TABLE} <= types
+        assert sum(b.block_type == BlockType.HEADING for b in doc.blocks) == 3
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = {"config": {"seed": 0}, "bm25": {"10000": {"build_s": 1.0, "query": {"p50_ms": 4.0, "p99_ms": 6.0}}},
+                "parsing": {"pdf": {"pages_per_s": 40.0}}, "rag": {"query": {"p50_ms": 20.0}}}
+    current = {"config": {"seed": 1}, "bm25": {"10000": {"build_s": 1.2, "query": {"p50_ms": 6.0, "p99_ms": 60.0}}},
+               "parsing": {"pdf": {"pages_per_s": 20.0}}, "chunker": {"chunks_per_s": 1.0}}
+    regressions = compare(current, baseline, tolerance=0.25)
+    assert [r["metric"] for r in regressions] == ["bm25.10000.query.p50_ms", "parsing.pdf.pages_per_s"]
+    assert regressions[0]["change"] == "+50%"
+    assert compare(baseline, baseline, tolerance=0.0) == []
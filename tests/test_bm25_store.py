@@ -0,0 +1,132 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.retrieval.bm25_segment import VERSION
+from app.retrieval.bm25_store import BM25Store
+from app.retrieval.chunk_store import ChunkStore
+
+
+# test_bm25_store.py
+chunks = [
+    {"text": "Total revenue grew to 1.2 billion dollars", "doc_id": "q1", "chunk_id": "a"},
+    {"text": "Float revenue from customer funds increased", "doc_id": "q1", "chunk_id": "b"},
+    {"text": "Net loss per share narrowed in the quarter", "doc_id": "q2", "chunk_id": "c"},
+    {"text": "Subscription and transaction revenue drove growth", "doc_id": "q2", "chunk_id": "d"},
+]
+
+
+def results(store, hits):
+    return [{**chunk, "bm25_score": score} for chunk, score in zip(store.chunks.hydrate(hits.ids), hits.scores)]
+
+
+def test_incremental_matches_bulk():
+    bulk, incremental = BM25Store(chunks=ChunkStore("")), BM25Store(chunks=ChunkStore(""))
+    bulk.add_documents(chunks)
+    for chunk in chunks:
+        incremental.add_documents([chunk])
+    assert bulk.search("revenue growth") == incremental.search("revenue growth")
+
+
+def test_delete_then_compact():
+    store = BM25Store(compaction_ratio=1.0, chunks=ChunkStore(""))
+    store.add_documents(chunks)
+    assert store.delete_document("q1") == 2
+    assert store.chunks.live_count == 2
+    tombstoned = results(store, store.search("revenue"))
+    assert all(r["doc_id"] == "q2" for r in tombstoned)
+    store.compact()
+    assert results(store, store.search("revenue")) == tombstoned
+    assert store.delete_chunks(["d"], "q2") == 1
+    assert [r["chunk_id"] for r in results(store, store.search("revenue"))] == []
+
+
+def test_segment_roundtrip(tmp_path):
+    store = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None,
+                      chunks=ChunkStore(str(tmp_path / "chunks.seg")))
+    store.add_documents(chunks)
+    expected = store.search("revenue")
+    store.save()
+    reopened = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None,
+                         chunks=ChunkStore(str(tmp_path / "chunks.seg")))
+    reopened.load()
+    assert reopened.search("revenue") == expected
+    assert results(reopened, expected) == results(store, expected)
+    assert results(reopened, expected)[0]["text"] == "Total revenue grew to 1.2 billion dollars"
+
+
+def test_filter_applied_before_top_k():
+    store = BM25Store(chunks=ChunkStore(""))
+    store.add_documents(chunks)
+    assert [r["doc_id"] for r in results(store, store.search("revenue", top_k=1, doc_filter="q2"))] == ["q2"]
+    assert store.search("revenue", doc_filter={"doc_id": "q2"}) == store.search("revenue", doc_filter="q2")
+    # chunk_id has no bitmap in the index; the chunk store column is matched instead
+    assert store.search("revenue", doc_filter={"chunk_id": "b"}).ids.tolist() == store.chunks.ids_of(["b"])
+
+
+def write_v1_segment(path, docs):
+    # The version 1 layout: the v2 sections up to the chunk payloads, no facets
+    import json, struct
+    import numpy as np
+    from app.retrieval.bm25_segment import HEADER, MAGIC, V1_SECTIONS
+    store = BM25Store(chunks=ChunkStore(""))
+    store.add_documents(docs)
+    _, doc_len, postings = store._merged()
+    blobs = [json.dumps(doc).encode() for doc in docs]
+    sections = {
+        "vocab_blob": np.frombuffer(b"".join(t.encode() for t, _, _ in postings), dtype=np.uint8),
+        "vocab_offsets": np.cumsum([0] + [len(t.encode()) for t, _, _ in postings], dtype=np.uint64),
+        "term_df": np.asarray([len(ids) for _, ids, _ in postings], dtype=np.uint32),
+        "postings_offsets": np.cumsum([0] + [2 * len(ids) for _, ids, _ in postings], dtype=np.uint64),
+        "postings": np.concatenate([np.concatenate([np.diff(ids, prepend=0), tfs]) for _, ids, tfs in postings])
+                      .astype(np.uint32),
+        "doc_len": np.asarray(doc_len, dtype=np.uint32),
+        "doc_offsets": np.cumsum([0] + [len(b) for b in blobs], dtype=np.uint64),
+        "doc_blob": np.frombuffer(b"".join(blobs), dtype=np.uint8),
+    }
+    table_format = "<" + "QQ" * len(V1_SECTIONS)
+    table, offset = [], HEADER.size + struct.calcsize(table_format)
+    for name, _ in V1_SECTIONS:
+        offset += -offset % 8
+        table += [offset, len(sections[name])]
+        offset += sections[name].nbytes
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 1, len(docs), len(postings), float(sum(doc_len)), 0.0))
+        f.write(struct.pack(table_format, *table))
+        for i, (name, _) in enumerate(V1_SECTIONS):
+            f.write(b"\x00" * (table[2 * i] - f.tell()))
+            f.write(sections[name].tobytes())
+
+
+def test_version_1_segment_is_migrated(tmp_path):
+    write_v1_segment(str(tmp_path / "bm25.seg"), chunks)
+    store = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None,
+                      chunks=ChunkStore(str(tmp_path / "chunks.seg")))
+    store.load()
+    fresh = BM25Store(chunks=ChunkStore(""))
+    fresh.add_documents(chunks)
+    assert results(store, store.search("revenue", doc_filter="q2")) == \
+        results(fresh, fresh.search("revenue", doc_filter="q2"))
+    reopened = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None,
+                         chunks=ChunkStore(str(tmp_path / "chunks.seg")))
+    reopened.load()
+    assert reopened._segment.version == VERSION
+    assert results(reopened, reopened.search("revenue")) == results(store, store.search("revenue"))
+
+
+def test_delete_does_not_need_the_chunk_text(tmp_path):
+    # Another writer (the vector store, an API delete) may have deleted and saved the chunks already,
+    # which drops their text from the chunk store
+    store = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None,
+                      chunks=ChunkStore(str(tmp_path / "chunks.seg")))
+    store.add_documents(chunks[:3])
+    store.save()
+    store.add_documents(chunks[3:])
+    store.chunks.delete(store.chunks.ids_of(["a", "d"]))
+    store.chunks.save()
+    assert store.delete_chunks(["a"], "q1") == store.delete_chunks(["d"]) == 1
+    fresh = BM25Store(chunks=ChunkStore(""))
+    fresh.add_documents([chunks[1], chunks[2]])
+    assert store._total_len == fresh._total_len
+    assert results(store, store.search("revenue quarter")) == results(fresh, fresh.search("revenue quarter"))
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ingestion.chunker import Chunk
+from app.retrieval.chunk_store import ChunkStore, chunk_key
+
+
+# test_chunk_store.py
+def make_chunks(doc_id, n, page=1):
+    return [Chunk(text=f"{doc_id} paragraph {i} on revenue", doc_id=doc_id, chunk_index=i, page_number=page,
+                  section_title=f"Section {i % 2}", parent_section="Results", chunk_id=f"{doc_id}-{i}")
+            for i in range(n)]
+
+
+def keys(*chunk_ids):
+    return [chunk_key(chunk_id) for chunk_id in chunk_ids]
+
+
+def test_ids_are_stable_across_adds_deletes_and_saves(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.seg"))
+    q1, q2 = make_chunks("q1", 3), make_chunks("q2", 2)
+    assert store.add(q1).tolist() == keys("q1-0", "q1-1", "q1-2")
+    assert store.add(q2 + q1[:1]).tolist() == keys("q2-0", "q2-1", "q1-0")
+    assert store.hydrate(keys("q2-1")) == [q2[1].to_dict()]
+    store.save()
+
+    store.delete(keys("q1-1"))
+    moved = make_chunks("q1", 3, page=7)
+    assert store.add(moved[2:]).tolist() == keys("q1-2")  # same chunk_id: same id, new metadata
+    store.add(make_chunks("q3", 1))
+    assert store.hydrate(keys("q1-1", "q1-2", "nope")) == [None, moved[2].to_dict(), None]
+    store.save()
+
+    reopened = ChunkStore(str(tmp_path / "chunks.seg"))
+    assert (reopened.count, reopened.live_count) == (6, 5)
+    assert reopened.hydrate(keys("q1-0", "q1-1", "q1-2", "q2-0", "q2-1", "q3-0")) == \
+        [c.to_dict() if c else None for c in [q1[0], None, moved[2], q2[0], q2[1], make_chunks("q3", 1)[0]]]
+    assert reopened.values(keys("q1-1"), "text") == [""]  # dropped from the deleted row on save
+    assert reopened.ids_of(["q1-1", "q2-0", "nope"]) == keys("q1-1", "q2-0")
+    assert reopened.add(q1[1:2]).tolist() == keys("q1-1") and reopened.hydrate(keys("q1-1")) == [q1[1].to_dict()]
+
+
+def test_filters_and_document_ids(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.seg"))
+    ids = store.add(make_chunks("q1", 4) + make_chunks("q2", 2, page=3)).tolist()
+    store.save()
+    ids += store.add(make_chunks("q3", 2)).tolist()
+    store.delete(store.ids_of(["q1-2"]))
+    assert store.document_ids("q1").tolist() == keys("q1-0", "q1-1", "q1-3")
+    assert store.document_ids("q3").tolist() == keys("q3-0", "q3-1")
+    assert store.matches(ids, "page_number", 3).tolist() == [False] * 4 + [True] * 2 + [False] * 2
+    assert store.matches(ids, "section_title", "Section 1").tolist() == [False, True] * 4
+    assert store.matches(ids, "parent_section", "Results").all()
+    assert not store.matches(ids, "unknown", "x").any()
+    assert store.values(ids[5:7] + [1], "doc_id") == ["q2", "q3", None]
+
+
+def test_reader_picks_up_rows_saved_by_another_process(tmp_path):
+    writer, reader = ChunkStore(str(tmp_path / "chunks.seg")), ChunkStore(str(tmp_path / "chunks.seg"))
+    assert reader.hydrate(keys("q1-1")) == [None]
+    writer.add(make_chunks("q1", 2))
+    writer.save()
+    assert reader.hydrate(keys("q1-1")) == [make_chunks("q1", 2)[1].to_dict()]
+
+
+def test_writers_in_two_processes_keep_each_others_rows(tmp_path):
+    # e.g. the ingestion CLI and an API worker: both assign the same ids, and a save merges the other's file
+    cli, api = ChunkStore(str(tmp_path / "chunks.seg")), ChunkStore(str(tmp_path / "chunks.seg"))
+    x, y = make_chunks("x", 2), make_chunks("y", 2)
+    cli.add(x)
+    api.add(y + x[:1])
+    cli.save()
+    api.delete(keys("x-0"))
+    api.save()
+    merged = ChunkStore(str(tmp_path / "chunks.seg"))
+    assert merged.hydrate(keys("x-0", "x-1", "y-0", "y-1")) == [None, x[1].to_dict(), y[0].to_dict(), y[1].to_dict()]
+    assert merged.hydrate(cli.add(x[1:])) == merged.hydrate(api.add(x[1:])) == [x[1].to_dict()]
+
+
+def test_chunks_without_chunk_id_are_keyed_by_content():
+    store = ChunkStore("")
+    chunk = {"text": "Revenue grew", "doc_id": "q1"}
+    assert store.add([chunk, dict(chunk)]).tolist() == store.add([chunk]).tolist()[:1] * 2
+    assert store.count == 1 and store.add([{**chunk, "page_number": 2}])[0] != store.add([chunk])[0]
@@ -18,3 +18,27 @@ print(f"Tables: {sum(1 for c in chunks if c.chunk_type == 'table')}")
 for c in chunks[:15]:
     print(f"[{c.chunk_type}] ({c.token_count} tok) Section: {c.section_title}")
     print(f"  {c.text[:150]}...")
+
+
+def test_streaming_matches_batch():
+    from app.ingestion.parser import DocumentBlock, ParsedDocument
+    blocks = doc.blocks[:300]
+    batch = chunker.chunk_document(ParsedDocument(doc_id="test-001", filename="", blocks=blocks))
+    streamed = list(chunker.iter_chunks((DocumentBlock(**vars(b)) for b in blocks), "test-001"))
+    assert [c.to_dict() for c in streamed] == [c.to_dict() for c in batch]
+
+
+def test_split_token_counts_match_text():
+    from app.ingestion.parser import BlockType, DocumentBlock
+    text = " ".join(f"Revenue in quarter {i} grew {i * 3}% to ${i * 11}.5 million!" for i in range(200))
+    block = DocumentBlock(content=text, block_type=BlockType.PARAGRAPH, page_number=1)
+    pieces = chunker._split_with_overlap(block, "test-001")
+    assert len(pieces) > 1
+    for c in pieces:
+        assert c.token_count == chunker.preprocessor.count_tokens(c.text)
+
+
+def test_special_token_text_is_counted_like_the_batch_path():
+    text = "Model card: documents end with <|endoftext|> in the raw dump."
+    preprocessor = chunker.preprocessor
+    assert preprocessor.count_tokens(text) == preprocessor.count_tokens_batch([text, text])[0] > 0
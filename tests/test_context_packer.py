@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ingestion.chunker import StructureAwareChunker
+from app.ingestion.parser import BlockType, DocumentBlock
+from app.retrieval.context_packer import ContextPacker, overlap_length
+
+
+def _chunks():
+    text = " ".join(f"Sentence number {i} talks about quarterly revenue and operating margin." for i in range(60))
+    blocks = [DocumentBlock(content=text, block_type=BlockType.PARAGRAPH, page_number=1, section_title="Results")]
+    chunker = StructureAwareChunker(max_tokens=64, overlap_tokens=20)
+    return [c.to_dict() for c in chunker.iter_chunks(blocks, "doc-pack")]
+
+
+# test_context_packer.py
+def test_adjacent_chunks_merge_without_overlap():
+    chunks = _chunks()
+    assert overlap_length(chunks[0]["text"], chunks[1]["text"]) > 0
+    packer = ContextPacker(budget_tokens=10000)
+    packed = packer.pack([chunks[2], chunks[0], chunks[1], chunks[5]])
+    assert len(packed.sources) == 2  # chunks 0-2 merged, ordered by their best rank
+    assert packed.chunk_ids[0] == [chunks[0]["chunk_id"], chunks[1]["chunk_id"], chunks[2]["chunk_id"]]
+    merged = packed.sources[0]["text"]
+    for i in range(30):
+        sentence = f"Sentence number {i} talks"
+        assert merged.count(sentence) == (1 if sentence in " ".join(c["text"] for c in chunks[:3]) else 0)
+    assert "[Source 2]" in packed.text and "[Source 3]" not in packed.text
+    assert packed.saved_tokens > 0 and packed.dropped == 0
+
+
+def test_budget_filled_greedily_by_rank():
+    chunks = _chunks()
+    ranked = [chunks[6], chunks[0], chunks[3]]
+    full = ContextPacker(budget_tokens=10000).pack(ranked)
+    packed = ContextPacker(budget_tokens=full.tokens - 10).pack(ranked)
+    assert packed.tokens <= full.tokens - 10 and packed.dropped == 1
+    assert [ids[0] for ids in packed.chunk_ids] == [chunks[6]["chunk_id"], chunks[0]["chunk_id"]]
+
+
+def test_top_result_is_truncated_rather_than_dropped():
+    chunks = _chunks()
+    packed = ContextPacker(budget_tokens=20).pack([chunks[0]])
+    assert 0 < packed.tokens <= 20 and packed.text.startswith("[Source 1]")
+    assert ContextPacker(budget_tokens=20).pack([]).tokens == 0
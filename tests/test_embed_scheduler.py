@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI
+import numpy as np
+
+from app.ingestion.preprocessor import TextPreprocessor
+from app.retrieval.embed_scheduler import EmbeddingScheduler, RateLimiter
+from tests.fake_openai import FakeOpenAIServer, fake_embedding
+
+
+# test_embed_scheduler.py
+texts = [f"Quarter {i} revenue was {i * 7} million dollars." for i in range(40)]
+
+
+def make_scheduler(server, **kwargs):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    return EmbeddingScheduler(client, "text-embedding-3-small", TextPreprocessor(), **kwargs)
+
+
+def test_token_packed_batches_keep_order():
+    with FakeOpenAIServer(dimension=8, latency=0.02) as server:
+        scheduler = make_scheduler(server, max_batch_tokens=50, max_in_flight=4)
+        embeddings = scheduler.embed(texts)
+    assert len(server.requests) > 1
+    assert server.max_in_flight > 1
+    for text, embedding in zip(texts, embeddings):
+        assert np.allclose(embedding, fake_embedding(text, 8), atol=1e-6)
+
+
+def test_retries_after_rate_limit():
+    with FakeOpenAIServer(dimension=8) as server:
+        server.fail_next(2, status=429, headers={"retry-after-ms": "10"})
+        scheduler = make_scheduler(server)
+        embeddings = scheduler.embed(texts[:3])
+    assert len(server.requests) == 3
+    assert np.allclose(embeddings[2], fake_embedding(texts[2], 8), atol=1e-6)
+
+
+def test_zero_limit_means_unlimited():
+    for rpm, tpm in [(0, 0), (0, 1000), (1000, 0)]:
+        limiter = RateLimiter(rpm, tpm)
+        for _ in range(5):
+            limiter.acquire(100)  # returns at once, no ZeroDivisionError
+    assert limiter._requests < 1000 - 4  # the limited bucket is still drawn down
@@ -0,0 +1,136 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from app.ingestion.chunker import Chunk, make_chunk_id
+from app.retrieval.chunk_store import ChunkStore
+from app.retrieval.embedded_store import EmbeddedVectorStore
+from tests.fake_openai import fake_embedding
+
+
+# test_embedded_store.py
+class FakeEmbedder:
+    model, dimension = "fake", 32
+
+    def embed_batch(self, texts):
+        return [fake_embedding(t, self.dimension).tolist() for t in texts]
+
+    def embed_text(self, text):
+        return self.embed_batch([text])[0]
+
+    def embed_queries(self, texts):
+        return self.embed_batch(texts)
+
+
+def open_store(tmp_path, chunks=None, **kwargs):
+    chunks = chunks if chunks is not None else ChunkStore(str(tmp_path / "chunks.seg"))
+    return EmbeddedVectorStore(path=str(tmp_path / "index"), embedder=FakeEmbedder(), chunks=chunks, **kwargs)
+
+
+def hydrate(store, hits):
+    return [{**chunk, "score": score} for chunk, score in zip(store.chunks.hydrate(hits.ids), hits.scores.tolist())]
+
+
+def search(store, query, **kwargs):
+    return hydrate(store, store.search(query, **kwargs))
+
+
+def make_chunks(n, doc_count=4):
+    chunks = []
+    for i in range(n):
+        text = f"Segment {i} revenue grew {i % 17}% on higher demand"
+        doc_id = f"doc-{i % doc_count}"
+        chunks.append(Chunk(text=text, doc_id=doc_id, chunk_index=i, page_number=1 + i % 5,
+                            section_title=f"Section {i % 3}", chunk_id=make_chunk_id(doc_id, text)))
+    return chunks
+
+
+def brute_force(chunks, query, top_k, keep=lambda c: True):
+    query = fake_embedding(query, FakeEmbedder.dimension)
+    scored = [(float(fake_embedding(c.text, FakeEmbedder.dimension) @ query), c.chunk_id) for c in chunks if keep(c)]
+    return [chunk_id for _, chunk_id in sorted(scored, reverse=True)[:top_k]]
+
+
+def test_exact_search_filters_and_persists(tmp_path):
+    chunks = make_chunks(300)
+    store = open_store(tmp_path, hnsw_threshold=10_000)
+    store.add_chunks(chunks[:200])
+    store.add_chunks(chunks[200:])
+    results = search(store, "Segment 7 revenue", top_k=10)
+    assert [r["chunk_id"] for r in results] == brute_force(chunks, "Segment 7 revenue", 10)
+    by_id = {c.chunk_id: c for c in chunks}
+    assert all(r["text"] == by_id[r["chunk_id"]].text for r in results)
+
+    # page_number isn't indexed here; the chunk store's column is matched
+    filtered = search(store, "Segment 7 revenue", top_k=5, doc_filter={"doc_id": "doc-1", "page_number": 2})
+    assert [r["chunk_id"] for r in filtered] == brute_force(
+        chunks, "Segment 7 revenue", 5, lambda c: c.doc_id == "doc-1" and c.page_number == 2)
+
+    store.delete_document("doc-2")
+    moved = Chunk(**{**chunks[1].__dict__, "page_number": 99})
+    store.update_payloads([moved])
+    store.save()
+    reopened = open_store(tmp_path, hnsw_threshold=10_000)
+    assert reopened.live_count == reopened.chunks.live_count == 225
+    assert not reopened.search("Segment 7 revenue", top_k=300, doc_filter="doc-2")
+    assert search(reopened, chunks[1].text, top_k=1)[0]["page_number"] == 99
+    assert reopened.search_batch(["Segment 7 revenue"], top_k=10)[0] == reopened.search("Segment 7 revenue", top_k=10)
+
+
+def test_int8_keeps_the_ranking(tmp_path):
+    chunks = make_chunks(300)
+    store = open_store(tmp_path, dtype="int8", hnsw_threshold=10_000)
+    store.add_chunks(chunks)
+    queries = [f"Segment {i} revenue grew" for i in range(20)]
+    recall = np.mean([len(set(r["chunk_id"] for r in search(store, q, top_k=10)) & set(brute_force(chunks, q, 10))) / 10
+                      for q in queries])
+    assert recall >= 0.95
+
+
+def test_hnsw_index_is_built_and_reloaded(tmp_path):
+    chunks = make_chunks(600)
+    store = open_store(tmp_path, hnsw_threshold=400)
+    store.add_chunks(chunks[:300])
+    assert store._hnsw is None
+    store.add_chunks(chunks[300:])
+    assert store._hnsw is not None and (tmp_path / "index" / "hnsw.bin").exists()
+    store.delete_document("doc-0")
+    store.save()
+
+    reopened = open_store(tmp_path, hnsw_threshold=400)
+    assert reopened._hnsw is not None
+    queries = [f"Segment {i} revenue grew" for i in range(20)]
+    live = [c for c in chunks if c.doc_id != "doc-0"]
+    batch = [hydrate(reopened, hits) for hits in reopened.search_batch(queries, top_k=10)]
+    found = [[r["chunk_id"] for r in rs] for rs in batch]
+    assert all(r["doc_id"] != "doc-0" for rs in batch for r in rs)
+    recall = np.mean([len(set(f) & set(brute_force(live, q, 10))) / 10 for f, q in zip(found, queries)])
+    assert recall >= 0.9
+    # A selective filter is answered by the exact scan
+    assert [r["chunk_id"] for r in search(reopened, queries[0], top_k=5, doc_filter="doc-1")] == \
+           brute_force(live, queries[0], 5, lambda c: c.doc_id == "doc-1")
+
+
+def test_payload_log_moves_to_the_chunk_store(tmp_path):
+    chunks = make_chunks(100)
+    store = open_store(tmp_path, chunks=ChunkStore(""), hnsw_threshold=10_000)
+    store.add_chunks(chunks)
+    store.delete_chunks([chunks[3].chunk_id], "doc-3")
+    expected = [r["chunk_id"] for r in search(store, "Segment 7 revenue", top_k=10)]
+    # Rewrite the log as it was before the chunk store: string ids and whole payloads
+    log = tmp_path / "index" / "payloads.jsonl"
+    records = [json.loads(line) for line in log.read_text().splitlines()]
+    legacy = [{"delete": chunks[3].chunk_id} if "delete" in r else
+              {"row": r["row"], "id": chunks[r["row"]].chunk_id, "payload": chunks[r["row"]].to_dict()}
+              for r in records]
+    log.write_text("".join(json.dumps(r) + "\n" for r in legacy))
+
+    migrated = open_store(tmp_path, hnsw_threshold=10_000)
+    assert migrated.live_count == migrated.chunks.live_count == 99
+    assert [r["chunk_id"] for r in search(migrated, "Segment 7 revenue", top_k=10)] == expected
+    assert all("payload" not in json.loads(line) for line in log.read_text().splitlines())
+    assert open_store(tmp_path, hnsw_threshold=10_000).chunks.live_count == 99
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.retrieval.embedding_cache import EmbeddingCache
+
+
+# test_embedding_cache.py
+def test_key_ignores_whitespace_but_not_model():
+    assert EmbeddingCache.key("m", 8, "total  revenue\n") == EmbeddingCache.key("m", 8, "total revenue")
+    assert EmbeddingCache.key("m", 8, "total revenue") != EmbeddingCache.key("other", 8, "total revenue")
+
+
+def test_lru_eviction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    assert cache.get_many(["a"]) == {"a": [1.0]}  # touch a so b is the eviction candidate
+    cache.put_many({"c": [3.0]})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,88 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+from app.retrieval.chunk_store import ChunkStore, Hits
+from app.retrieval.hybrid import HybridRetriever
+
+
+# test_hybrid.py
+class SlowLeg:
+    def __init__(self, delay, prefix, error=None, chunks=None):
+        self.delay, self.prefix, self.error = delay, prefix, error
+        self.chunks = chunks if chunks is not None else ChunkStore("")
+        texts = [f"{prefix} {i}" for i in range(3)] + ["shared"]
+        self.ids = self.chunks.add([{"text": t, "doc_id": "q1", "chunk_id": t} for t in texts])
+
+    def search(self, query, top_k=20, doc_filter=None):
+        time.sleep(self.delay)
+        if self.error: raise self.error
+        return Hits(self.ids, [1.0, 0.9, 0.8, 0.7])
+
+
+def legs(*args):
+    chunks = ChunkStore("")
+    return [SlowLeg(*leg_args, chunks=chunks) for leg_args in args]
+
+
+def test_legs_run_concurrently():
+    retriever = HybridRetriever(*legs((0.2, "vec"), (0.2, "bm25")), leg_timeout=1.0)
+    start = time.perf_counter()
+    results = retriever.search("revenue", top_k=10)
+    assert time.perf_counter() - start < 0.35
+    assert not results.partial
+    assert results[0]["text"] == "shared"  # ranked by both legs
+    assert results[0]["score"] == 0.7 and (results[0]["bm25_score"], results[0]["bm25_rank"]) == (0.7, 4)
+    assert len(results) == 7
+
+
+def test_deleted_chunks_are_skipped_after_fusion():
+    retriever = HybridRetriever(*legs((0.0, "vec"), (0.0, "bm25")), leg_timeout=1.0)
+    retriever.chunks.delete(retriever.chunks.ids_of(["shared", "vec 0"]))
+    assert [r["text"] for r in retriever.search("revenue", top_k=3)] == ["bm25 0", "vec 1", "bm25 1"]
+
+
+def test_late_leg_gives_partial_results():
+    retriever = HybridRetriever(*legs((0.5, "vec"), (0.0, "bm25")), leg_timeout=0.1)
+    start = time.perf_counter()
+    results = retriever.search("revenue", top_k=10)
+    assert time.perf_counter() - start < 0.3
+    assert results.partial and results.missing == ["vector"]
+    assert [r["text"] for r in results] == ["bm25 0", "bm25 1", "bm25 2", "shared"]
+
+
+def test_failed_leg_is_skipped_unless_both_fail():
+    retriever = HybridRetriever(*legs((0.0, "vec"), (0.0, "bm25", ValueError("boom"))), leg_timeout=1.0)
+    assert retriever.search("revenue").missing == ["bm25"]
+    retriever.vector_store.error = ConnectionError("down")
+    with pytest.raises(ConnectionError):
+        retriever.search("revenue")
+
+
+def test_search_batch_matches_search(tmp_path):
+    from app.retrieval.bm25_store import BM25Store
+    docs = [{"text": f"Segment {i} revenue grew {i}% on payment volume and float income", "doc_id": f"q{i % 3}"}
+            for i in range(30)] + [{"text": "Net loss narrowed as operating expenses fell", "doc_id": "q1"}]
+    chunks = ChunkStore(str(tmp_path / "chunks.seg"))
+    store = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None, chunks=chunks)
+    store.add_documents(docs[:20])
+    store.save()
+    store.add_documents(docs[20:])
+    store.delete_document("q2")
+
+    class BatchLeg(SlowLeg):
+        def search_batch(self, queries, top_k=20, doc_filter=None):
+            return [self.search(q, top_k, doc_filter) for q in queries]
+
+    retriever = HybridRetriever(BatchLeg(0.0, "vec", chunks=chunks), store, leg_timeout=1.0)
+    queries = ["revenue growth", "float income float", "net loss", "unknown terms"]
+    for doc_filter in (None, "q1"):
+        batch = retriever.search_batch(queries, top_k=8, doc_filter=doc_filter)
+        for query, results in zip(queries, batch):
+            single = retriever.search(query, top_k=8, doc_filter=doc_filter)
+            assert [r["text"] for r in results] == [r["text"] for r in single]
+            assert [r.get("bm25_score") for r in results] == pytest.approx([r.get("bm25_score") for r in single])
@@ -0,0 +1,149 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from docx import Document
+import pytest
+from qdrant_client import QdrantClient
+
+from app.config import settings
+from app.ingestion.manifest import IngestManifest
+from app.ingestion.pipeline import IngestionPipeline
+from app.retrieval.bm25_store import BM25Store
+from app.retrieval.chunk_store import ChunkStore
+from app.retrieval.embedder import EmbeddingService
+from app.retrieval.vector_store import VectorStore
+from tests.fake_openai import FakeOpenAIServer
+
+
+# test_incremental_ingest.py
+# Each paragraph is long enough to stay its own chunk instead of being merged with its neighbours
+paragraphs = [f"Note {i}. Revenue from segment {i} was {i * 13} million dollars, up {i}% from last year, driven by "
+              f"customer growth and higher processing volumes across all regions. Management expects segment {i} "
+              f"margins to stay within the range disclosed in the prior quarterly filing." for i in range(12)]
+new_paragraph = ("Note A. A brand new disclosure about float revenue was added this quarter, describing how interest "
+                 "earned on customer funds held in trust is recognized, how rate changes affect that revenue, and which "
+                 "portion of the balance is invested in short-term treasury securities and agency bonds.")
+
+
+def write_docx(path, paras):
+    doc = Document()
+    doc.add_heading("Results of Operations", level=1)
+    for text in paras:
+        doc.add_paragraph(text)
+    doc.save(path)
+
+
+def make_pipeline(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "openai_base_url", server.url)
+    monkeypatch.setattr(settings, "openai_api_key", "test")
+    monkeypatch.setattr(settings, "embedding_cache_path", "")
+    monkeypatch.setattr(settings, "embedding_dimension", 8)
+    chunks = ChunkStore(str(tmp_path / "chunks.seg"))
+    vector_store = VectorStore(client=QdrantClient(":memory:"), embedder=EmbeddingService(), chunks=chunks)
+    bm25 = BM25Store(index_path=str(tmp_path / "bm25.seg"), legacy_path=None, chunks=chunks)
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+    return IngestionPipeline(vector_store, bm25, parse_workers=1, embed_workers=1, upsert_workers=1, manifest=manifest)
+
+
+def indexed(pipeline):
+    chunks = pipeline.vector_store.chunks
+    points, _ = pipeline.vector_store.client.scroll(settings.collection_name, limit=1000)
+    vector_texts = sorted(c["text"] for c in chunks.hydrate([p.id for p in points]) if c["chunk_type"] != "heading")
+    bm25_texts = sorted(c["text"] for c in chunks.hydrate(pipeline.bm25_store.search("revenue", top_k=1000).ids))
+    return vector_texts, bm25_texts
+
+
+def test_reingest_embeds_only_changed_chunks(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write_docx(docs / "report.docx", paragraphs)
+    with FakeOpenAIServer(dimension=8) as server:
+        pipeline = make_pipeline(server, tmp_path, monkeypatch)
+        first = pipeline.ingest_directory(str(docs))
+        assert first.chunks == len(paragraphs) + 1
+        requests = len(server.requests)
+
+        assert pipeline.ingest_directory(str(docs)).skipped == 1
+        assert len(server.requests) == requests
+
+        # Insert one paragraph at the top and drop the last one
+        edited = [new_paragraph] + paragraphs[:-1]
+        write_docx(docs / "report.docx", edited)
+        second = pipeline.ingest_directory(str(docs))
+        embedded = [text for r in server.requests[requests:] for text in r[1]["input"]]
+        assert embedded == [edited[0]]
+        assert (second.chunks, second.deleted_chunks) == (1, 1)
+        assert second.moved_chunks == len(paragraphs) - 1
+
+        vector_texts, bm25_texts = indexed(pipeline)
+        assert vector_texts == bm25_texts == sorted(edited)
+        points, _ = pipeline.vector_store.client.scroll(settings.collection_name, limit=1000)
+        assert sorted(p.payload["chunk_index"] for p in points) == list(range(len(edited) + 1))
+        assert pipeline.vector_store.chunks.live_count == len(edited) + 1
+        assert ChunkStore(str(tmp_path / "chunks.seg")).live_count == len(edited) + 1
+
+        (docs / "report.docx").unlink()
+        pipeline.ingest_directory(str(docs), prune=True)
+        assert indexed(pipeline) == ([], [])
+        assert pipeline.vector_store.chunks.live_count == 0
+        assert pipeline.manifest.documents == {}
+
+
+def test_failed_reparse_keeps_the_indexed_version(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write_docx(docs / "report.docx", paragraphs)
+    with FakeOpenAIServer(dimension=8) as server:
+        pipeline = make_pipeline(server, tmp_path, monkeypatch)
+        pipeline.ingest_directory(str(docs))
+        before, entry = indexed(pipeline), pipeline.manifest.get("report")
+
+        (docs / "report.docx").write_bytes(b"truncated upload, not a zip archive")
+        stats = pipeline.ingest_directory(str(docs))
+        assert stats.failed == [str(docs / "report.docx")]
+        assert indexed(pipeline) == before
+        assert pipeline.manifest.get("report") == entry
+
+        (docs / "broken.docx").write_bytes(b"never parsed")
+        assert pipeline.ingest_directory(str(docs)).failed == [str(docs / "broken.docx"), str(docs / "report.docx")]
+        assert pipeline.manifest.get("broken") is None and indexed(pipeline) == before
+
+
+def test_failed_run_still_persists_the_stores(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write_docx(docs / "report.docx", paragraphs)
+    with FakeOpenAIServer(dimension=8) as server:
+        pipeline = make_pipeline(server, tmp_path, monkeypatch)
+        pipeline.ingest_directory(str(docs))
+        (docs / "report.docx").unlink()
+        write_docx(docs / "other.docx", paragraphs[:2])
+        server.fail_next(1, status=400)
+        with pytest.raises(Exception):
+            pipeline.ingest_directory(str(docs), prune=True)
+    # The pruned document is gone from the chunk store and the manifest on disk, not only from Qdrant
+    assert ChunkStore(str(tmp_path / "chunks.seg")).live_count == 0
+    assert IngestManifest(str(tmp_path / "manifest.json")).documents == {}
+
+
+def test_same_file_name_in_two_folders_stays_two_documents(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    for folder, paras in (("2022", paragraphs[:3]), ("2023", paragraphs[3:5])):
+        (docs / folder).mkdir(parents=True)
+        write_docx(docs / folder / "report.docx", paras)
+    write_docx(docs / "summary.docx", paragraphs[5:6])
+    with FakeOpenAIServer(dimension=8) as server:
+        pipeline = make_pipeline(server, tmp_path, monkeypatch)
+        pipeline.ingest_directory(str(docs))
+        assert sorted(pipeline.manifest.documents) == ["2022/report", "2023/report", "summary"]
+        assert indexed(pipeline)[0] == sorted(paragraphs[:6])
+        requests = len(server.requests)
+
+        # report.pdf next to report.docx would share its doc_id: nothing is ingested
+        (docs / "2023" / "report.pdf").write_bytes(b"%PDF-1.4")
+        with pytest.raises(ValueError, match="would both be ingested as 2023/report"):
+            pipeline.ingest_directory(str(docs))
+        assert len(server.requests) == requests and "2023/report" in pipeline.manifest.documents
+
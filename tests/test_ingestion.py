@@ -29,6 +29,6 @@ for file_path, doc_id in docs:
     print(f"Stored {count} chunks")
 
 
-results = vector_store.search("What is the Total Revenue in 2024 first quarter?")
-for r in results[:3]:
-    print(f"Score: {r['score']:.4f} | Section: {r['section_title']} | {r['text'][:100]}")
+hits = vector_store.search("What is the Total Revenue in 2024 first quarter?", top_k=3)
+for r, score in zip(vector_store.chunks.hydrate(hits.ids), hits.scores):
+    print(f"Score: {score:.4f} | Section: {r['section_title']} | {r['text'][:100]}")
@@ -3,6 +3,8 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
+import pytest
+
 from app.ingestion.parser import PDFParser, BlockType
 parser = PDFParser()
 doc = parser.parse("data/sample_docs/bill-20231231.pdf", "test-001")
@@ -13,3 +15,45 @@ for block in doc.blocks:
     # Print blocks from specific page
     if block.page_number == 10:
         print(f"[{block.block_type.value}] sec.{block.section_title} p.{block.page_number}: {block.content[:80]}...")
+
+
+def write_table_pdf(path):
+    # Page 1: a paragraph, a fully ruled 3x3 table, another paragraph; page 2: a header rule and text only
+    import fitz
+    pdf = fitz.open()
+    page = pdf.new_page(width=400, height=400)
+    page.insert_text((40, 50), "Revenue grew in every segment this year.", fontsize=10)
+    rows = [["Segment", "2023", "2022"], ["Payments", "120", "100"], ["Lending", "80", "75"]]
+    top, height, xs = 80, 20, [40, 160, 240, 320]
+    for i in range(len(rows) + 1):
+        page.draw_line((xs[0], top + i * height), (xs[-1], top + i * height))
+    for x in xs:
+        page.draw_line((x, top), (x, top + len(rows) * height))
+    for i, row in enumerate(rows):
+        for x, cell in zip(xs, row):
+            page.insert_text((x + 4, top + i * height + 14), cell, fontsize=10)
+    page.insert_text((40, 180), "Lending margins narrowed slightly.", fontsize=10)
+    plain = pdf.new_page(width=400, height=400)
+    plain.draw_line((40, 30), (360, 30))
+    plain.insert_text((40, 60), "No tables on this page.", fontsize=10)
+    pdf.save(str(path))
+
+
+@pytest.mark.parametrize("engine", ["pdfplumber", "pymupdf"])
+def test_pdf_tables_in_reading_order(tmp_path, engine):
+    import fitz
+    write_table_pdf(tmp_path / "tables.pdf")
+    pdf_parser = PDFParser(parallel_workers=0, table_engine=engine)
+    with fitz.open(str(tmp_path / "tables.pdf")) as pdf:
+        # A lone header rule doesn't make a page pay for table detection
+        assert [pdf_parser._has_ruling(page) for page in pdf] == [True, False]
+
+    blocks = pdf_parser.parse(str(tmp_path / "tables.pdf"), "tables").blocks
+    # The table sits between the paragraphs around it, and its cell text isn't repeated as paragraphs
+    assert [(b.block_type, b.page_number, b.content) for b in blocks] == [
+        (BlockType.PARAGRAPH, 1, "Revenue grew in every segment this year."),
+        (BlockType.TABLE, 1, "Segment\t2023\t2022\nPayments\t120\t100\nLending\t80\t75"),
+        (BlockType.PARAGRAPH, 1, "Lending margins narrowed slightly."),
+        (BlockType.PARAGRAPH, 2, "No tables on this page."),
+    ]
+
@@ -0,0 +1,113 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI
+
+from app.config import settings
+from app.retrieval.hybrid import HybridResults
+from app.retrieval.rag_pipeline import RAGPipeline
+from tests.fake_openai import FakeOpenAIServer
+
+
+# test_query_stream.py
+sources = [{"text": "Total revenue was $1.2 billion", "section_title": "Results", "page_number": 3}]
+
+
+class FixedRetriever:
+    def search(self, query, top_k=5, doc_filter=None):
+        return sources
+
+
+def make_pipeline(server, monkeypatch):
+    monkeypatch.setattr(settings, "rerank_backend", "none")
+    monkeypatch.setattr(settings, "answer_cache_size", 0)
+    pipeline = RAGPipeline(vector_store=object(), bm25_store=object(),
+                           llm=OpenAI(api_key="test", base_url=server.url, max_retries=0))
+    pipeline.retriever = FixedRetriever()
+    return pipeline
+
+
+def test_sources_first_then_tokens_and_metrics(monkeypatch):
+    answer = "Total revenue was $1.2 billion in fiscal 2024 [Source 1]."
+    with FakeOpenAIServer(answer=answer, latency=0.05, token_delay=0.01) as server:
+        events = list(make_pipeline(server, monkeypatch).query_stream("What was total revenue?"))
+    assert events[0] == {"type": "sources", "sources": sources, "partial": False, "missing": []}
+    assert "".join(e["text"] for e in events if e["type"] == "token") == answer
+    assert server.requests[-1][1]["stream"] is True
+    metrics = events[-1]["metrics"]
+    assert events[-1]["type"] == "done" and not metrics["cancelled"]
+    assert metrics["tokens"] == len(answer.split(" "))
+    assert 0.05 <= metrics["llm_ttft_s"] <= metrics["ttft_s"] < metrics["total_s"]
+    assert metrics["tokens_per_s"] > 0
+
+
+def test_closing_the_generator_stops_the_completion(monkeypatch):
+    with FakeOpenAIServer(answer=" ".join(["word"] * 200), token_delay=0.01) as server:
+        pipeline = make_pipeline(server, monkeypatch)
+        stream = pipeline.query_stream("What was total revenue?")
+        assert next(stream)["type"] == "sources"
+        assert next(stream)["type"] == "token"
+        stream.close()
+        for _ in range(100):
+            if server.disconnects: break
+            time.sleep(0.02)
+    assert server.disconnects == 1
+    assert pipeline.stream_metrics[-1].cancelled
+
+
+def test_cancel_event_ends_with_done(monkeypatch):
+    cancel = threading.Event()
+    with FakeOpenAIServer(answer=" ".join(["word"] * 200), token_delay=0.005) as server:
+        events = []
+        for event in make_pipeline(server, monkeypatch).query_stream("revenue?", cancel=cancel):
+            events.append(event)
+            if len(events) == 3: cancel.set()
+    assert events[-1]["type"] == "done" and events[-1]["metrics"]["cancelled"]
+    assert len([e for e in events if e["type"] == "token"]) < 200
+
+
+class VectorLegDown:
+    def search(self, query, top_k=5, doc_filter=None):
+        return HybridResults(sources, missing=["vector"])
+
+
+def test_degraded_retrieval_is_marked(monkeypatch):
+    with FakeOpenAIServer(answer="Total revenue was $1.2 billion [Source 1].") as server:
+        pipeline = make_pipeline(server, monkeypatch)
+        pipeline.retriever = VectorLegDown()
+        response = pipeline.query("What was total revenue?")
+        events = list(pipeline.query_stream("What was total revenue?"))
+    assert (response.partial, response.missing) == (True, ["vector"])
+    assert events[0]["partial"] and events[0]["missing"] == ["vector"]
+    assert events[-1]["metrics"]["partial"] and events[-1]["metrics"]["missing"] == ["vector"]
+
+
+class FirstOnly:
+    def rerank(self, query, candidates, top_k=None):
+        return [{**candidates[0], "rerank_score": 1.0}]
+
+
+def test_reranked_results_stay_marked(monkeypatch):
+    with FakeOpenAIServer() as server:
+        pipeline = make_pipeline(server, monkeypatch)
+        pipeline.retriever, pipeline.reranker = VectorLegDown(), FirstOnly()
+        response = pipeline.query("What was total revenue?")
+    assert (response.partial, response.missing) == (True, ["vector"])
+
+
+def test_degraded_answers_are_not_cached(monkeypatch):
+    from app.retrieval.answer_cache import AnswerCache
+    with FakeOpenAIServer() as server:
+        pipeline = make_pipeline(server, monkeypatch)
+        pipeline.answer_cache = AnswerCache(max_entries=10, ttl=60, semantic_threshold=0)
+        pipeline.retriever = VectorLegDown()
+        assert not pipeline.query("What was total revenue?").cached
+        list(pipeline.query_stream("What was total revenue?"))
+        assert not pipeline.query("What was total revenue?").cached
+        pipeline.retriever = FixedRetriever()  # the leg recovered
+        pipeline.query("What was total revenue?")
+        assert pipeline.query("What was total revenue?").cached
@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.retrieval.reranker import Reranker, padded_batches
+
+
+# test_reranker.py
+class OverlapBackend:
+    """Scores a passage by how many query words it contains; records every call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def score(self, query, passages):
+        self.calls.append(len(passages))
+        words = set(query.lower().split())
+        return [float(len(words & set(p.lower().split()))) for p in passages]
+
+
+candidates = [{"text": f"chunk {i} " + "revenue " * (i % 4), "chunk_id": f"c{i}"} for i in range(20)]
+
+
+def test_rerank_orders_by_score_and_caches():
+    backend = OverlapBackend()
+    reranker = Reranker(backend, cache_size=100, round_size=8, early_stop=False)
+    top = reranker.rerank("revenue chunk 3", candidates, top_k=3)
+    assert [c["chunk_id"] for c in top] == ["c3", "c1", "c2"]
+    assert top[0]["rerank_score"] == 3.0
+    assert sum(backend.calls) == 20
+    assert reranker.rerank("revenue chunk 3", candidates, top_k=3) == top
+    assert sum(backend.calls) == 20 and reranker.hits == 20
+
+
+def test_cache_evicts_least_recently_used():
+    backend = OverlapBackend()
+    reranker = Reranker(backend, cache_size=5, round_size=5, early_stop=False)
+    reranker.rerank("revenue", candidates[:5], top_k=2)
+    reranker.rerank("revenue", candidates[5:7], top_k=2)
+    reranker.rerank("revenue", candidates[2:5], top_k=2)
+    assert backend.calls == [5, 2]
+
+
+def test_early_stop_when_top_k_is_stable():
+    backend = OverlapBackend()
+    ranked = sorted(candidates, key=lambda c: -c["text"].count("revenue"))  # retrieval already did well
+    reranker = Reranker(backend, cache_size=0, round_size=5, early_stop=True)
+    top = reranker.rerank("revenue", ranked, top_k=3)
+    assert backend.calls == [5, 5]
+    assert [c["rerank_score"] for c in top] == [1.0, 1.0, 1.0]
+
+
+def test_padded_batches_respect_token_budget():
+    lengths = [120, 30, 500, 40, 35, 260, 90]
+    batches = padded_batches(lengths, max_tokens=512)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 512
+    assert batches[0] == [1, 4, 3, 6]
+
+
+def test_pipeline_answers_without_reranker_when_backend_cannot_load(monkeypatch):
+    from app.config import settings
+    from app.retrieval import rag_pipeline, reranker
+
+    def unavailable(*args, **kwargs):
+        raise OSError("cross-encoder/ms-marco-MiniLM-L-6-v2 is not cached and the hub is unreachable")
+
+    monkeypatch.setattr(settings, "rerank_backend", "local")
+    monkeypatch.setattr(settings, "answer_cache_size", 0)
+    monkeypatch.setattr(reranker, "LocalCrossEncoderBackend", unavailable)
+    pipeline = rag_pipeline.RAGPipeline(vector_store=object(), bm25_store=object(), llm=object())
+    assert pipeline.reranker is None
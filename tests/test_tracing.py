@@ -0,0 +1,80 @@
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI
+
+from app import tracing
+from app.config import settings
+from app.retrieval.rag_pipeline import RAGPipeline
+from tests.fake_openai import FakeOpenAIServer
+
+
+# test_tracing.py
+def enable(monkeypatch, export_path=""):
+    tracer = tracing.Tracer(enabled=True, export_path=export_path)
+    monkeypatch.setattr(tracing, "tracer", tracer)
+    return tracer
+
+
+def test_disabled_tracing_records_nothing():
+    assert not tracing.tracer.enabled
+    with tracing.span("stage") as span:
+        pass
+    assert span.breakdown() is None
+    assert tracing.traced("stage")(lambda x: x + 1)(1) == 2
+    fn = lambda: None
+    assert tracing.bind(fn) is fn
+    assert "rag_stage_duration_seconds_count" not in tracing.prometheus_text()
+
+
+def test_spans_nest_across_threads_into_one_trace(tmp_path, monkeypatch):
+    tracer = enable(monkeypatch, str(tmp_path / "traces.jsonl"))
+    leg = tracing.traced("leg")(lambda: None)
+    with ThreadPoolExecutor(2) as pool, tracing.span("root", top_k=5) as root:
+        for future in [pool.submit(tracing.bind(leg)) for _ in range(2)]:
+            future.result()
+        try:
+            with tracing.span("fails"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    assert set(root.breakdown()) == {"root", "leg", "fails"}
+
+    request = json.loads((tmp_path / "traces.jsonl").read_text())
+    assert request == tracer.recent[-1]
+    spans = {s["name"]: s for s in request["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+    assert len(request["resourceSpans"][0]["scopeSpans"][0]["spans"]) == 4
+    assert {s["traceId"] for s in spans.values()} == {root.trace_id}
+    assert spans["leg"]["parentSpanId"] == spans["fails"]["parentSpanId"] == root.span_id
+    assert spans["root"]["attributes"] == [{"key": "top_k", "value": {"intValue": "5"}}]
+    assert spans["fails"]["status"] == {"code": 2, "message": "ValueError: boom"}
+
+    text = tracing.prometheus_text()
+    assert 'rag_stage_duration_seconds_count{stage="leg"} 2' in text
+    assert 'rag_stage_duration_seconds_bucket{stage="root",le="+Inf"} 1' in text
+    assert 'rag_stage_duration_seconds_sum{stage="root"}' in text
+    assert 'rag_stage_errors_total{stage="fails"} 1' in text
+
+
+def test_query_carries_per_stage_timings(monkeypatch):
+    class FixedRetriever:
+        @tracing.traced("HybridRetriever.search")
+        def search(self, query, top_k=5, doc_filter=None):
+            return [{"text": "Total revenue was $1.2 billion", "section_title": "Results", "page_number": 3}]
+
+    monkeypatch.setattr(settings, "rerank_backend", "none")
+    monkeypatch.setattr(settings, "answer_cache_size", 0)
+    with FakeOpenAIServer(answer="$1.2 billion [Source 1].") as server:
+        pipeline = RAGPipeline(vector_store=object(), bm25_store=object(),
+                               llm=OpenAI(api_key="test", base_url=server.url, max_retries=0))
+        pipeline.retriever = FixedRetriever()
+        assert pipeline.query("What was total revenue?").timings is None
+        enable(monkeypatch)
+        response = pipeline.query("What was total revenue?")
+    assert set(response.timings) == {"RAGPipeline.query", "HybridRetriever.search", "ContextPacker.pack",
+                                     "LLM.completion"}
+    assert response.timings["RAGPipeline.query"] >= response.timings["LLM.completion"] > 0
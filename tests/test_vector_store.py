@@ -0,0 +1,157 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+from app.config import settings
+from app.ingestion.chunker import Chunk, make_chunk_id
+from app.retrieval.chunk_store import ChunkStore, chunk_key
+from app.retrieval.vector_store import VectorStore
+from tests.fake_openai import fake_embedding
+
+
+# test_vector_store.py
+class VectorsOnly:
+    model, dimension = "fake", 16
+
+
+class RecordingClient(QdrantClient):
+    # Local mode accepts but does not keep the HNSW and quantization config, so record what was sent
+    def create_collection(self, collection_name, **kwargs):
+        self.created, self.indexes = kwargs, {}
+        return super().create_collection(collection_name, **kwargs)
+
+
+    def create_payload_index(self, collection_name, field_name, field_schema=None, **kwargs):
+        self.indexes[field_name] = field_schema
+        return super().create_payload_index(collection_name, field_name, field_schema, **kwargs)
+
+
+    def search_batch(self, collection_name, requests, **kwargs):
+        self.requests = requests
+        return super().search_batch(collection_name, requests, **kwargs)
+
+
+def make_store(monkeypatch, collection, **profile):
+    monkeypatch.setattr(settings, "collection_name", collection)
+    for key, value in profile.items():
+        monkeypatch.setattr(settings, key, value)
+    return VectorStore(client=RecordingClient(":memory:"), embedder=VectorsOnly(), chunks=ChunkStore(""))
+
+
+def hydrate(store, hits):
+    return [{**chunk, "score": score} for chunk, score in zip(store.chunks.hydrate(hits.ids), hits.scores.tolist())]
+
+
+@pytest.mark.parametrize("quantization", ["scalar", "binary", "none"])
+def test_collection_profile_and_projected_search(monkeypatch, quantization):
+    store = make_store(monkeypatch, f"profile-{quantization}", qdrant_quantization=quantization, hnsw_m=24,
+                       hnsw_ef_construct=64, hnsw_payload_m=12, qdrant_on_disk=True)
+    created = store.client.created
+    assert created["hnsw_config"].m == 24 and created["hnsw_config"].ef_construct == 64
+    assert created["hnsw_config"].payload_m == 12
+    # doc_id is the tenant key; the other filter fields are plain keyword indexes
+    indexes = store.client.indexes
+    assert indexes["doc_id"].type == "keyword" and indexes["doc_id"].is_tenant is True
+    assert indexes["section_title"] == indexes["chunk_type"] == {"type": "keyword"}
+    assert created["vectors_config"].on_disk is True
+    assert (created["quantization_config"] is None) == (quantization == "none")
+
+    texts = [f"Segment {i} revenue grew {i}%" for i in range(50)]
+    chunks = [Chunk(text=t, doc_id=f"doc-{i % 2}", chunk_index=i, page_number=1, chunk_id=make_chunk_id("doc", t),
+                    parent_section="Results of Operations") for i, t in enumerate(texts)]
+    store.upsert_embedded(chunks, [fake_embedding(t, 16).tolist() for t in texts])
+    hits = store.search_vectors([fake_embedding(texts[7], 16)], top_k=3)[0]
+    results = hydrate(store, hits)
+    assert results[0]["chunk_id"] == chunks[7].chunk_id and results[0]["text"] == texts[7]
+    # The point id is derived from the chunk_id; searches don't fetch the payload, which keeps the whole chunk
+    point = store.client.retrieve(store.collection, [int(hits.ids[0])])[0]
+    assert point.id == chunk_key(chunks[7].chunk_id) and point.payload == chunks[7].to_dict()
+    request = store.client.requests[0]
+    assert request.with_payload is False and request.params.hnsw_ef == settings.hnsw_ef
+    assert (request.params.quantization is None) == (quantization == "none")
+    filtered = store.search_vectors([fake_embedding(texts[7], 16)], 5, "doc-0")[0]
+    assert all(r["doc_id"] == "doc-0" for r in hydrate(store, filtered))
+
+    store.delete_chunks([chunks[7].chunk_id], "doc-1")
+    assert store.chunks.hydrate(hits.ids[:1]) == [None]
+    assert int(hits.ids[0]) not in store.search_vectors([fake_embedding(texts[7], 16)], top_k=3)[0].ids
+    store.delete_document("doc-0")
+    assert store.chunks.live_count == 24
+
+
+def test_lost_chunk_store_is_restored_from_point_payloads(monkeypatch):
+    from app.retrieval import vector_store
+    store = make_store(monkeypatch, "restore")
+    texts = [f"Segment {i} revenue grew {i}%" for i in range(30)]
+    chunks = [Chunk(text=t, doc_id="doc", chunk_index=i, page_number=1, chunk_id=make_chunk_id("doc", t))
+              for i, t in enumerate(texts)]
+    store.upsert_embedded(chunks, [fake_embedding(t, 16).tolist() for t in texts])
+    hits = store.search_vectors([fake_embedding(texts[3], 16)], top_k=5)[0]
+
+    vector_store._known_collections.pop(store.client)  # as in a new process
+    reopened = VectorStore(client=store.client, embedder=VectorsOnly(), chunks=ChunkStore(""))
+    assert reopened.chunks.live_count == len(chunks)
+    assert hydrate(reopened, hits) == hydrate(store, hits)
+
+
+def test_collection_of_another_vector_size_is_rejected(monkeypatch):
+    from app.retrieval import vector_store
+    store = make_store(monkeypatch, "resized")
+    vector_store._known_collections.pop(store.client)
+
+    class SmallerModel:
+        model, dimension = "smaller", 8
+    with pytest.raises(ValueError, match=r"holds vectors \[16\] but smaller writes \[8\]"):
+        VectorStore(client=store.client, embedder=SmallerModel(), chunks=ChunkStore(""))
+
+
+def test_unknown_quantization_is_rejected(monkeypatch):
+    with pytest.raises(ValueError, match="Unsupported Qdrant quantization"):
+        make_store(monkeypatch, "profile-bad", qdrant_quantization="pq")
+
+
+def test_two_stage_matryoshka_search(monkeypatch):
+    # Decaying weights put most of each vector's mass in its leading dimensions, as Matryoshka training does
+    weights = 1 / np.arange(1, 17)
+    embed = lambda t: (fake_embedding(t, 16) * weights).tolist()
+    store = make_store(monkeypatch, "profile-matryoshka", matryoshka_dimension=8, matryoshka_candidates=4)
+    assert set(store.client.created["vectors_config"]) == {"coarse", "full"}
+    assert store.client.created["vectors_config"]["full"].on_disk is True
+
+    texts = [f"Segment {i} revenue grew {i}%" for i in range(200)]
+    chunks = [Chunk(text=t, doc_id=f"doc-{i % 2}", chunk_index=i, page_number=1, chunk_id=make_chunk_id("doc", t))
+              for i, t in enumerate(texts)]
+    store.upsert_embedded(chunks, [embed(t) for t in texts])
+    full = np.array([embed(t) for t in texts])
+    full /= np.linalg.norm(full, axis=1, keepdims=True)
+    queries = [f"Segment {i} revenue" for i in range(20)]
+    results = [hydrate(store, hits) for hits in store.search_vectors([embed(q) for q in queries], top_k=5)]
+    for query, found in zip(queries, results):
+        # Candidates are ranked by the full vector, so the scores are exact full-dimension cosines
+        q = np.array(embed(query)) / np.linalg.norm(embed(query))
+        assert [r["score"] for r in found] == pytest.approx([float(full[r["chunk_index"]] @ q) for r in found], abs=1e-5)
+    exact = [set(np.argsort(-(full @ (np.array(embed(q)) / np.linalg.norm(embed(q)))))[:5]) for q in queries]
+    assert np.mean([len({r["chunk_index"] for r in f} & e) / 5 for f, e in zip(results, exact)]) >= 0.9
+    filtered = store.search_vectors([embed(queries[0])], 5, "doc-1")[0]
+    assert all(r["doc_id"] == "doc-1" for r in hydrate(store, filtered))
+
+
+@pytest.mark.parametrize("before, after", [(0, 8), (8, 0)])
+def test_matryoshka_switch_on_an_existing_collection_is_rejected(monkeypatch, before, after):
+    from app.retrieval import vector_store
+    store = make_store(monkeypatch, f"switch-{before}-{after}", matryoshka_dimension=before)
+    vector_store._known_collections.pop(store.client)
+    monkeypatch.setattr(settings, "matryoshka_dimension", after)
+    with pytest.raises(ValueError, match=f"MATRYOSHKA_DIMENSION is {after}"):
+        VectorStore(client=store.client, embedder=VectorsOnly(), chunks=ChunkStore(""))
+
+    # A coarse vector of another size is a layout mismatch too
+    if before:
+        monkeypatch.setattr(settings, "matryoshka_dimension", 4)
+        with pytest.raises(ValueError, match=r"holds vectors coarse\[8\] \+ full\[16\]"):
+            VectorStore(client=store.client, embedder=VectorsOnly(), chunks=ChunkStore(""))